@@ -0,0 +1,36 @@
+"""Add file_derivatives table for previews
+
+Revision ID: 002
+Revises: 001
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '002'
+down_revision = '001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'file_derivatives',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('version_id', sa.Integer(), sa.ForeignKey('file_versions.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('kind', sa.String(), nullable=False),
+        sa.Column('content', sa.LargeBinary(), nullable=True),
+        sa.Column('mime_type', sa.String(), nullable=True),
+        sa.Column('meta', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.create_index('ix_file_derivatives_id', 'file_derivatives', ['id'])
+    op.create_index('ix_file_derivatives_version_id', 'file_derivatives', ['version_id'])
+
+
+def downgrade():
+    op.drop_index('ix_file_derivatives_version_id', table_name='file_derivatives')
+    op.drop_index('ix_file_derivatives_id', table_name='file_derivatives')
+    op.drop_table('file_derivatives')
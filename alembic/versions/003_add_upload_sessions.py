@@ -0,0 +1,37 @@
+"""Add upload_sessions table for resumable uploads
+
+Revision ID: 003
+Revises: 002
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '003'
+down_revision = '002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'upload_sessions',
+        sa.Column('id', sa.String(), primary_key=True),
+        sa.Column('filename', sa.String(), nullable=False),
+        sa.Column('folder_id', sa.Integer(), sa.ForeignKey('folders.id', ondelete='CASCADE'), nullable=True),
+        sa.Column('memo', sa.Text(), nullable=True),
+        sa.Column('mime_type', sa.String(), nullable=True),
+        sa.Column('total_size', sa.BigInteger(), nullable=True),
+        sa.Column('received_size', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.Column('next_chunk', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column('expires_at', sa.DateTime(timezone=True), nullable=False),
+    )
+    op.create_index('ix_upload_sessions_expires_at', 'upload_sessions', ['expires_at'])
+
+
+def downgrade():
+    op.drop_index('ix_upload_sessions_expires_at', table_name='upload_sessions')
+    op.drop_table('upload_sessions')
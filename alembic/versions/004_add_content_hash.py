@@ -0,0 +1,24 @@
+"""Add content_hash column to file_versions
+
+Revision ID: 004
+Revises: 003
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '004'
+down_revision = '003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 既存行はNULLのまま（最新バージョンとの比較時に必要に応じて計算される）
+    op.add_column('file_versions', sa.Column('content_hash', sa.String(length=64), nullable=True))
+
+
+def downgrade():
+    op.drop_column('file_versions', 'content_hash')
@@ -0,0 +1,28 @@
+"""Add aggregate columns to folders
+
+Revision ID: 005
+Revises: 004
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '005'
+down_revision = '004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('folders', sa.Column('file_count', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('folders', sa.Column('head_bytes', sa.BigInteger(), nullable=False, server_default='0'))
+    op.add_column('folders', sa.Column('retained_bytes', sa.BigInteger(), nullable=False, server_default='0'))
+    # 既存データの集計値は repair_folder_stats.py で計算する
+
+
+def downgrade():
+    op.drop_column('folders', 'retained_bytes')
+    op.drop_column('folders', 'head_bytes')
+    op.drop_column('folders', 'file_count')
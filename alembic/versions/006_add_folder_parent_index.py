@@ -0,0 +1,24 @@
+"""Add index on folders.parent_id
+
+Revision ID: 006
+Revises: 005
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '006'
+down_revision = '005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 子フォルダの取得（遅延展開・再帰CTE）で使用
+    op.create_index('ix_folders_parent_id', 'folders', ['parent_id'])
+
+
+def downgrade():
+    op.drop_index('ix_folders_parent_id', table_name='folders')
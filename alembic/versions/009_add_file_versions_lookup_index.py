@@ -0,0 +1,36 @@
+"""Add (folder_id, filename, version) index on file_versions
+
+Revision ID: 009
+Revises: 008
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '009'
+down_revision = '008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # フォルダ内の各ファイルの最新バージョン（時点指定を含む）の検索に使用
+    # PostgreSQL では書き込みを止めないよう CONCURRENTLY で作成する（トランザクション外で実行）
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_file_versions_folder_filename_version',
+            'file_versions',
+            ['folder_id', 'filename', 'version'],
+            postgresql_concurrently=True
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_file_versions_folder_filename_version',
+            table_name='file_versions',
+            postgresql_concurrently=True
+        )
@@ -0,0 +1,36 @@
+"""Add online_migrations checkpoint table
+
+Revision ID: 010
+Revises: 009
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '010'
+down_revision = '009'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # バックフィルは online_migrate.py で実行する（このマイグレーションではテーブルのみ作成）
+    op.create_table(
+        'online_migrations',
+        sa.Column('name', sa.String(), primary_key=True),
+        sa.Column('status', sa.String(), nullable=False, server_default='pending'),
+        sa.Column('last_id', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.Column('max_id', sa.BigInteger(), nullable=True),
+        sa.Column('rows_processed', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.Column('batches', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('started_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('finished_at', sa.DateTime(timezone=True), nullable=True),
+    )
+
+
+def downgrade():
+    op.drop_table('online_migrations')
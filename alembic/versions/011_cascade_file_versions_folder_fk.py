@@ -0,0 +1,53 @@
+"""Cascade file_versions.folder_id on folder delete
+
+Revision ID: 011
+Revises: 010
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '011'
+down_revision = '010'
+branch_labels = None
+depends_on = None
+
+CONSTRAINT = 'file_versions_folder_id_fkey'
+
+
+def _is_partitioned() -> bool:
+    return bool(op.get_bind().execute(sa.text(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'file_versions'::regclass"
+    )).scalar())
+
+
+def _replace_foreign_key(ondelete: str):
+    op.drop_constraint(CONSTRAINT, 'file_versions', type_='foreignkey')
+    if _is_partitioned():
+        # パーティション分割したテーブルでは NOT VALID を指定できない
+        op.create_foreign_key(CONSTRAINT, 'file_versions', 'folders', ['folder_id'], ['id'], ondelete=ondelete)
+        return
+    # 既存行の検証で書き込みを止めないよう、NOT VALID で追加してから別途検証する
+    op.create_foreign_key(
+        CONSTRAINT, 'file_versions', 'folders', ['folder_id'], ['id'],
+        ondelete=ondelete, postgresql_not_valid=True
+    )
+    # 追加までをコミットして ACCESS EXCLUSIVE ロックを解放し、検証は別トランザクションで行う
+    # （VALIDATE は SHARE UPDATE EXCLUSIVE ロックのみのため、検証中も読み書きできる）
+    with op.get_context().autocommit_block():
+        op.execute(f"ALTER TABLE file_versions VALIDATE CONSTRAINT {CONSTRAINT}")
+
+
+def upgrade():
+    # フォルダの物理削除で、含まれるバージョンもデータベース側で削除する（ルートへ移さない）
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    _replace_foreign_key('CASCADE')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    _replace_foreign_key('SET NULL')
@@ -0,0 +1,242 @@
+"""
+アップロードのアドミッション制御
+
+アップロード系のリクエストに対して、ボディを読み込む前に次の制限を確認し、超過した場合は
+待たせずに 429 / 503（Retry-After 付き）を返す。
+  - 全体の同時アップロード数
+  - クライアントごとの同時アップロード数
+  - 受信中のバイト数の合計（Content-Length で予約。Content-Length の無いチャンク転送は既定のサイズを
+    予約し、実際の受信量が予約を超えた分はその都度加算する）
+  - クライアントごとのトークンバケットによるレート制限
+
+状態はワーカープロセスごとに持つため、制限値はワーカー1つあたりの値になる。
+各制限は 0 を指定すると無効になる。
+"""
+import json
+import os
+import re
+import time
+from typing import Dict, Optional, Tuple
+
+from .database import budget_default
+
+UPLOAD_MAX_CONCURRENT = int(os.getenv("UPLOAD_MAX_CONCURRENT", "16"))
+UPLOAD_MAX_CONCURRENT_PER_CLIENT = int(os.getenv("UPLOAD_MAX_CONCURRENT_PER_CLIENT", "4"))
+UPLOAD_MAX_BYTES_IN_FLIGHT = int(os.getenv("UPLOAD_MAX_BYTES_IN_FLIGHT", str(budget_default(1 / 4, 512, 4) * 1024 * 1024)))
+# Content-Length の無いリクエストに予約するバイト数
+UPLOAD_UNKNOWN_LENGTH_RESERVE = int(os.getenv("UPLOAD_UNKNOWN_LENGTH_RESERVE", str(16 * 1024 * 1024)))
+UPLOAD_RATE_PER_CLIENT = float(os.getenv("UPLOAD_RATE_PER_CLIENT", "5"))  # 1秒あたりのリクエスト数
+UPLOAD_RATE_BURST = int(os.getenv("UPLOAD_RATE_BURST", "20"))
+# プロキシ配下で X-Forwarded-For の先頭をクライアントとして扱う
+UPLOAD_TRUST_FORWARDED = os.getenv("UPLOAD_TRUST_FORWARDED", "0") == "1"
+
+# 制限の対象となるリクエスト
+_ADMISSION_ROUTES = [
+    ("POST", re.compile(r"^/files/upload$")),
+    ("PUT", re.compile(r"^/uploads/[^/]+/chunks/\d+$")),
+    ("POST", re.compile(r"^/uploads/[^/]+/complete$")),
+]
+
+# 使われていないバケットを掃除する件数の目安
+_MAX_IDLE_BUCKETS = 10000
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self) -> float:
+        """トークンを1つ消費する。足りない場合は消費せず、次のトークンまでの秒数を返す"""
+        now = time.monotonic()
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def is_full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.burst
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_concurrent: int = UPLOAD_MAX_CONCURRENT,
+        max_concurrent_per_client: int = UPLOAD_MAX_CONCURRENT_PER_CLIENT,
+        max_bytes_in_flight: int = UPLOAD_MAX_BYTES_IN_FLIGHT,
+        rate_per_client: float = UPLOAD_RATE_PER_CLIENT,
+        rate_burst: int = UPLOAD_RATE_BURST
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_concurrent_per_client = max_concurrent_per_client
+        self.max_bytes_in_flight = max_bytes_in_flight
+        self.rate_per_client = rate_per_client
+        self.rate_burst = rate_burst
+
+        self.in_flight = 0
+        self.bytes_in_flight = 0
+        self.per_client: Dict[str, int] = {}
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.admitted = 0
+        self.rejected: Dict[str, int] = {
+            "rate_limited": 0,
+            "client_concurrency": 0,
+            "global_concurrency": 0,
+            "bytes_in_flight": 0,
+        }
+
+    def try_acquire(self, client: str, size: int) -> Optional[Tuple[int, str, float, str]]:
+        """
+        アップロードの受け付けを判定
+
+        受け付けた場合は None、拒否した場合は (ステータス, 理由, Retry-After秒, メッセージ) を返す。
+        受け付けた場合は必ず release を呼ぶこと。
+        """
+        if self.rate_per_client > 0:
+            bucket = self.buckets.get(client)
+            if bucket is None:
+                if len(self.buckets) >= _MAX_IDLE_BUCKETS:
+                    self._prune_buckets()
+                bucket = self.buckets[client] = TokenBucket(self.rate_per_client, self.rate_burst)
+            wait = bucket.take()
+            if wait > 0:
+                self.rejected["rate_limited"] += 1
+                return 429, "rate_limited", wait, "アップロードのリクエストが多すぎます"
+
+        if self.max_concurrent_per_client and self.per_client.get(client, 0) >= self.max_concurrent_per_client:
+            self.rejected["client_concurrency"] += 1
+            return 429, "client_concurrency", 1, "同時アップロード数の上限に達しています"
+
+        if self.max_concurrent and self.in_flight >= self.max_concurrent:
+            self.rejected["global_concurrency"] += 1
+            return 503, "global_concurrency", 1, "サーバーが混雑しています"
+
+        # 予算より大きいリクエストは、他に受信中のものがない場合に限り受け付ける
+        if (
+            self.max_bytes_in_flight
+            and self.bytes_in_flight > 0
+            and self.bytes_in_flight + size > self.max_bytes_in_flight
+        ):
+            self.rejected["bytes_in_flight"] += 1
+            return 503, "bytes_in_flight", 1, "サーバーが混雑しています"
+
+        self.in_flight += 1
+        self.bytes_in_flight += size
+        self.per_client[client] = self.per_client.get(client, 0) + 1
+        self.admitted += 1
+        return None
+
+    def add_bytes(self, size: int):
+        """受け付け後に予約を超えて受信した分を加算（拒否はしない。release には合計を渡すこと）"""
+        self.bytes_in_flight += size
+
+    def release(self, client: str, size: int):
+        self.in_flight -= 1
+        self.bytes_in_flight -= size
+        remaining = self.per_client.get(client, 1) - 1
+        if remaining > 0:
+            self.per_client[client] = remaining
+        else:
+            self.per_client.pop(client, None)
+
+    def _prune_buckets(self):
+        for client in [c for c, bucket in self.buckets.items() if bucket.is_full()]:
+            del self.buckets[client]
+
+    def metrics(self) -> dict:
+        return {
+            "limits": {
+                "max_concurrent": self.max_concurrent,
+                "max_concurrent_per_client": self.max_concurrent_per_client,
+                "max_bytes_in_flight": self.max_bytes_in_flight,
+                "rate_per_client": self.rate_per_client,
+                "rate_burst": self.rate_burst,
+            },
+            "in_flight": self.in_flight,
+            "bytes_in_flight": self.bytes_in_flight,
+            "clients_in_flight": len(self.per_client),
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+        }
+
+admission = AdmissionController()
+
+def _client_key(scope) -> str:
+    if UPLOAD_TRUST_FORWARDED:
+        for name, value in scope.get("headers", []):
+            if name == b"x-forwarded-for":
+                return value.decode("latin-1").split(",")[0].strip()
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+def _content_length(scope) -> Optional[int]:
+    """Content-Length の値（無い・不正な場合は None）"""
+    for name, value in scope.get("headers", []):
+        if name == b"content-length":
+            try:
+                return max(int(value), 0)
+            except ValueError:
+                return None
+    return None
+
+class AdmissionControlMiddleware:
+    """アップロード系のリクエストにアドミッション制御をかけるASGIミドルウェア"""
+
+    def __init__(self, app, controller: AdmissionController = admission):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not any(
+            scope["method"] == method and pattern.match(scope["path"])
+            for method, pattern in _ADMISSION_ROUTES
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        client = _client_key(scope)
+        content_length = _content_length(scope)
+        size = content_length if content_length is not None else UPLOAD_UNKNOWN_LENGTH_RESERVE
+        rejection = self.controller.try_acquire(client, size)
+        if rejection is not None:
+            await self._reject(send, *rejection)
+            return
+
+        # 実際に受信したバイト数を数え、予約を超えた分は受信中のバイト数に加える
+        reserved = size
+        received = 0
+
+        async def counting_receive():
+            nonlocal reserved, received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > reserved:
+                    self.controller.add_bytes(received - reserved)
+                    reserved = received
+            return message
+
+        try:
+            await self.app(scope, counting_receive, send)
+        finally:
+            self.controller.release(client, reserved)
+
+    @staticmethod
+    async def _reject(send, status: int, reason: str, retry_after: float, detail: str):
+        body = json.dumps({"detail": detail, "reason": reason}, ensure_ascii=False).encode("utf-8")
+        headers = [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            # ボディを読まずに応答するため、接続は再利用しない
+            (b"connection", b"close"),
+        ]
+        if retry_after:
+            headers.append((b"retry-after", str(max(1, int(retry_after + 0.999))).encode()))
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,142 @@
+"""
+ファイルコンテンツのサイドカー保存（任意）
+
+BLOB_STORE_DIR を設定すると、file_versions.file_content にはコンテンツ本体の代わりに参照
+（"sidecar:sha256:<ハッシュ>"）を保存し、本体は BLOB_STORE_DIR/<先頭2文字>/<次の2文字>/<ハッシュ> の
+ファイルとして保存する。SQLite ではテーブルが小さく保たれ、VACUUM やページキャッシュの負担が減る。
+
+  - 内容のハッシュをファイル名にするため、同じ内容は1つのファイルを共有する（コピーや復元は参照の複製）
+  - BLOB_INLINE_MAX バイト以下の小さな内容は従来どおり行内に保存する
+  - 読み取りは参照・行内のどちらにも対応するため、途中から有効にしても既存の行はそのまま読める
+  - どの行からも参照されなくなったファイルは gc で削除する（書き込み中のトランザクションと
+    競合しないよう、作成または最後の参照から BLOB_GC_GRACE_SECONDS 秒以内のファイルは残す）
+"""
+import hashlib
+import os
+import re
+import time
+from pathlib import Path
+from typing import Iterable, Optional, Tuple
+
+from sqlalchemy import LargeBinary, text
+from sqlalchemy.types import TypeDecorator
+
+BLOB_STORE_DIR = os.getenv("BLOB_STORE_DIR", "")
+BLOB_INLINE_MAX = int(os.getenv("BLOB_INLINE_MAX", "4096"))  # バイト
+BLOB_FSYNC = os.getenv("BLOB_FSYNC", "1") == "1"
+BLOB_GC_GRACE_SECONDS = int(os.getenv("BLOB_GC_GRACE_SECONDS", "3600"))
+
+REF_MARKER = b"sidecar:sha256:"
+REF_LENGTH = len(REF_MARKER) + 64
+_HASH_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+def is_ref(value) -> bool:
+    return (
+        value is not None
+        and len(value) == REF_LENGTH
+        and bytes(value[:len(REF_MARKER)]) == REF_MARKER
+    )
+
+def ref_hash(value) -> Optional[str]:
+    """参照であれば内容の SHA-256（参照に含まれる）、行内の内容であれば None"""
+    if not is_ref(value):
+        return None
+    return bytes(value[len(REF_MARKER):]).decode("ascii")
+
+class SidecarBlobStore:
+    def __init__(self, directory: str = BLOB_STORE_DIR, inline_max: int = BLOB_INLINE_MAX, fsync: bool = BLOB_FSYNC):
+        self.enabled = bool(directory)
+        self.directory = Path(directory or "blob_store")
+        self.inline_max = inline_max
+        self.fsync = fsync
+
+    def path_for(self, content_hash: str) -> Path:
+        return self.directory / content_hash[:2] / content_hash[2:4] / content_hash
+
+    def ref_path(self, value) -> Optional[Path]:
+        """参照であれば本体のパス、行内の内容であれば None"""
+        content_hash = ref_hash(value)
+        return self.path_for(content_hash) if content_hash else None
+
+    def put(self, content: bytes) -> bytes:
+        """内容を保存し、行に書き込む値（参照または行内の内容）を返す"""
+        # 参照と同じ形の内容は、読み取り時に区別できないため必ずファイルにする
+        if not self.enabled or (len(content) <= self.inline_max and not is_ref(content)):
+            return content
+
+        content_hash = hashlib.sha256(content).hexdigest()
+        path = self.path_for(content_hash)
+        try:
+            # 既存のファイルを再び参照する場合も更新時刻を新しくし、走査中の gc の猶予期間に含める
+            os.utime(path)
+        except FileNotFoundError:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f"{content_hash}.{os.getpid()}.{time.monotonic_ns()}.tmp")
+            with open(tmp_path, "wb") as f:
+                f.write(content)
+                if self.fsync:
+                    # コミット後に本体が失われないよう、参照を書き込む前にディスクへ反映する
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        return REF_MARKER + content_hash.encode("ascii")
+
+    def load(self, value) -> bytes:
+        """行の値から内容を取り出す"""
+        path = self.ref_path(value)
+        if path is None:
+            return value
+        with open(path, "rb") as f:
+            return f.read()
+
+    def iter_files(self) -> Iterable[Path]:
+        if not self.directory.exists():
+            return
+        for path in self.directory.glob("*/*/*"):
+            if path.is_file():
+                yield path
+
+    def gc(self, connection, grace_seconds: int = BLOB_GC_GRACE_SECONDS) -> Tuple[int, int]:
+        """どの行からも参照されていないファイルを削除し、(件数, バイト数) を返す"""
+        referenced = set()
+        # 型変換を通さずに参照の値だけを読む
+        for (value,) in connection.execute(text(
+            "SELECT DISTINCT file_content FROM file_versions WHERE length(file_content) = :length"
+        ), {"length": REF_LENGTH}):
+            if is_ref(value):
+                referenced.add(ref_hash(value))
+
+        cutoff = time.time() - grace_seconds
+        removed = 0
+        removed_bytes = 0
+        for path in list(self.iter_files()):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            if stat.st_mtime > cutoff:
+                continue
+            if path.name.endswith(".tmp") or (_HASH_PATTERN.match(path.name) and path.name not in referenced):
+                path.unlink(missing_ok=True)
+                removed += 1
+                removed_bytes += stat.st_size
+        print(f"Blob GC removed {removed} files ({removed_bytes} bytes), {len(referenced)} referenced")
+        return removed, removed_bytes
+
+blob_store = SidecarBlobStore()
+
+class SidecarBlob(TypeDecorator):
+    """サイドカー保存に対応したバイナリ列（無効時は LargeBinary と同じ）"""
+
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return blob_store.put(bytes(value))
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return blob_store.load(value)
@@ -0,0 +1,161 @@
+"""
+変更フィード
+
+ファイルのバージョン作成・削除やフォルダ作成と同じトランザクションで change_log に記録し、
+クライアントはカーソル（change_log.id）以降の差分だけを取得する。
+ライブ更新はイベントバスで起こされた Server-Sent Events のストリームで配信する。
+
+PostgreSQLではシーケンスの採番順とコミット順が一致しないため、記録時にトランザクション単位の
+アドバイザリロックを取り、採番からコミットまでを直列化する（カーソルが未コミットの変更を追い越さない）。
+"""
+import asyncio
+import os
+import threading
+from typing import List, Optional, Set, Tuple
+
+from sqlalchemy import event, func, insert, text
+from sqlalchemy.orm import Session
+
+from .database import ChangeLog, SessionLocal, DATABASE_URL
+from .events import bus
+
+CHANGES_PAGE_SIZE = int(os.getenv("CHANGES_PAGE_SIZE", "500"))
+# SSEのキープアライブ間隔（秒）
+CHANGES_KEEPALIVE_SECONDS = float(os.getenv("CHANGES_KEEPALIVE_SECONDS", "15"))
+
+# change_log の採番を直列化するアドバイザリロックのキー
+CHANGE_LOG_LOCK_KEY = 0x66766D01
+_use_advisory_lock = DATABASE_URL.startswith("postgresql")
+
+def _as_dict(entry) -> dict:
+    return {
+        "cursor": entry.id,
+        "entity": entry.entity,
+        "operation": entry.operation,
+        "folder_id": entry.folder_id,
+        "filename": entry.filename,
+        "version": entry.version,
+        "file_size": entry.file_size,
+        "created_at": entry.created_at.isoformat() if entry.created_at else None
+    }
+
+class ChangeLogService:
+    @staticmethod
+    def record(
+        db: Session,
+        entity: str,
+        operation: str,
+        folder_id: Optional[int] = None,
+        filename: Optional[str] = None,
+        version: Optional[int] = None,
+        file_size: Optional[int] = None
+    ):
+        """
+        変更を記録（コミットは呼び出し側のトランザクションで行う）
+
+        ロックはコミットまで保持されるため、コミット直前に呼ぶこと。
+        """
+        ChangeLogService._lock(db)
+        db.add(ChangeLog(
+            entity=entity,
+            operation=operation,
+            folder_id=folder_id,
+            filename=filename,
+            version=version,
+            file_size=file_size
+        ))
+
+    @staticmethod
+    def record_many(db: Session, entries: List[dict]):
+        """
+        複数の変更を1回の INSERT でまとめて記録（フォルダ単位の一括削除など）
+
+        各要素は record と同じキー（entity, operation と任意の folder_id, filename, version, file_size）。
+        record と同じくコミット直前に呼ぶこと。
+        """
+        if not entries:
+            return
+        ChangeLogService._lock(db)
+        db.execute(insert(ChangeLog), [
+            {
+                "entity": entry["entity"],
+                "operation": entry["operation"],
+                "folder_id": entry.get("folder_id"),
+                "filename": entry.get("filename"),
+                "version": entry.get("version"),
+                "file_size": entry.get("file_size")
+            }
+            for entry in entries
+        ])
+
+    @staticmethod
+    def _lock(db: Session):
+        if _use_advisory_lock and not db.info.get("change_log_locked"):
+            db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": CHANGE_LOG_LOCK_KEY})
+            db.info["change_log_locked"] = True
+
+    @staticmethod
+    def latest_cursor(db: Session) -> int:
+        return db.query(func.max(ChangeLog.id)).scalar() or 0
+
+    @staticmethod
+    def get_changes(db: Session, since: int, limit: int = CHANGES_PAGE_SIZE) -> Tuple[List[dict], int, bool]:
+        """
+        カーソル以降の変更を取得
+
+        戻り値は (変更のリスト, 次のカーソル, 続きがあるか)。
+        """
+        entries = db.query(ChangeLog).filter(ChangeLog.id > since).order_by(ChangeLog.id).limit(limit + 1).all()
+        has_more = len(entries) > limit
+        entries = entries[:limit]
+
+        changes = [_as_dict(entry) for entry in entries]
+        cursor = entries[-1].id if entries else since
+        return changes, cursor, has_more
+
+def read_changes(since: Optional[int]) -> Tuple[List[dict], int, bool]:
+    """SSEストリーム用：独自のセッションで変更を取得（since が None の場合は現在の末尾から）"""
+    db = SessionLocal()
+    try:
+        if since is None:
+            return [], ChangeLogService.latest_cursor(db), False
+        return ChangeLogService.get_changes(db, since)
+    finally:
+        db.close()
+
+class ChangeNotifier:
+    """SSEストリームの待機を、変更イベントの受信時に起こす"""
+
+    def __init__(self):
+        self._waiters: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+        self._lock = threading.Lock()
+
+    def register(self) -> Tuple[asyncio.AbstractEventLoop, asyncio.Event]:
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._waiters.add(waiter)
+        return waiter
+
+    def unregister(self, waiter):
+        with self._lock:
+            self._waiters.discard(waiter)
+
+    def notify(self, change=None):
+        # イベントバスはリクエストやリスナーのスレッドから呼ぶため、ループ側で set する
+        with self._lock:
+            waiters = list(self._waiters)
+        for loop, wakeup in waiters:
+            try:
+                loop.call_soon_threadsafe(wakeup.set)
+            except RuntimeError:
+                # ループが既に閉じられている
+                self.unregister((loop, wakeup))
+
+notifier = ChangeNotifier()
+bus.subscribe(notifier.notify)
+
+@event.listens_for(SessionLocal, "after_commit")
+@event.listens_for(SessionLocal, "after_rollback")
+def _release_change_log_lock(session: Session):
+    # トランザクション終了でアドバイザリロックは解放される
+    session.info.pop("change_log_locked", None)
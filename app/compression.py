@@ -0,0 +1,211 @@
+"""
+レスポンスの圧縮（Content-Encoding のネゴシエーション）
+
+Accept-Encoding に応じて、JSON やテキストなど圧縮の効く種類のレスポンスを圧縮して返す。
+  - gzip は常に利用可能。brotli / zstandard パッケージがインストールされていれば br / zstd も使う
+  - 画像・動画・ZIP・gzip など圧縮済みの形式や SSE（text/event-stream）は圧縮しない
+  - すでに Content-Encoding が付いているレスポンスは再圧縮せずそのまま返す
+  - Range 応答（206）や小さなレスポンスは圧縮しない
+"""
+import os
+import re
+import zlib
+from typing import List, Optional
+
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "1") == "1"
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))  # バイト
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+COMPRESSION_ZSTD_LEVEL = int(os.getenv("COMPRESSION_ZSTD_LEVEL", "3"))
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 圧縮の効く種類（text/* は text/event-stream を除く）
+_COMPRESSIBLE_TYPES = {
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "application/xml",
+    "application/x-yaml",
+    "application/sql",
+    "application/csv",
+    "image/svg+xml",
+}
+_UNCOMPRESSIBLE_TYPES = {"text/event-stream"}
+
+def is_compressible(media_type: str) -> bool:
+    media_type = (media_type or "").split(";")[0].strip().lower()
+    if not media_type or media_type in _UNCOMPRESSIBLE_TYPES:
+        return False
+    return (
+        media_type.startswith("text/")
+        or media_type in _COMPRESSIBLE_TYPES
+        or media_type.endswith("+json")
+        or media_type.endswith("+xml")
+    )
+
+class _GzipEncoder:
+    def __init__(self):
+        # wbits=31 で gzip ヘッダ付きの出力にする
+        self._compressor = zlib.compressobj(COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+class _BrotliEncoder:
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=COMPRESSION_BROTLI_QUALITY)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+class _ZstdEncoder:
+    def __init__(self):
+        self._compressor = zstandard.ZstdCompressor(level=COMPRESSION_ZSTD_LEVEL).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+# 同じ q 値の場合の優先順
+_ENCODERS = {"gzip": _GzipEncoder}
+if brotli is not None:
+    _ENCODERS["br"] = _BrotliEncoder
+if zstandard is not None:
+    _ENCODERS["zstd"] = _ZstdEncoder
+_PREFERENCE = ["zstd", "br", "gzip"]
+
+_ACCEPT_ENCODING_ITEM = re.compile(r"^\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?\s*$")
+
+def available_encodings() -> List[str]:
+    return [name for name in _PREFERENCE if name in _ENCODERS]
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Accept-Encoding から使用する圧縮方式を選ぶ。圧縮しない場合は None"""
+    weights = {}
+    for item in (accept_encoding or "").split(","):
+        match = _ACCEPT_ENCODING_ITEM.match(item)
+        if not match:
+            continue
+        try:
+            weights[match.group(1).lower()] = float(match.group(2)) if match.group(2) else 1.0
+        except ValueError:
+            continue
+
+    best, best_q = None, 0.0
+    for name in available_encodings():
+        q = weights.get(name, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+def _header(headers, name: bytes) -> Optional[bytes]:
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+class CompressionMiddleware:
+    """Accept-Encoding に応じてレスポンスを圧縮するASGIミドルウェア"""
+
+    def __init__(self, app, min_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.min_size = min_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate_encoding((_header(scope.get("headers", []), b"accept-encoding") or b"").decode("latin-1"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        state = {"start": None, "encoder": None, "passthrough": False, "flush_each": False}
+
+        async def send_compressed(message):
+            if message["type"] == "http.response.start":
+                # ボディの最初の部分を見るまで送信を保留する
+                state["start"] = message
+                return
+
+            if message["type"] != "http.response.body" or state["passthrough"]:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if state["encoder"] is None:
+                start = state["start"]
+                headers = list(start.get("headers", []))
+                length = _header(headers, b"content-length")
+                media_type = (_header(headers, b"content-type") or b"").decode("latin-1")
+                if (
+                    start["status"] in (204, 206, 304)
+                    or _header(headers, b"content-encoding") is not None
+                    or _header(headers, b"content-range") is not None
+                    or not is_compressible(media_type)
+                    or (length is not None and int(length) < self.min_size)
+                    or (length is None and not more_body and len(body) < self.min_size)
+                ):
+                    # 圧縮済みや対象外の内容はそのまま流す
+                    state["passthrough"] = True
+                    await send(start)
+                    await send(message)
+                    return
+
+                headers = [(k, v) for k, v in headers if k.lower() not in (b"content-length", b"etag")]
+                etag = _header(start.get("headers", []), b"etag")
+                if etag is not None:
+                    # 圧縮後はバイト列が変わるため弱いETagにする
+                    headers.append((b"etag", etag if etag.startswith(b"W/") else b"W/" + etag))
+                headers.append((b"content-encoding", encoding.encode()))
+                vary = _header(headers, b"vary")
+                if vary is None:
+                    headers.append((b"vary", b"Accept-Encoding"))
+                elif b"accept-encoding" not in vary.lower():
+                    headers = [(k, v) for k, v in headers if k.lower() != b"vary"]
+                    headers.append((b"vary", vary + b", Accept-Encoding"))
+
+                state["encoder"] = _ENCODERS[encoding]()
+                # NDJSON のような逐次送信は、送られた単位ごとにクライアントへ届ける
+                state["flush_each"] = media_type.startswith("application/x-ndjson")
+                await send({**start, "headers": headers})
+
+            encoder = state["encoder"]
+            chunk = encoder.compress(body)
+            if not more_body:
+                chunk += encoder.finish()
+            elif state["flush_each"]:
+                chunk += encoder.flush()
+            if chunk or not more_body:
+                await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
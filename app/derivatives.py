@@ -0,0 +1,207 @@
+"""
+プレビュー用の派生データ（サムネイル、テキスト冒頭、PDFページ数）の生成とキャッシュ
+
+生成はワーカープールで行い、結果はバージョンIDごとに file_derivatives テーブルへ保存する。
+バージョンは不変なので、一度生成した派生データは対応するバージョンが削除されるまで有効。
+"""
+import asyncio
+import json
+import os
+import re
+from io import BytesIO
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy.orm import Session
+
+from .database import SessionLocal, FileDerivative, FileVersion
+from .workers import get_process_pool
+
+THUMBNAIL_SIZE = int(os.getenv("PREVIEW_THUMBNAIL_SIZE", "256"))
+PREVIEW_TEXT_LINES = int(os.getenv("PREVIEW_TEXT_LINES", "50"))
+# テキストプレビューのために読む最大バイト数
+PREVIEW_TEXT_MAX_BYTES = 64 * 1024
+
+TEXT_MIME_TYPES = {
+    "application/json",
+    "application/xml",
+    "application/javascript",
+    "application/x-yaml",
+    "application/yaml",
+    "application/x-sh",
+    "application/sql",
+    "application/toml",
+}
+
+def is_text_mime(mime_type: Optional[str]) -> bool:
+    """テキストとして扱えるMIMEタイプかどうか"""
+    if not mime_type:
+        return False
+    mime_type = mime_type.split(";")[0].strip().lower()
+    return (
+        mime_type.startswith("text/")
+        or mime_type in TEXT_MIME_TYPES
+        or mime_type.endswith("+json")
+        or mime_type.endswith("+xml")
+    )
+
+def is_previewable(mime_type: Optional[str]) -> bool:
+    """プレビュー生成の対象かどうか"""
+    if not mime_type:
+        return False
+    return (
+        mime_type.startswith("image/")
+        or mime_type == "application/pdf"
+        or is_text_mime(mime_type)
+    )
+
+_PDF_PAGE_PATTERN = re.compile(rb"/Type\s*/Page(?![a-zA-Z])")
+# 圧縮されたオブジェクトストリーム（中のページオブジェクトは正規表現では数えられない）
+_PDF_OBJECT_STREAM = b"/ObjStm"
+
+def generate_derivatives(content: bytes, mime_type: Optional[str]) -> List[dict]:
+    """
+    派生データを生成（ワーカープロセスで実行される）
+
+    戻り値は kind, content, mime_type, meta を持つ辞書のリスト。
+    生成できなかった場合は kind='none' を1件返す。
+    """
+    mime_type = (mime_type or "").split(";")[0].strip().lower()
+    try:
+        if mime_type.startswith("image/"):
+            try:
+                from PIL import Image
+            except ImportError:
+                return [{"kind": "none", "content": None, "mime_type": None,
+                         "meta": {"reason": "Pillow がインストールされていません"}}]
+
+            with Image.open(BytesIO(content)) as image:
+                width, height = image.size
+                image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+                if image.mode not in ("RGB", "RGBA"):
+                    image = image.convert("RGBA")
+                output = BytesIO()
+                image.save(output, format="PNG", optimize=True)
+            return [{
+                "kind": "thumbnail",
+                "content": output.getvalue(),
+                "mime_type": "image/png",
+                "meta": {"width": width, "height": height},
+            }]
+
+        if mime_type == "application/pdf":
+            # ページオブジェクトを数える簡易的な方法のため、オブジェクトストリームを含む PDF では
+            # 一部（またはすべて）のページを数えられない。その場合は概数として返し、0件なら不明とする
+            page_count = len(_PDF_PAGE_PATTERN.findall(content))
+            approximate = _PDF_OBJECT_STREAM in content
+            return [{"kind": "pdf", "content": None, "mime_type": None,
+                     "meta": {
+                         "page_count": None if approximate and page_count == 0 else page_count,
+                         "page_count_approximate": approximate
+                     }}]
+
+        if is_text_mime(mime_type):
+            head = content[:PREVIEW_TEXT_MAX_BYTES].decode("utf-8", errors="replace")
+            lines = head.splitlines()
+            preview_lines = lines[:PREVIEW_TEXT_LINES]
+            truncated = len(lines) > PREVIEW_TEXT_LINES or len(content) > PREVIEW_TEXT_MAX_BYTES
+            return [{
+                "kind": "text",
+                "content": "\n".join(preview_lines).encode("utf-8"),
+                "mime_type": "text/plain; charset=utf-8",
+                "meta": {"lines": len(preview_lines), "truncated": truncated},
+            }]
+
+    except Exception as e:
+        return [{"kind": "none", "content": None, "mime_type": None,
+                 "meta": {"reason": f"プレビュー生成に失敗: {str(e)}"}}]
+
+    return [{"kind": "none", "content": None, "mime_type": None,
+             "meta": {"reason": "プレビュー対象外のファイル形式です"}}]
+
+class DerivativeService:
+    # 生成中のバージョンID（重複して生成しないため）
+    _in_flight: Set[int] = set()
+    # 生成タスクへの参照（GCされないように保持）
+    _tasks: Set[asyncio.Task] = set()
+
+    @staticmethod
+    def schedule(version_id: int, file_content: bytes, mime_type: Optional[str]) -> bool:
+        """派生データの生成をバックグラウンドで開始"""
+        if not is_previewable(mime_type) or not file_content:
+            return False
+        if version_id in DerivativeService._in_flight:
+            return True
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+
+        DerivativeService._in_flight.add(version_id)
+        task = loop.create_task(
+            DerivativeService._generate_and_store(version_id, file_content, mime_type)
+        )
+        DerivativeService._tasks.add(task)
+        task.add_done_callback(DerivativeService._tasks.discard)
+        return True
+
+    @staticmethod
+    async def _generate_and_store(version_id: int, file_content: bytes, mime_type: Optional[str]):
+        try:
+            loop = asyncio.get_running_loop()
+            derivatives = await loop.run_in_executor(
+                get_process_pool(), generate_derivatives, file_content, mime_type
+            )
+            DerivativeService.store(version_id, derivatives)
+        except Exception as e:
+            print(f"Derivative generation failed for version {version_id}: {str(e)}")
+        finally:
+            DerivativeService._in_flight.discard(version_id)
+
+    @staticmethod
+    def store(version_id: int, derivatives: List[dict]):
+        """生成結果を保存（バージョンが既に削除されていれば何もしない）"""
+        db = SessionLocal()
+        try:
+            if db.query(FileVersion.id).filter(FileVersion.id == version_id).first() is None:
+                print(f"Version {version_id} was pruned before derivatives were stored")
+                return
+
+            db.query(FileDerivative).filter(FileDerivative.version_id == version_id).delete(
+                synchronize_session=False
+            )
+            for derivative in derivatives:
+                db.add(FileDerivative(
+                    version_id=version_id,
+                    kind=derivative["kind"],
+                    content=derivative["content"],
+                    mime_type=derivative["mime_type"],
+                    meta=json.dumps(derivative["meta"], ensure_ascii=False),
+                ))
+            db.commit()
+            print(f"Stored {len(derivatives)} derivatives for version {version_id}")
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    @staticmethod
+    def is_pending(version_id: int) -> bool:
+        return version_id in DerivativeService._in_flight
+
+    @staticmethod
+    def get_derivatives(db: Session, version_id: int) -> Dict[str, FileDerivative]:
+        derivatives = db.query(FileDerivative).filter(
+            FileDerivative.version_id == version_id
+        ).all()
+        return {d.kind: d for d in derivatives}
+
+    @staticmethod
+    def evict(db: Session, version_ids: List[int]) -> int:
+        """削除されるバージョンの派生データを削除（コミットは呼び出し側で行う）"""
+        if not version_ids:
+            return 0
+        return db.query(FileDerivative).filter(
+            FileDerivative.version_id.in_(version_ids)
+        ).delete(synchronize_session=False)
@@ -0,0 +1,162 @@
+"""
+バージョン間の差分計算
+
+テキスト系のMIMEタイプは行単位の差分、それ以外はサイズやハッシュの概要を返す。
+バージョンは不変なので、結果は (バージョンID, バージョンID) ごとにキャッシュする。
+"""
+import asyncio
+import difflib
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from .database import FileVersion, budget_default
+from .derivatives import is_text_mime
+from .workers import get_process_pool
+
+# 合計サイズがこの値を超える差分はワーカープールで計算（それ以下はスレッドプールで計算）
+DIFF_POOL_THRESHOLD = int(os.getenv("DIFF_POOL_THRESHOLD", str(256 * 1024)))
+DIFF_CACHE_SIZE = int(os.getenv("DIFF_CACHE_SIZE", str(budget_default(1 / 8, 256, 16))))  # 件数
+
+DIFF_FORMATS = ("unified", "lines")
+
+def _decode(content: bytes) -> Optional[str]:
+    try:
+        return content.decode("utf-8")
+    except UnicodeDecodeError:
+        return None
+
+def _binary_summary(from_content: bytes, to_content: bytes) -> dict:
+    from_hash = hashlib.sha256(from_content).hexdigest()
+    to_hash = hashlib.sha256(to_content).hexdigest()
+    return {
+        "type": "binary",
+        "identical": from_hash == to_hash,
+        "from_size": len(from_content),
+        "to_size": len(to_content),
+        "size_delta": len(to_content) - len(from_content),
+        "from_sha256": from_hash,
+        "to_sha256": to_hash,
+    }
+
+def compute_diff(
+    from_content: bytes,
+    to_content: bytes,
+    text_like: bool,
+    diff_format: str = "unified",
+    context: int = 3,
+    from_label: str = "from",
+    to_label: str = "to"
+) -> dict:
+    """差分を計算（ワーカープロセスで実行される）"""
+    from_text = _decode(from_content) if text_like else None
+    to_text = _decode(to_content) if text_like else None
+
+    if from_text is None or to_text is None:
+        return _binary_summary(from_content, to_content)
+
+    from_lines = from_text.splitlines(keepends=True)
+    to_lines = to_text.splitlines(keepends=True)
+
+    if diff_format == "lines":
+        matcher = difflib.SequenceMatcher(None, from_lines, to_lines, autojunk=False)
+        changes = []
+        added = removed = 0
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == "equal":
+                continue
+            removed += i2 - i1
+            added += j2 - j1
+            changes.append({
+                "op": tag,
+                "from_start": i1 + 1,
+                "from_lines": [line.rstrip("\r\n") for line in from_lines[i1:i2]],
+                "to_start": j1 + 1,
+                "to_lines": [line.rstrip("\r\n") for line in to_lines[j1:j2]],
+            })
+        return {
+            "type": "text",
+            "format": "lines",
+            "identical": not changes,
+            "added": added,
+            "removed": removed,
+            "changes": changes,
+        }
+
+    added = removed = 0
+    diff_lines = []
+    for line in difflib.unified_diff(from_lines, to_lines, fromfile=from_label, tofile=to_label, n=context):
+        if line.startswith("+") and not line.startswith("+++"):
+            added += 1
+        elif line.startswith("-") and not line.startswith("---"):
+            removed += 1
+        diff_lines.append(line if line.endswith("\n") else line + "\n")
+
+    return {
+        "type": "text",
+        "format": "unified",
+        "identical": not diff_lines,
+        "added": added,
+        "removed": removed,
+        "diff": "".join(diff_lines),
+    }
+
+class DiffService:
+    _cache: "OrderedDict[Tuple, dict]" = OrderedDict()
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _cache_get(key: Tuple) -> Optional[dict]:
+        with DiffService._lock:
+            result = DiffService._cache.get(key)
+            if result is not None:
+                DiffService._cache.move_to_end(key)
+            return result
+
+    @staticmethod
+    def _cache_put(key: Tuple, result: dict):
+        with DiffService._lock:
+            DiffService._cache[key] = result
+            DiffService._cache.move_to_end(key)
+            while len(DiffService._cache) > DIFF_CACHE_SIZE:
+                DiffService._cache.popitem(last=False)
+
+    @staticmethod
+    async def diff_versions(
+        from_version: FileVersion,
+        to_version: FileVersion,
+        diff_format: str = "unified",
+        context: int = 3
+    ) -> dict:
+        """2つのバージョンの差分を取得（キャッシュがあれば再利用）"""
+        key = (from_version.id, to_version.id, diff_format, context)
+        cached = DiffService._cache_get(key)
+        if cached is not None:
+            return cached
+
+        from_content = from_version.file_content or b""
+        to_content = to_version.file_content or b""
+        text_like = is_text_mime(from_version.mime_type) and is_text_mime(to_version.mime_type)
+        args = (
+            from_content,
+            to_content,
+            text_like,
+            diff_format,
+            context,
+            f"{from_version.filename} (v{from_version.version})",
+            f"{to_version.filename} (v{to_version.version})",
+        )
+
+        if len(from_content) + len(to_content) > DIFF_POOL_THRESHOLD:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(get_process_pool(), compute_diff, *args)
+        else:
+            # 小さな差分でも difflib はイベントループを止めるため、スレッドで計算する
+            result = await run_in_threadpool(compute_diff, *args)
+
+        DiffService._cache_put(key, result)
+        return result
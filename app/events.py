@@ -0,0 +1,181 @@
+"""
+ワーカー間のキャッシュ無効化バス
+
+書き込み処理は型付きの変更イベントを発行し、キャッシュは購読して自身を無効化する。
+PostgreSQLでは LISTEN/NOTIFY を使い、NOTIFY をトランザクション内で発行するため
+コミットされた変更のイベントだけが他のワーカーへ届く。
+SQLiteやテストではプロセス内で直接配信する。SQLiteで複数ワーカーを起動した場合に備え、
+PRAGMA data_version を定期的に確認し、他の接続（他のワーカー）のコミットを検知したら
+全キャッシュを破棄する（EVENT_POLL_SECONDS の間は古い内容が返りうる）。
+"""
+import json
+import os
+import select
+import socket
+import threading
+from typing import Callable, List, Optional, Set
+
+from pydantic import BaseModel
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+from .database import engine, SessionLocal, DATABASE_URL
+
+CHANNEL = os.getenv("CHANGE_EVENT_CHANNEL", "fvm_changes")
+# SQLiteで他のワーカーのコミットを確認する間隔（秒）
+EVENT_POLL_SECONDS = float(os.getenv("EVENT_POLL_SECONDS", "1"))
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# イベント種別
+FOLDER_CREATED = "folder_created"
+FOLDER_UPDATED = "folder_updated"
+FOLDER_DELETED = "folder_deleted"
+FILE_VERSION_SAVED = "file_version_saved"
+VERSIONS_PRUNED = "versions_pruned"
+STATS_RECOMPUTED = "stats_recomputed"
+# 通知を取りこぼした可能性がある場合（全キャッシュを破棄する）
+RESYNC = "resync"
+
+class ChangeEvent(BaseModel):
+    type: str
+    folder_id: Optional[int] = None
+    filename: Optional[str] = None
+    version: Optional[int] = None
+    operation: Optional[str] = None
+    origin: str = WORKER_ID
+
+Subscriber = Callable[[ChangeEvent], None]
+
+class EventBus:
+    def __init__(self):
+        self._subscribers: List[tuple] = []
+        self._lock = threading.Lock()
+        self._listener: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.use_notify = DATABASE_URL.startswith("postgresql")
+        self.use_poll = DATABASE_URL.startswith("sqlite")
+
+    def subscribe(self, handler: Subscriber, types: Optional[Set[str]] = None):
+        """イベントを購読（types を指定するとその種別のみ）"""
+        with self._lock:
+            self._subscribers.append((handler, types))
+
+    def publish(self, db: Session, change: ChangeEvent):
+        """イベントを発行（セッションのコミット時に配信される）"""
+        db.info.setdefault("pending_events", []).append(change)
+
+    def dispatch(self, change: ChangeEvent):
+        """購読者へ配信"""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for handler, types in subscribers:
+            if types is not None and change.type not in types:
+                continue
+            try:
+                handler(change)
+            except Exception as e:
+                print(f"Event subscriber failed for {change.type}: {str(e)}")
+
+    def start(self):
+        """他のワーカーからの通知の受信を開始（PostgreSQLは LISTEN、SQLiteはポーリング）"""
+        if self._listener is not None:
+            return
+        if self.use_notify:
+            target, name = self._listen, "event-bus-listener"
+        elif self.use_poll:
+            target, name = self._poll, "event-bus-poller"
+        else:
+            return
+        self._stop.clear()
+        self._listener = threading.Thread(target=target, name=name, daemon=True)
+        self._listener.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._listener is not None:
+            self._listener.join(timeout=2)
+            self._listener = None
+
+    def _listen(self):
+        while not self._stop.is_set():
+            connection = None
+            try:
+                connection = engine.raw_connection()
+                dbapi_connection = connection.dbapi_connection
+                dbapi_connection.autocommit = True
+                cursor = dbapi_connection.cursor()
+                cursor.execute(f'LISTEN "{CHANNEL}"')
+                print(f"Event bus listening on channel {CHANNEL}")
+
+                while not self._stop.is_set():
+                    if select.select([dbapi_connection], [], [], 1.0) == ([], [], []):
+                        continue
+                    dbapi_connection.poll()
+                    while dbapi_connection.notifies:
+                        notify = dbapi_connection.notifies.pop(0)
+                        change = ChangeEvent(**json.loads(notify.payload))
+                        # 自ワーカーのイベントはコミット時に配信済み
+                        if change.origin != WORKER_ID:
+                            self.dispatch(change)
+            except Exception as e:
+                print(f"Event bus listener error: {str(e)}")
+                # 接続が切れた間の通知は届かないため、キャッシュを破棄してから再接続
+                self.dispatch(ChangeEvent(type=RESYNC))
+                self._stop.wait(1.0)
+            finally:
+                if connection is not None:
+                    try:
+                        connection.invalidate()
+                    except Exception:
+                        pass
+
+    def _poll(self):
+        # data_version は同じ接続で読む限り、他の接続がコミットするたびに変わる
+        # （どの変更かは分からないため全キャッシュを破棄する。自ワーカーの変更でも破棄されるが害はない）
+        while not self._stop.is_set():
+            connection = None
+            try:
+                connection = engine.raw_connection()
+                cursor = connection.dbapi_connection.cursor()
+                cursor.execute("PRAGMA data_version")
+                last = cursor.fetchone()[0]
+                print(f"Event bus polling SQLite data_version every {EVENT_POLL_SECONDS}s")
+
+                while not self._stop.wait(EVENT_POLL_SECONDS):
+                    cursor.execute("PRAGMA data_version")
+                    current = cursor.fetchone()[0]
+                    if current != last:
+                        last = current
+                        self.dispatch(ChangeEvent(type=RESYNC))
+            except Exception as e:
+                print(f"Event bus poller error: {str(e)}")
+                self.dispatch(ChangeEvent(type=RESYNC))
+                self._stop.wait(1.0)
+            finally:
+                if connection is not None:
+                    try:
+                        connection.invalidate()
+                    except Exception:
+                        pass
+
+bus = EventBus()
+
+@event.listens_for(SessionLocal, "before_commit")
+def _notify_before_commit(session: Session):
+    # NOTIFY はトランザクションに含まれ、コミットされた場合にのみ配信される
+    if not bus.use_notify:
+        return
+    for change in session.info.get("pending_events", []):
+        session.execute(
+            text("SELECT pg_notify(:channel, :payload)"),
+            {"channel": CHANNEL, "payload": json.dumps(change.dict())}
+        )
+
+@event.listens_for(SessionLocal, "after_commit")
+def _dispatch_after_commit(session: Session):
+    for change in session.info.pop("pending_events", []):
+        bus.dispatch(change)
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _discard_after_rollback(session: Session):
+    session.info.pop("pending_events", None)
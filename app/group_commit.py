@@ -0,0 +1,170 @@
+"""
+小さなアップロードのグループコミット
+
+有効にすると、同時に届いた小さなアップロードをキューに入れ、専用の書き込みスレッドが
+数ミリ秒ごと（または一定件数ごと）にまとめて FileVersionService.bulk_save_versions で
+1トランザクションとして保存する。各呼び出し元には自分のファイルの結果（バージョン番号など）が返る。
+
+  - 書き込みは1スレッドで順に行い、まとめた中では到着順に採番するため、
+    同じファイルへの連続したアップロードの順序と保持数の整理は通常の保存と同じになる
+  - まとめた保存が失敗した場合は1件ずつ保存し直し、失敗した呼び出し元にだけ例外を返す
+  - コミット後、作成されたバージョンのプレビュー用派生データの生成を通常の保存と同じく予約する
+  - 状態はワーカープロセスごとに持つ
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from .database import SessionLocal, IS_SQLITE
+from .services import FileVersionService
+from .derivatives import DerivativeService
+
+# SQLite では書き込みが1つずつしか進まないため、既定で有効にして書き込みを1スレッドに集約する
+GROUP_COMMIT_ENABLED = os.getenv("GROUP_COMMIT_ENABLED", "1" if IS_SQLITE else "0") == "1"
+GROUP_COMMIT_WINDOW_MS = float(os.getenv("GROUP_COMMIT_WINDOW_MS", "5"))
+GROUP_COMMIT_MAX_ITEMS = int(os.getenv("GROUP_COMMIT_MAX_ITEMS", "200"))
+# これより大きいファイルは通常どおり個別に保存する
+GROUP_COMMIT_MAX_FILE_SIZE = int(os.getenv("GROUP_COMMIT_MAX_FILE_SIZE", str(256 * 1024)))
+
+class GroupCommitWriter:
+    def __init__(
+        self,
+        window_ms: float = GROUP_COMMIT_WINDOW_MS,
+        max_items: int = GROUP_COMMIT_MAX_ITEMS,
+        max_file_size: int = GROUP_COMMIT_MAX_FILE_SIZE,
+        session_factory=SessionLocal
+    ):
+        self.window = window_ms / 1000
+        self.max_items = max_items
+        self.max_file_size = max_file_size
+        self.session_factory = session_factory
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+        self.batches = 0
+        self.items = 0
+        self.fallbacks = 0
+        self.largest_batch = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def accepts(self, size: int) -> bool:
+        return self.running and size <= self.max_file_size
+
+    def start(self):
+        if self.running:
+            return
+        self._queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="group-commit")
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        print(f"Group commit writer started (window={self.window * 1000:.1f}ms, max_items={self.max_items})")
+
+    async def stop(self):
+        """キューに残っているものを書き込んでから停止"""
+        if not self.running:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._executor.shutdown(wait=True)
+        self._task = None
+        self._queue = None
+        self._executor = None
+
+    async def submit(self, item: dict) -> dict:
+        """
+        バージョンの保存を依頼し、コミット後の結果を返す
+
+        item は bulk_save_versions の要素と同じ形式。
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            entry = await self._queue.get()
+            if entry is None:
+                break
+            batch = [entry]
+
+            # 最初の1件から window の間、または max_items 件に達するまで集める
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_items:
+                try:
+                    entry = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        entry = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if entry is None:
+                    stopping = True
+                    break
+                batch.append(entry)
+
+            outcomes = await loop.run_in_executor(self._executor, self._write, [item for item, _ in batch])
+            for (item, future), outcome in zip(batch, outcomes):
+                if isinstance(outcome, dict) and outcome["created"] and outcome["operation"] != "delete":
+                    DerivativeService.schedule(outcome["id"], item["file_content"], item.get("mime_type"))
+                if future.done():
+                    # 呼び出し元が切断済み（保存自体は完了している）
+                    continue
+                if isinstance(outcome, Exception):
+                    future.set_exception(outcome)
+                else:
+                    future.set_result(outcome)
+
+    def _write(self, items: List[dict]) -> list:
+        """書き込みスレッドで実行。items と同じ順に結果または例外を返す"""
+        self.batches += 1
+        self.items += len(items)
+        self.largest_batch = max(self.largest_batch, len(items))
+
+        db = self.session_factory()
+        try:
+            try:
+                return FileVersionService.bulk_save_versions(db, items)
+            except Exception as e:
+                db.rollback()
+                if len(items) == 1:
+                    return [e]
+                print(f"Group commit of {len(items)} items failed, retrying individually: {e}")
+
+            # 1件ずつ保存し直し、失敗の影響をその呼び出し元だけに留める
+            self.fallbacks += 1
+            outcomes = []
+            for item in items:
+                try:
+                    outcomes.extend(FileVersionService.bulk_save_versions(db, [item]))
+                except Exception as e:
+                    db.rollback()
+                    outcomes.append(e)
+            return outcomes
+        finally:
+            db.close()
+
+    def metrics(self) -> dict:
+        return {
+            "enabled": self.running,
+            "window_ms": self.window * 1000,
+            "max_items": self.max_items,
+            "max_file_size": self.max_file_size,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "batches": self.batches,
+            "items": self.items,
+            "largest_batch": self.largest_batch,
+            "average_batch": round(self.items / self.batches, 2) if self.batches else 0,
+            "fallbacks": self.fallbacks,
+        }
+
+group_writer = GroupCommitWriter()
@@ -0,0 +1,427 @@
+"""
+バックグラウンドジョブ
+
+重い処理（フォルダのZIP作成、保持数の一括適用、集計値の再計算、サイドカーの整理など）は jobs テーブルに登録し、
+リクエストの外でワーカーが実行する。ワーカーはAPIプロセス内のスレッドとして動かすか
+（JOBS_IN_PROCESS=1、デフォルト）、別プロセスとして起動する（python -m app.jobs）。
+
+ジョブの取得は status='queued' を条件にした UPDATE で行うため、複数のワーカーが同じジョブを
+実行することはない。ジョブ種別ごとの同時実行数は、実行中のジョブ数をデータベースで数えて制限する
+（複数ワーカーが同時に取得した場合はわずかに超えることがある）。
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from .database import SessionLocal, Job, Folder, FileVersion
+from .blobstore import blob_store, BLOB_GC_GRACE_SECONDS
+from .events import WORKER_ID
+from .services import FileVersionService, FolderService, RETAINED_VERSIONS
+
+JOB_WORKER_THREADS = int(os.getenv("JOB_WORKER_THREADS", "2"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "2"))
+# この秒数ハートビートのない実行中ジョブは、ワーカーが停止したものとして再実行する
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", "300"))
+JOB_RESULT_DIR = Path(os.getenv("JOB_RESULT_DIR", "job_results"))
+JOBS_IN_PROCESS = os.getenv("JOBS_IN_PROCESS", "1") == "1"
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATUSES = (SUCCEEDED, FAILED, CANCELLED)
+
+# 進捗をデータベースへ書き込む最小間隔（秒）
+_PROGRESS_INTERVAL = 0.5
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+class JobCancelled(Exception):
+    """ジョブのキャンセルが要求された"""
+
+class JobContext:
+    """ハンドラーに渡される実行中ジョブの情報（進捗の報告とキャンセルの確認）"""
+
+    def __init__(self, job_id: int, params: dict):
+        self.job_id = job_id
+        self.params = params
+        self._last_update = 0.0
+
+    def progress(self, fraction: float, message: Optional[str] = None, force: bool = False):
+        """進捗を報告（キャンセルが要求されていれば JobCancelled を送出）"""
+        now = time.monotonic()
+        if not force and now - self._last_update < _PROGRESS_INTERVAL:
+            return
+        self._last_update = now
+
+        db = SessionLocal()
+        try:
+            values = {Job.progress: max(0.0, min(fraction, 1.0)), Job.heartbeat_at: _utcnow()}
+            if message is not None:
+                values[Job.message] = message
+            db.query(Job).filter(Job.id == self.job_id).update(values, synchronize_session=False)
+            db.commit()
+            cancel_requested = db.query(Job.cancel_requested).filter(Job.id == self.job_id).scalar()
+        finally:
+            db.close()
+
+        if cancel_requested:
+            raise JobCancelled()
+
+# ジョブ種別 -> (ハンドラー, 同時実行数)
+Handler = Callable[[JobContext, Session], Optional[dict]]
+_handlers: Dict[str, Tuple[Handler, int]] = {}
+
+def job_handler(job_type: str, concurrency: int = 1):
+    """ジョブ種別のハンドラーを登録するデコレーター"""
+    def register(handler: Handler) -> Handler:
+        _handlers[job_type] = (handler, int(os.getenv(f"JOB_CONCURRENCY_{job_type.upper()}", str(concurrency))))
+        return handler
+    return register
+
+def job_types() -> Dict[str, int]:
+    return {job_type: concurrency for job_type, (_, concurrency) in _handlers.items()}
+
+class JobService:
+    @staticmethod
+    def enqueue(db: Session, job_type: str, params: Optional[dict] = None) -> Job:
+        if job_type not in _handlers:
+            raise ValueError(f"不明なジョブ種別です: {job_type}")
+
+        job = Job(type=job_type, status=QUEUED, params=json.dumps(params or {}), progress=0.0)
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+        print(f"Job queued: id={job.id}, type={job_type}")
+
+        runner.wake()
+        return job
+
+    @staticmethod
+    def get_job(db: Session, job_id: int) -> Optional[Job]:
+        return db.query(Job).get(job_id)
+
+    @staticmethod
+    def list_jobs(db: Session, status: Optional[str] = None, job_type: Optional[str] = None, limit: int = 50) -> List[Job]:
+        query = db.query(Job)
+        if status is not None:
+            query = query.filter(Job.status == status)
+        if job_type is not None:
+            query = query.filter(Job.type == job_type)
+        return query.order_by(Job.id.desc()).limit(limit).all()
+
+    @staticmethod
+    def cancel(db: Session, job: Job) -> Job:
+        """待機中のジョブはすぐにキャンセル、実行中のジョブには中断を要求する"""
+        if job.status == QUEUED:
+            cancelled = db.query(Job).filter(Job.id == job.id, Job.status == QUEUED).update({
+                Job.status: CANCELLED,
+                Job.finished_at: _utcnow()
+            }, synchronize_session=False)
+            if not cancelled:
+                # 取得された直後だった場合は実行中として扱う
+                db.query(Job).filter(Job.id == job.id).update(
+                    {Job.cancel_requested: True}, synchronize_session=False
+                )
+        elif job.status == RUNNING:
+            db.query(Job).filter(Job.id == job.id).update({Job.cancel_requested: True}, synchronize_session=False)
+        db.commit()
+        db.refresh(job)
+        return job
+
+    @staticmethod
+    def to_dict(job: Job) -> dict:
+        return {
+            "id": job.id,
+            "type": job.type,
+            "status": job.status,
+            "params": json.loads(job.params) if job.params else {},
+            "progress": job.progress,
+            "message": job.message,
+            "result": json.loads(job.result) if job.result else None,
+            "error": job.error,
+            "cancel_requested": job.cancel_requested,
+            "created_at": job.created_at,
+            "started_at": job.started_at,
+            "finished_at": job.finished_at
+        }
+
+class JobRunner:
+    """jobs テーブルをポーリングしてジョブを実行するワーカー"""
+
+    def __init__(self, threads: int = JOB_WORKER_THREADS):
+        self.threads = threads
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._active = 0
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="job")
+        self._thread = threading.Thread(target=self._loop, name="job-runner", daemon=True)
+        self._thread.start()
+        print(f"Job runner started: {self.threads} threads, types={job_types()}")
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        if self._executor is not None:
+            # 実行中のジョブは中断されたものとして、他のワーカーが後で再実行する
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def wake(self):
+        self._wakeup.set()
+
+    def run_forever(self):
+        self.start()
+        try:
+            while self._thread is not None and self._thread.is_alive():
+                self._thread.join(timeout=1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def _loop(self):
+        last_maintenance = 0.0
+        while not self._stop.is_set():
+            try:
+                if time.monotonic() - last_maintenance > min(JOB_STALE_SECONDS / 3, 30):
+                    self._maintenance()
+                    last_maintenance = time.monotonic()
+
+                while self._free_slots() > 0 and not self._stop.is_set():
+                    claimed = self._claim_next()
+                    if claimed is None:
+                        break
+                    with self._lock:
+                        self._active += 1
+                    self._executor.submit(self._execute, *claimed)
+            except Exception as e:
+                print(f"Job runner error: {str(e)}")
+
+            self._wakeup.wait(JOB_POLL_SECONDS)
+            self._wakeup.clear()
+
+    def _free_slots(self) -> int:
+        with self._lock:
+            return self.threads - self._active
+
+    def _maintenance(self):
+        db = SessionLocal()
+        try:
+            now = _utcnow()
+            # 自分が実行中のジョブのハートビート
+            db.query(Job).filter(Job.status == RUNNING, Job.worker_id == WORKER_ID).update(
+                {Job.heartbeat_at: now}, synchronize_session=False
+            )
+            # 停止したワーカーのジョブを待機中に戻す
+            requeued = db.query(Job).filter(
+                Job.status == RUNNING,
+                Job.heartbeat_at < now - timedelta(seconds=JOB_STALE_SECONDS)
+            ).update({Job.status: QUEUED, Job.worker_id: None}, synchronize_session=False)
+            db.commit()
+            if requeued:
+                print(f"Requeued {requeued} stale jobs")
+        finally:
+            db.close()
+
+    def _claim_next(self) -> Optional[Tuple[int, str, dict]]:
+        db = SessionLocal()
+        try:
+            running = dict(
+                db.query(Job.type, func.count(Job.id)).filter(Job.status == RUNNING).group_by(Job.type).all()
+            )
+            eligible = [t for t, (_, limit) in _handlers.items() if running.get(t, 0) < limit]
+            if not eligible:
+                return None
+
+            candidates = db.query(Job.id, Job.type, Job.params).filter(
+                Job.status == QUEUED,
+                Job.type.in_(eligible)
+            ).order_by(Job.id).limit(10).all()
+
+            for candidate in candidates:
+                now = _utcnow()
+                claimed = db.query(Job).filter(Job.id == candidate.id, Job.status == QUEUED).update({
+                    Job.status: RUNNING,
+                    Job.worker_id: WORKER_ID,
+                    Job.started_at: now,
+                    Job.heartbeat_at: now
+                }, synchronize_session=False)
+                db.commit()
+                if claimed:
+                    return candidate.id, candidate.type, json.loads(candidate.params or "{}")
+            return None
+        finally:
+            db.close()
+
+    def _execute(self, job_id: int, job_type: str, params: dict):
+        handler, _ = _handlers[job_type]
+        context = JobContext(job_id, params)
+        db = SessionLocal()
+        started = time.monotonic()
+        print(f"Job started: id={job_id}, type={job_type}")
+
+        try:
+            context.progress(0.0, force=True)
+            result = handler(context, db)
+            values = {
+                Job.status: SUCCEEDED,
+                Job.progress: 1.0,
+                Job.result: json.dumps(result or {}, ensure_ascii=False)
+            }
+        except JobCancelled:
+            db.rollback()
+            values = {Job.status: CANCELLED, Job.message: "キャンセルされました"}
+        except Exception as e:
+            db.rollback()
+            print(f"Job failed: id={job_id}, type={job_type}: {str(e)}")
+            values = {Job.status: FAILED, Job.error: str(e)}
+        finally:
+            with self._lock:
+                self._active -= 1
+            self.wake()
+
+        try:
+            values[Job.finished_at] = _utcnow()
+            db.query(Job).filter(Job.id == job_id).update(values, synchronize_session=False)
+            db.commit()
+            print(f"Job finished: id={job_id}, type={job_type}, status={values[Job.status]}, {time.monotonic() - started:.1f}s")
+        finally:
+            db.close()
+
+runner = JobRunner()
+
+# ---- ハンドラー ----
+
+def _folder_paths(db: Session, folder_id: Optional[int], include_subfolders: bool) -> Dict[Optional[int], str]:
+    """対象フォルダのIDからZIP内の相対パスへの対応（階層ごとに1クエリ）"""
+    paths: Dict[Optional[int], str] = {folder_id: ""}
+    frontier = [folder_id]
+    while include_subfolders and frontier:
+        parent_ids = [f for f in frontier if f is not None]
+        query = db.query(Folder.id, Folder.name, Folder.parent_id)
+        if None in frontier:
+            query = query.filter((Folder.parent_id.in_(parent_ids)) | (Folder.parent_id.is_(None)))
+        else:
+            query = query.filter(Folder.parent_id.in_(parent_ids))
+        children = query.all()
+        frontier = []
+        for child in children:
+            paths[child.id] = f"{paths[child.parent_id]}{child.name}/"
+            frontier.append(child.id)
+    return paths
+
+@job_handler("folder_zip", concurrency=2)
+def folder_zip(context: JobContext, db: Session) -> dict:
+    """
+    フォルダ（サブフォルダを含む）の最新版をZIPにまとめる
+
+    params: folder_id（省略時はルート）, include_subfolders（デフォルト true）,
+            as_of（ISO 8601。指定するとその時点のスナップショット）
+    コンテンツは1ファイルずつ読み込んで書き出すため、メモリ使用量はファイル1つ分。
+    """
+    folder_id = context.params.get("folder_id")
+    include_subfolders = context.params.get("include_subfolders", True)
+    as_of = datetime.fromisoformat(context.params["as_of"]) if context.params.get("as_of") else None
+
+    if folder_id is not None and not db.query(Folder.id).filter(Folder.id == folder_id).first():
+        raise ValueError(f"フォルダID {folder_id} が見つかりません")
+
+    paths = _folder_paths(db, folder_id, include_subfolders)
+    folder_ids = [f for f in paths if f is not None]
+
+    # 各ファイルの最新バージョン（as_of 指定時はその時点。削除済みを除く）
+    folder_filter = FileVersion.folder_id.in_(folder_ids)
+    if None in paths:
+        folder_filter = folder_filter | FileVersion.folder_id.is_(None)
+    latest = FileVersionService.latest_version_ids(db, folder_filter, as_of)
+    entries = db.query(FileVersion.id, FileVersion.filename, FileVersion.folder_id, FileVersion.file_size).join(
+        latest, (FileVersion.filename == latest.c.filename) & (FileVersion.id == latest.c.version_id)
+    ).filter(FileVersion.operation != "delete").order_by(FileVersion.folder_id, FileVersion.filename).all()
+
+    JOB_RESULT_DIR.mkdir(parents=True, exist_ok=True)
+    path = JOB_RESULT_DIR / f"job_{context.job_id}.zip"
+    tmp_path = path.with_suffix(".zip.tmp")
+    total_bytes = sum(entry.file_size or 0 for entry in entries)
+    written_bytes = 0
+
+    try:
+        with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            for index, entry in enumerate(entries):
+                content = db.query(FileVersion.file_content).filter(
+                    FileVersion.filename == entry.filename,
+                    FileVersion.id == entry.id
+                ).scalar() or b""
+                archive.writestr(f"{paths[entry.folder_id]}{entry.filename}", content)
+                written_bytes += len(content)
+                context.progress(
+                    written_bytes / total_bytes if total_bytes else (index + 1) / len(entries),
+                    f"{index + 1}/{len(entries)} ファイル"
+                )
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+    folder_name = db.query(Folder.name).filter(Folder.id == folder_id).scalar() if folder_id is not None else "root"
+    return {
+        "path": str(path),
+        "filename": f"{folder_name}.zip",
+        "media_type": "application/zip",
+        "files": len(entries),
+        "bytes": written_bytes,
+        "as_of": context.params.get("as_of"),
+        "size": path.stat().st_size
+    }
+
+@job_handler("retention_sweep", concurrency=1)
+def retention_sweep(context: JobContext, db: Session) -> dict:
+    """保持数（RETAINED_VERSIONS）を超えて残っているバージョンを全ファイルについて削除"""
+    keys = db.query(FileVersion.filename, FileVersion.folder_id).group_by(
+        FileVersion.filename, FileVersion.folder_id
+    ).having(func.count(FileVersion.id) > RETAINED_VERSIONS).all()
+
+    for index, key in enumerate(keys):
+        asyncio.run(FileVersionService.cleanup_old_versions(db, key.filename, key.folder_id))
+        context.progress((index + 1) / len(keys), f"{index + 1}/{len(keys)} ファイル")
+
+    return {"files": len(keys)}
+
+@job_handler("rebuild_folder_stats", concurrency=1)
+def rebuild_folder_stats(context: JobContext, db: Session) -> dict:
+    """全フォルダの集計値を再計算"""
+    return {"folders": FolderService.recompute_stats(db)}
+
+@job_handler("blob_gc", concurrency=1)
+def blob_gc(context: JobContext, db: Session) -> dict:
+    """どのバージョンからも参照されなくなったサイドカーのファイルを削除"""
+    grace_seconds = int(context.params.get("grace_seconds", BLOB_GC_GRACE_SECONDS))
+    removed, removed_bytes = blob_store.gc(db.connection(), grace_seconds)
+    return {"files": removed, "bytes": removed_bytes}
+
+if __name__ == "__main__":
+    # APIとは別プロセスのワーカーとして起動する（JOBS_IN_PROCESS=0 と組み合わせる）
+    runner.run_forever()
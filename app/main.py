@@ -1,34 +1,131 @@
-from fastapi import FastAPI, File, UploadFile, Form, Depends, HTTPException, Query
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi import FastAPI, File, UploadFile, Form, Depends, HTTPException, Query, Request, Header
+from fastapi.responses import StreamingResponse, JSONResponse, Response, FileResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from typing import Optional, List
+from typing import Optional, List, Dict
 import os
+import json
+import asyncio
+import threading
 from pathlib import Path
-from io import BytesIO
-
-from .database import get_db, create_tables, FileVersion, Folder
-from .services import FileVersionService, FolderService
-from .schemas import Folder as FolderSchema
+from datetime import datetime
+
+from .database import (
+    get_db, get_read_db, create_tables, FileVersion, Folder,
+    READ_REPLICA_URL, mark_primary_sticky, is_replica_session, engine, read_engine
+)
+from .services import FileVersionService, FolderService, FileConflictError, FolderCycleError, VERSION_BATCH_MAX_FILES
+from .schemas import Folder as FolderSchema, FolderNode, JobCreate, VersionBatchRequest
+from .derivatives import DerivativeService, is_previewable
+from .diffs import DiffService, DIFF_FORMATS
+from .workers import shutdown_pools
+from .uploads import UploadSessionService, UploadOffsetMismatch, UploadSizeError, UploadBusyError
+from .events import bus
+from .admission import AdmissionControlMiddleware, admission
+from .compression import CompressionMiddleware, COMPRESSION_ENABLED
+from .group_commit import group_writer, GROUP_COMMIT_ENABLED
+from .blobstore import blob_store
+from .profiling import ProfilerMiddleware, install_sql_hooks, is_authorized, store as profile_store, PROFILER_ENABLED
+from .jobs import JobService, runner as job_runner, job_types, JOBS_IN_PROCESS, SUCCEEDED
+from .changes import ChangeLogService, notifier, read_changes, CHANGES_KEEPALIVE_SECONDS
+from .streaming import ndjson_lines, wants_ndjson, NDJSON_MEDIA_TYPE
 
 app = FastAPI(title="File Version Manager", version="1.0.0")
 
-# 起動時にテーブル作成
-create_tables()
+# テーブル作成はワーカー起動時には行わない（複数ワーカーがDDLで競合するため）
+# 事前に `python -m app.database` または alembic で作成しておく
+
+# フォルダツリーのキャッシュ（フォルダやファイルの変更イベントで無効化）
+_folder_tree_cache: Dict[str, List[FolderSchema]] = {}
+# 無効化のたびに進める世代番号。読み込み中に無効化された結果を保存しないために使う
+# （イベントは受信スレッドから届くためロックで保護する）
+_folder_tree_generation = 0
+_folder_tree_lock = threading.Lock()
+
+def _invalidate_folder_tree(change):
+    global _folder_tree_generation
+    with _folder_tree_lock:
+        _folder_tree_generation += 1
+        _folder_tree_cache.clear()
+
+bus.subscribe(_invalidate_folder_tree)
 
 # 静的ファイルの配信設定
 if Path("static").exists():
     app.mount("/static", StaticFiles(directory="static"), name="static")
 
+# アップロード系リクエストの同時実行数・受信バイト数・レートを制限
+app.add_middleware(AdmissionControlMiddleware)
+
+# Accept-Encoding に応じてJSONやテキストのレスポンスを圧縮
+if COMPRESSION_ENABLED:
+    app.add_middleware(CompressionMiddleware)
+
+# 指定されたリクエストのプロファイル（関数ごとの時間とSQL）を記録。無効時は何も組み込まない
+if PROFILER_ENABLED:
+    install_sql_hooks(engine, read_engine)
+    app.add_middleware(ProfilerMiddleware)
+
+@app.middleware("http")
+async def primary_stickiness(request: Request, call_next):
+    # レプリカ使用時、書き込みに成功したクライアントはしばらくプライマリから読む
+    response = await call_next(request)
+    if READ_REPLICA_URL and request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400:
+        mark_primary_sticky(response)
+    return response
+
+@app.on_event("startup")
+async def startup():
+    bus.start()
+    if JOBS_IN_PROCESS:
+        job_runner.start()
+    if GROUP_COMMIT_ENABLED:
+        group_writer.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await group_writer.stop()
+    bus.stop()
+    job_runner.stop()
+    shutdown_pools()
+
 @app.get("/")
 async def root():
     return {"message": "File Version Manager API"}
 
+def _unchanged_response(version) -> dict:
+    return {
+        "message": f"ファイル '{version.filename}' は最新バージョンと同一のため更新されませんでした",
+        "filename": version.filename,
+        "version": version.version,
+        "memo": version.memo,
+        "operation": "unchanged",
+        "unchanged": True,
+        "folder_id": version.folder_id
+    }
+
+@app.post("/files/precheck")
+async def precheck_upload(
+    filename: str = Form(...),
+    size: int = Form(..., ge=0),
+    sha256: str = Form(..., min_length=64, max_length=64),
+    folder_id: Optional[int] = Form(None),
+    db: Session = Depends(get_db)
+):
+    """アップロード前の事前確認（最新バージョンと同一内容なら本体の送信は不要）"""
+    identical = FileVersionService.get_identical_head(db, filename, sha256, size, folder_id)
+    if identical:
+        return {"status": "unchanged", **_unchanged_response(identical)}
+
+    return {"status": "upload_required", "filename": filename, "folder_id": folder_id}
+
 @app.post("/files/upload")
 async def upload_file(
     file: UploadFile = File(...),
     memo: Optional[str] = Form(None),
     folder_id: Optional[int] = Form(None),
+    force: bool = Form(False, description="同一内容でも新しいバージョンを作成する"),
     db: Session = Depends(get_db)
 ):
     """ファイルをアップロード（新規作成または更新）"""
@@ -43,13 +140,42 @@ async def upload_file(
                 print(f"Folder with ID {folder_id} not found")
                 raise HTTPException(status_code=404, detail=f"フォルダID {folder_id} が見つかりません")
 
-        # 既存ファイルかチェック
-        existing = db.query(FileVersion).filter(
-            FileVersion.filename == file.filename,
-            FileVersion.folder_id == folder_id
-        ).first()
+        # 最新バージョンと同一内容なら新しいバージョンを作らない
+        if not force:
+            identical = FileVersionService.get_identical_head(
+                db, file.filename, FileVersionService.compute_hash(content), len(content), folder_id
+            )
+            if identical:
+                return _unchanged_response(identical)
+
+        # 小さなファイルは他の同時アップロードとまとめて1トランザクションで保存
+        if group_writer.accepts(len(content)):
+            # 書き込み待ちの間に接続を占有しないよう、先にこのリクエストの接続を返却する
+            db.close()
+            result = await group_writer.submit({
+                "filename": file.filename,
+                "file_content": content,
+                "folder_id": folder_id,
+                "memo": memo,
+                "mime_type": file.content_type,
+                "force": force
+            })
+            if not result["created"]:
+                # 同じバッチ内の先行アップロードと同一内容だった場合
+                return _unchanged_response(
+                    FileVersionService.get_file_version(db, file.filename, result["version"], folder_id)
+                )
+            return {
+                "message": f"ファイル '{file.filename}' が正常に{result['operation']}されました",
+                "filename": file.filename,
+                "version": result["version"],
+                "memo": memo,
+                "operation": result["operation"],
+                "folder_id": folder_id
+            }
 
-        operation = "update" if existing else "create"
+        # 既存ファイルかチェック
+        operation = FileVersionService.detect_operation(db, file.filename, folder_id)
 
         version = await FileVersionService.save_file_version(
             db=db,
@@ -58,7 +184,8 @@ async def upload_file(
             memo=memo,
             operation=operation,
             folder_id=folder_id,
-            mime_type=file.content_type
+            mime_type=file.content_type,
+            force=True
         )
 
         return {
@@ -102,7 +229,8 @@ async def delete_file(
             file_content=b"",  # 削除なので空
             memo=memo or "ファイル削除",
             operation="delete",
-            folder_id=folder_id
+            folder_id=folder_id,
+            force=False
         )
 
         return {
@@ -118,6 +246,125 @@ async def delete_file(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"ファイル削除エラー: {str(e)}")
 
+def _require_folder(db: Session, folder_id: Optional[int]):
+    if folder_id is not None and not db.query(Folder.id).filter(Folder.id == folder_id).first():
+        raise HTTPException(status_code=404, detail=f"フォルダID {folder_id} が見つかりません")
+
+def _copied_response(filename: str, folder_id: Optional[int], version: int, operation: str, created: bool, message: str) -> dict:
+    return {
+        "message": message if created else f"ファイル '{filename}' は最新版と同一のため新しいバージョンは作成されませんでした",
+        "filename": filename,
+        "version": version,
+        "operation": operation,
+        "folder_id": folder_id,
+        "unchanged": not created
+    }
+
+@app.post("/files/{filename}/restore")
+async def restore_file_version(
+    filename: str,
+    version: int = Form(..., description="復元するバージョン番号"),
+    folder_id: Optional[int] = Form(None),
+    memo: Optional[str] = Form(None),
+    db: Session = Depends(get_db)
+):
+    """過去のバージョンを新しい最新版として復元（コンテンツはサーバー内でコピー）"""
+    source = FileVersionService.get_version_metadata(db, filename, folder_id, version)
+    if not source:
+        raise HTTPException(status_code=404, detail="ファイルまたはバージョンが見つかりません")
+    if source.operation == "delete":
+        raise HTTPException(status_code=400, detail="削除記録のバージョンは復元できません")
+
+    try:
+        new_id, new_version, operation, created = await FileVersionService.save_version_from(
+            db, source.id, filename, folder_id, memo or f"バージョン{version}から復元",
+            force=False, source_filename=filename
+        )
+    except ValueError:
+        # メタデータの取得後に保持数の整理などで削除された
+        raise HTTPException(status_code=404, detail="ファイルまたはバージョンが見つかりません")
+    return _copied_response(
+        filename, folder_id, new_version, operation, created,
+        f"ファイル '{filename}' のバージョン{version}をバージョン{new_version}として復元しました"
+    )
+
+@app.post("/files/{filename}/copy")
+async def copy_file(
+    filename: str,
+    target_folder_id: Optional[int] = Form(None, description="コピー先のフォルダID（省略時はルート）"),
+    folder_id: Optional[int] = Form(None, description="コピー元のフォルダID"),
+    version: Optional[int] = Form(None, description="コピーするバージョン（省略時は最新版）"),
+    new_filename: Optional[str] = Form(None, description="コピー先のファイル名（省略時は同じ名前）"),
+    memo: Optional[str] = Form(None),
+    db: Session = Depends(get_db)
+):
+    """ファイルを別のフォルダ（または別名）へコピー（コンテンツはサーバー内でコピー）"""
+    _require_folder(db, target_folder_id)
+    source = FileVersionService.get_version_metadata(db, filename, folder_id, version)
+    if not source:
+        raise HTTPException(status_code=404, detail="ファイルまたはバージョンが見つかりません")
+    if source.operation == "delete":
+        raise HTTPException(status_code=400, detail="削除されたファイルはコピーできません")
+
+    target_filename = new_filename or filename
+    try:
+        new_id, new_version, operation, created = await FileVersionService.save_version_from(
+            db, source.id, target_filename, target_folder_id, memo or f"'{filename}' からコピー",
+            force=False, source_filename=filename
+        )
+    except ValueError:
+        # メタデータの取得後に保持数の整理などで削除された
+        raise HTTPException(status_code=404, detail="ファイルまたはバージョンが見つかりません")
+    return _copied_response(
+        target_filename, target_folder_id, new_version, operation, created,
+        f"ファイル '{filename}' を '{target_filename}' にコピーしました"
+    )
+
+@app.post("/files/{filename}/move")
+async def move_file(
+    filename: str,
+    target_folder_id: Optional[int] = Form(None, description="移動先のフォルダID（省略時はルート）"),
+    folder_id: Optional[int] = Form(None, description="移動元のフォルダID"),
+    db: Session = Depends(get_db)
+):
+    """ファイルを全バージョンごと別のフォルダへ移動"""
+    _require_folder(db, target_folder_id)
+    try:
+        moved = FileVersionService.relocate_file(db, filename, folder_id, target_folder_id, filename)
+    except FileConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not moved:
+        raise HTTPException(status_code=404, detail="ファイルが見つかりません")
+
+    return {
+        "message": f"ファイル '{filename}' を移動しました",
+        "filename": filename,
+        "folder_id": target_folder_id,
+        "versions": moved
+    }
+
+@app.post("/files/{filename}/rename")
+async def rename_file(
+    filename: str,
+    new_filename: str = Form(..., description="新しいファイル名"),
+    folder_id: Optional[int] = Form(None),
+    db: Session = Depends(get_db)
+):
+    """ファイル名を変更（全バージョン）"""
+    try:
+        moved = FileVersionService.relocate_file(db, filename, folder_id, folder_id, new_filename)
+    except FileConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not moved:
+        raise HTTPException(status_code=404, detail="ファイルが見つかりません")
+
+    return {
+        "message": f"ファイル '{filename}' を '{new_filename}' に変更しました",
+        "filename": new_filename,
+        "folder_id": folder_id,
+        "versions": moved
+    }
+
 @app.post("/folders", response_model=FolderSchema)
 async def create_folder(
     name: str = Form(...),
@@ -132,17 +379,103 @@ async def create_folder(
         raise HTTPException(status_code=400, detail=f"フォルダ作成に失敗: {str(e)}")
 
 @app.get("/folders", response_model=List[FolderSchema])
-async def list_folders(db: Session = Depends(get_db)):
+async def list_folders(db: Session = Depends(get_read_db)):
     """フォルダのツリー構造を取得"""
-    folders = FolderService.get_folder_tree(db)
-    return folders  # from_attrを使用するため、変換は不要
+    cached = _folder_tree_cache.get("tree")
+    if cached is not None:
+        return cached
+
+    generation = _folder_tree_generation
+    folders = [FolderSchema.from_orm(folder) for folder in FolderService.get_folder_tree(db)]
+    # レプリカは遅延があり得るため、キャッシュにはプライマリから読んだ結果だけを入れる
+    if not is_replica_session(db):
+        with _folder_tree_lock:
+            # 読み込み中に無効化された場合は古い可能性があるため保存しない
+            if generation == _folder_tree_generation:
+                _folder_tree_cache["tree"] = folders
+    return folders
+
+def _stream_all_files(request: Request, folder_id: Optional[int], as_of: Optional[datetime]):
+    # 応答の送信中もセッションを保持するため、依存関係とは別にセッションを開く
+    sessions = get_read_db(request)
+    db = next(sessions)
+    try:
+        yield from ndjson_lines(FileVersionService.iter_all_files(db, folder_id, as_of))
+    finally:
+        sessions.close()
+
+@app.get("/folders/children", response_model=List[FolderNode])
+async def list_root_folder_children(
+    depth: int = Query(1, ge=1, le=10, description="取得する階層の深さ"),
+    db: Session = Depends(get_read_db)
+):
+    """ルート直下のフォルダを depth 階層分だけ取得（遅延展開用）"""
+    return FolderService.get_folder_children(db, None, depth)
+
+@app.get("/folders/{folder_id}/children", response_model=List[FolderNode])
+async def list_folder_children(
+    folder_id: int,
+    depth: int = Query(1, ge=1, le=10, description="取得する階層の深さ"),
+    db: Session = Depends(get_read_db)
+):
+    """指定フォルダの子フォルダを depth 階層分だけ取得（遅延展開用）"""
+    if not db.query(Folder.id).filter(Folder.id == folder_id).first():
+        raise HTTPException(status_code=404, detail=f"フォルダID {folder_id} が見つかりません")
+    return FolderService.get_folder_children(db, folder_id, depth)
+
+@app.delete("/folders/{folder_id}")
+async def delete_folder(
+    folder_id: int,
+    physical: bool = Query(False, description="true の場合はフォルダと全バージョンを物理削除（復元不可）"),
+    memo: Optional[str] = Query(None, description="削除記録のメモ（論理削除時）"),
+    db: Session = Depends(get_db)
+):
+    """
+    フォルダ以下を削除
+
+    既定は論理削除（フォルダは残し、含まれる全ファイルに削除記録を作成）。
+    physical=true の場合はフォルダ・子孫フォルダ・全バージョンを削除する。
+    """
+    _require_folder(db, folder_id)
+    if physical:
+        result = FolderService.purge_folder(db, folder_id)
+        message = f"フォルダID {folder_id} を物理削除しました"
+    else:
+        result = FolderService.delete_folder(db, folder_id, memo)
+        message = f"フォルダID {folder_id} 以下のファイルを削除しました"
+
+    return {"message": message, "folder_id": folder_id, "physical": physical, **result}
+
+@app.post("/folders/{folder_id}/move", response_model=FolderSchema)
+async def move_folder(
+    folder_id: int,
+    target_parent_id: Optional[int] = Form(None, description="移動先の親フォルダID（省略時はルート）"),
+    db: Session = Depends(get_db)
+):
+    """フォルダを子孫・ファイルごと別の親フォルダの下へ移動"""
+    _require_folder(db, folder_id)
+    _require_folder(db, target_parent_id)
+    try:
+        folder = FolderService.move_folder(db, folder_id, target_parent_id)
+    except FolderCycleError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except FileConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    return FolderSchema.from_orm(folder)
 
 @app.get("/files")
 async def list_files(
+    request: Request,
     folder_id: Optional[int] = Query(None, description="フォルダID"),
-    db: Session = Depends(get_db)
+    as_of: Optional[datetime] = Query(None, description="この時点のスナップショット（ISO 8601、タイムゾーンなしはUTC）"),
+    db: Session = Depends(get_read_db)
 ):
-    """全ファイルのリストを取得"""
+    """
+    全ファイルのリストを取得（Accept: application/x-ndjson の場合は1行1ファイルでストリーミング）
+
+    as_of を指定すると、各ファイルのその時点での最新バージョン（削除記録を含む）を返す。
+    """
     try:
         # まず、フォルダが存在するかチェック
         if folder_id is not None:
@@ -150,8 +483,14 @@ async def list_files(
             if not folder:
                 raise HTTPException(status_code=404, detail=f"フォルダID {folder_id} が見つかりません")
 
+        if wants_ndjson(request.headers.get("accept")):
+            return StreamingResponse(
+                _stream_all_files(request, folder_id, as_of),
+                media_type=NDJSON_MEDIA_TYPE
+            )
+
         # フォルダIDを渡してファイルを取得
-        files = FileVersionService.get_all_files(db, folder_id)
+        files = FileVersionService.get_all_files(db, folder_id, as_of)
 
         return {"files": files}
     except Exception as e:
@@ -162,11 +501,37 @@ async def list_files(
 
         raise HTTPException(status_code=500, detail=f"ファイル一覧の取得に失敗: {str(e)}")
 
+@app.post("/files/versions/batch")
+async def get_file_versions_batch(request: VersionBatchRequest, db: Session = Depends(get_read_db)):
+    """
+    複数ファイルのバージョン履歴を1回のクエリでまとめて取得
+
+    files に (filename, folder_id) を並べると、その順で各ファイルの履歴を返す（存在しないファイルは空）。
+    files を省略すると folder_id のフォルダ（省略時はルート）内の全ファイルの履歴を返す。
+    """
+    if request.files is not None and len(request.files) > VERSION_BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"一度に指定できるファイルは {VERSION_BATCH_MAX_FILES} 件までです")
+
+    if request.files is None:
+        _require_folder(db, request.folder_id)
+        histories = FileVersionService.get_versions_batch(db, folder_id=request.folder_id)
+        keys = list(histories)
+    else:
+        keys = list(dict.fromkeys((file.folder_id, file.filename) for file in request.files))
+        histories = FileVersionService.get_versions_batch(db, keys)
+
+    return {
+        "files": [
+            {"filename": filename, "folder_id": folder_id, "versions": histories.get((folder_id, filename), [])}
+            for folder_id, filename in keys
+        ]
+    }
+
 @app.get("/files/{filename}/versions")
 async def get_file_versions(
     filename: str,
     folder_id: Optional[int] = Query(None, description="フォルダID"),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """指定ファイルのバージョン履歴を取得"""
     versions = FileVersionService.get_file_versions(db, filename, folder_id)
@@ -195,15 +560,11 @@ async def download_file(
     filename: str,
     version: Optional[int] = Query(None, description="バージョン番号（省略時は最新版）"),
     folder_id: Optional[int] = Query(None, description="フォルダID"),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """ファイルをダウンロード"""
-    if version:
-        file_version = FileVersionService.get_file_version(db, filename, version, folder_id)
-    else:
-        # 最新バージョンを取得
-        versions = FileVersionService.get_file_versions(db, filename, folder_id)
-        file_version = versions[0] if versions else None
+    # コンテンツは参照を解決せずに取得し、サイドカーのファイルにある場合はメモリに読み込まずに返す
+    file_version, stored_content = FileVersionService.get_download_version(db, filename, version, folder_id)
 
     if not file_version:
         raise HTTPException(status_code=404, detail="ファイルまたはバージョンが見つかりません")
@@ -211,18 +572,12 @@ async def download_file(
     # 削除されたファイルでもダウンロード可能（3世代以内であれば）
     if file_version.operation == "delete":
         # 削除されたファイルの場合は空のコンテンツを返す
-        if not file_version.file_content:
+        if not stored_content:
             # 削除記録の場合は空のファイルを返す
-            file_content = b""
-        else:
-            file_content = file_version.file_content
+            stored_content = b""
     else:
-        if not file_version.file_content:
+        if not stored_content:
             raise HTTPException(status_code=404, detail="ファイルコンテンツが見つかりません")
-        file_content = file_version.file_content
-
-    # データベースからファイルコンテンツを取得してストリーミングレスポンスで返す
-    file_stream = BytesIO(file_content)
 
     # 日本語ファイル名を適切にエンコード
     import urllib.parse
@@ -231,13 +586,365 @@ async def download_file(
     headers = {
         "Content-Disposition": f"attachment; filename*=UTF-8''{encoded_filename}"
     }
+    media_type = file_version.mime_type or "application/octet-stream"
 
-    return StreamingResponse(
-        file_stream,
-        media_type=file_version.mime_type or "application/octet-stream",
+    blob_path = blob_store.ref_path(stored_content)
+    if blob_path is not None:
+        if not blob_path.exists():
+            raise HTTPException(status_code=404, detail="ファイルコンテンツが見つかりません")
+        # サイドカーのファイルを分割して送る（Content-Length 付き）
+        return FileResponse(blob_path, media_type=media_type, headers=headers)
+
+    # 内容はメモリ上にあるため Content-Length 付きで一度に返す
+    # （圧縮はミドルウェアが種類に応じて行い、gzip や画像など圧縮済みの内容はそのまま返す）
+    return Response(
+        content=stored_content,
+        media_type=media_type,
         headers=headers
     )
 
+@app.get("/files/{filename}/preview")
+async def preview_file(
+    filename: str,
+    version: Optional[int] = Query(None, description="バージョン番号（省略時は最新版）"),
+    folder_id: Optional[int] = Query(None, description="フォルダID"),
+    kind: Optional[str] = Query(None, description="派生データの種類（thumbnail, text, pdf）"),
+    db: Session = Depends(get_read_db)
+):
+    """ファイルのプレビュー（サムネイル、テキスト冒頭、PDFページ数）を取得"""
+    # コンテンツは生成を開始する場合だけ読み込む
+    file_version = FileVersionService.get_preview_version(db, filename, version, folder_id)
+
+    if not file_version:
+        raise HTTPException(status_code=404, detail="ファイルまたはバージョンが見つかりません")
+
+    if file_version.operation == "delete":
+        raise HTTPException(status_code=404, detail="削除されたファイルのプレビューはありません")
+
+    derivatives = DerivativeService.get_derivatives(db, file_version.id)
+
+    if not derivatives:
+        # 未生成の場合はバックグラウンドで生成を開始し、202を返す
+        if not DerivativeService.is_pending(file_version.id):
+            if not is_previewable(file_version.mime_type) or not DerivativeService.schedule(
+                file_version.id, file_version.file_content, file_version.mime_type
+            ):
+                raise HTTPException(status_code=404, detail="プレビュー対象外のファイル形式です")
+        return JSONResponse(
+            status_code=202,
+            content={"status": "pending", "filename": filename, "version": file_version.version},
+            headers={"Retry-After": "1"}
+        )
+
+    if kind:
+        derivative = derivatives.get(kind)
+    else:
+        derivative = next(
+            (derivatives[k] for k in ("thumbnail", "text", "pdf") if k in derivatives),
+            None
+        )
+
+    if derivative is None:
+        reason = json.loads(derivatives["none"].meta).get("reason") if "none" in derivatives else None
+        raise HTTPException(status_code=404, detail=reason or "プレビューが見つかりません")
+
+    # バージョン指定時は内容が変わらないので長期間キャッシュ可能
+    headers = {
+        "Cache-Control": "public, max-age=31536000, immutable" if version else "no-cache"
+    }
+
+    if derivative.kind == "thumbnail":
+        return Response(content=derivative.content, media_type=derivative.mime_type, headers=headers)
+
+    meta = json.loads(derivative.meta) if derivative.meta else {}
+    body = {
+        "filename": filename,
+        "version": file_version.version,
+        "kind": derivative.kind,
+        **meta
+    }
+    if derivative.kind == "text":
+        body["text"] = derivative.content.decode("utf-8")
+
+    return JSONResponse(content=body, headers=headers)
+
+@app.get("/files/{filename}/diff")
+async def diff_file_versions(
+    filename: str,
+    from_version: int = Query(..., alias="from", description="比較元のバージョン番号"),
+    to_version: int = Query(..., alias="to", description="比較先のバージョン番号"),
+    folder_id: Optional[int] = Query(None, description="フォルダID"),
+    format: str = Query("unified", description="差分形式（unified, lines）"),
+    context: int = Query(3, ge=0, le=100, description="unified形式の前後行数"),
+    db: Session = Depends(get_read_db)
+):
+    """2つのバージョン間の差分を取得"""
+    if format not in DIFF_FORMATS:
+        raise HTTPException(status_code=400, detail=f"不正な差分形式です: {format}")
+
+    source = FileVersionService.get_file_version(db, filename, from_version, folder_id)
+    target = FileVersionService.get_file_version(db, filename, to_version, folder_id)
+
+    if not source or not target:
+        raise HTTPException(status_code=404, detail="ファイルまたはバージョンが見つかりません")
+
+    diff = await DiffService.diff_versions(source, target, format, context)
+
+    return {
+        "filename": filename,
+        "folder_id": folder_id,
+        "from": {"version": source.version, "operation": source.operation, "mime_type": source.mime_type},
+        "to": {"version": target.version, "operation": target.operation, "mime_type": target.mime_type},
+        **diff
+    }
+
+def _upload_session_status(upload) -> dict:
+    return {
+        "upload_id": upload.id,
+        "filename": upload.filename,
+        "folder_id": upload.folder_id,
+        "offset": upload.received_size,
+        "next_chunk": upload.next_chunk,
+        "total_size": upload.total_size,
+        "expires_at": upload.expires_at
+    }
+
+@app.post("/uploads")
+async def create_upload_session(
+    filename: str = Form(...),
+    memo: Optional[str] = Form(None),
+    folder_id: Optional[int] = Form(None),
+    mime_type: Optional[str] = Form(None),
+    total_size: Optional[int] = Form(None),
+    db: Session = Depends(get_db)
+):
+    """再開可能なアップロードのセッションを作成"""
+    if folder_id is not None and not db.query(Folder).get(folder_id):
+        raise HTTPException(status_code=404, detail=f"フォルダID {folder_id} が見つかりません")
+
+    upload = UploadSessionService.create_session(db, filename, folder_id, memo, mime_type, total_size)
+    return _upload_session_status(upload)
+
+@app.get("/uploads/{upload_id}")
+async def get_upload_session(upload_id: str, db: Session = Depends(get_db)):
+    """アップロードセッションの現在のオフセットを取得"""
+    upload = UploadSessionService.get_session(db, upload_id)
+    if not upload:
+        raise HTTPException(status_code=404, detail="アップロードセッションが見つかりません")
+    return _upload_session_status(upload)
+
+@app.put("/uploads/{upload_id}/chunks/{index}")
+async def put_upload_chunk(
+    upload_id: str,
+    index: int,
+    request: Request,
+    offset: int = Query(..., ge=0, description="チャンクの開始オフセット"),
+    db: Session = Depends(get_db)
+):
+    """番号付きチャンクを送信（リクエストボディがチャンクのバイト列）"""
+    upload = UploadSessionService.get_session(db, upload_id)
+    if not upload:
+        raise HTTPException(status_code=404, detail="アップロードセッションが見つかりません")
+
+    try:
+        upload = await UploadSessionService.append_chunk(db, upload, index, offset, request.stream())
+    except UploadOffsetMismatch as e:
+        return JSONResponse(
+            status_code=409,
+            content={
+                "detail": "オフセットが一致しません",
+                "offset": e.expected_offset,
+                "next_chunk": e.next_chunk
+            }
+        )
+    except UploadSizeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UploadBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    return _upload_session_status(upload)
+
+@app.post("/uploads/{upload_id}/complete")
+async def complete_upload_session(
+    upload_id: str,
+    force: bool = Query(False, description="同一内容でも新しいバージョンを作成する"),
+    db: Session = Depends(get_db)
+):
+    """アップロードを確定して新しいバージョンを作成"""
+    upload = UploadSessionService.get_session(db, upload_id)
+    if not upload:
+        raise HTTPException(status_code=404, detail="アップロードセッションが見つかりません")
+
+    try:
+        version, created = await UploadSessionService.finalize(db, upload, force)
+    except UploadSizeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except UploadBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    if not created:
+        return _unchanged_response(version)
+
+    return {
+        "message": f"ファイル '{version.filename}' が正常に{version.operation}されました",
+        "filename": version.filename,
+        "version": version.version,
+        "memo": version.memo,
+        "operation": version.operation,
+        "folder_id": version.folder_id
+    }
+
+@app.delete("/uploads/{upload_id}")
+async def abort_upload_session(upload_id: str, db: Session = Depends(get_db)):
+    """アップロードを中止して一時データを削除"""
+    upload = UploadSessionService.get_session(db, upload_id)
+    if not upload:
+        raise HTTPException(status_code=404, detail="アップロードセッションが見つかりません")
+
+    UploadSessionService.discard(db, upload)
+    return {"message": "アップロードを中止しました", "upload_id": upload_id}
+
+@app.get("/metrics/admission")
+async def admission_metrics():
+    """アップロードのアドミッション制御の状態（このワーカーの値）"""
+    return admission.metrics()
+
+@app.get("/metrics/group-commit")
+async def group_commit_metrics():
+    """グループコミットの状態（このワーカーの値）"""
+    return group_writer.metrics()
+
+def _require_profiler_token(x_profile: Optional[str] = Header(None)):
+    if not PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="プロファイラーは無効です")
+    if not is_authorized(x_profile):
+        raise HTTPException(status_code=403, detail="プロファイラーのトークンが正しくありません")
+
+@app.get("/admin/profiles", dependencies=[Depends(_require_profiler_token)])
+async def list_profiles():
+    """保存されているプロファイルの一覧（新しい順）"""
+    return {"profiles": await run_in_threadpool(profile_store.list)}
+
+@app.get("/admin/profiles/{profile_id}", dependencies=[Depends(_require_profiler_token)])
+async def get_profile(profile_id: str):
+    """プロファイルの詳細（関数ごとの時間と発行されたSQL）"""
+    if not profile_id.isalnum():
+        raise HTTPException(status_code=404, detail="プロファイルが見つかりません")
+    report = await run_in_threadpool(profile_store.get, profile_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail="プロファイルが見つかりません")
+    return report
+
+@app.post("/jobs", status_code=202)
+async def create_job(job: JobCreate, db: Session = Depends(get_db)):
+    """バックグラウンドジョブを登録"""
+    try:
+        created = JobService.enqueue(db, job.type, job.params)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return JobService.to_dict(created)
+
+@app.get("/jobs")
+async def list_jobs(
+    status: Optional[str] = Query(None, description="状態（queued, running, succeeded, failed, cancelled）"),
+    type: Optional[str] = Query(None, description="ジョブ種別"),
+    limit: int = Query(50, ge=1, le=500),
+    db: Session = Depends(get_db)
+):
+    """ジョブの一覧（新しい順）"""
+    return {
+        "jobs": [JobService.to_dict(job) for job in JobService.list_jobs(db, status, type, limit)],
+        "types": job_types()
+    }
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: int, db: Session = Depends(get_db)):
+    """ジョブの状態・進捗・結果を取得"""
+    job = JobService.get_job(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="ジョブが見つかりません")
+    return JobService.to_dict(job)
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: int, db: Session = Depends(get_db)):
+    """ジョブをキャンセル（実行中の場合は次の進捗報告で中断される）"""
+    job = JobService.get_job(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="ジョブが見つかりません")
+    return JobService.to_dict(JobService.cancel(db, job))
+
+@app.get("/jobs/{job_id}/result")
+async def download_job_result(job_id: int, db: Session = Depends(get_db)):
+    """ジョブが作成したファイル（ZIPなど）をダウンロード"""
+    job = JobService.get_job(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="ジョブが見つかりません")
+    if job.status != SUCCEEDED:
+        raise HTTPException(status_code=409, detail=f"ジョブは完了していません（{job.status}）")
+
+    result = json.loads(job.result or "{}")
+    if not result.get("path") or not Path(result["path"]).exists():
+        raise HTTPException(status_code=404, detail="ジョブの結果ファイルがありません")
+
+    return FileResponse(
+        result["path"],
+        media_type=result.get("media_type", "application/octet-stream"),
+        filename=result.get("filename")
+    )
+
+@app.get("/changes")
+async def list_changes(
+    since: Optional[int] = Query(None, description="前回のカーソル（省略時は現在のカーソルのみ返す）"),
+    limit: int = Query(500, ge=1, le=5000, description="最大件数"),
+    db: Session = Depends(get_read_db)
+):
+    """カーソル以降の変更を取得（差分同期用）"""
+    if since is None:
+        return {"changes": [], "cursor": ChangeLogService.latest_cursor(db), "has_more": False}
+
+    changes, cursor, has_more = ChangeLogService.get_changes(db, since, limit)
+    return {"changes": changes, "cursor": cursor, "has_more": has_more}
+
+@app.get("/changes/stream")
+async def stream_changes(
+    request: Request,
+    since: Optional[int] = Query(None, description="このカーソル以降の変更から配信（省略時は接続以降の変更のみ）")
+):
+    """変更を Server-Sent Events で配信（再接続時は Last-Event-ID から再開）"""
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id and last_event_id.isdigit():
+        since = int(last_event_id)
+
+    async def event_stream():
+        waiter = notifier.register()
+        _, wakeup = waiter
+        cursor = since
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                # 取得中に届いた通知を取りこぼさないよう、取得前にクリアする
+                wakeup.clear()
+                changes, cursor, has_more = await run_in_threadpool(read_changes, cursor)
+                for change in changes:
+                    data = json.dumps(change, ensure_ascii=False)
+                    yield f"id: {change['cursor']}\nevent: change\ndata: {data}\n\n"
+                if has_more:
+                    continue
+                try:
+                    await asyncio.wait_for(wakeup.wait(), timeout=CHANGES_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+        finally:
+            notifier.unregister(waiter)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 if __name__ == "__main__":
     import uvicorn
+    # 単一プロセスで起動する場合はここでテーブルを作成
+    create_tables()
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,346 @@
+"""
+オンラインマイグレーション（サービスを止めずに行うスキーマ変更）
+
+file_versions のような大きなテーブルを1つの UPDATE や ALTER で書き換えると、
+テーブルのロックが長時間続き、WAL も一度に大量に生成される。ここでは次の手順で行う。
+
+  1. 拡張: NULL 許可の列追加など、すぐ終わる変更だけを Alembic で行う
+     （アプリケーションは新しい行を新しい形式で書き込み、読み取りは旧形式（NULL）にも対応する）
+  2. バックフィル: 既存の行を id の範囲ごとの短いトランザクションで書き換える
+     - 1バッチごとにコミットし、チェックポイント（online_migrations テーブル）を同じトランザクションで記録
+     - バッチ間で休止して負荷と WAL の生成量を抑える（稼働率・レプリカ遅延による調整）
+     - 中断しても同じコマンドで続きから再開できる
+  3. インデックス: PostgreSQL では CREATE INDEX CONCURRENTLY で書き込みを止めずに作成
+  4. 縮小: バックフィル完了（is_complete）を確認してから、旧形式への対応や旧列を削除する
+
+バックフィルは @backfill で登録し、online_migrate.py から実行する。
+"""
+import os
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional
+
+from sqlalchemy import LargeBinary, Table, bindparam, func, select, text, type_coerce, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from .database import SessionLocal, OnlineMigration, FileVersion, DATABASE_URL, engine
+from .blobstore import blob_store, is_ref, ref_hash, REF_MARKER, REF_LENGTH
+from .partitioning import copy_batch
+from .services import FileVersionService
+
+PENDING = "pending"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+# 1バッチのロック待ちの上限（PostgreSQL）。超えた場合はロールバックして待ってから再試行する
+ONLINE_MIGRATION_LOCK_TIMEOUT_MS = int(os.getenv("ONLINE_MIGRATION_LOCK_TIMEOUT_MS", "2000"))
+ONLINE_MIGRATION_MAX_RETRIES = int(os.getenv("ONLINE_MIGRATION_MAX_RETRIES", "10"))
+
+_is_postgres = DATABASE_URL.startswith("postgresql")
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+# バックフィルの処理関数: (db, lo, hi) を受け取り、lo < id <= hi の行を書き換えて件数を返す
+BatchHandler = Callable[[Session, int, int], int]
+
+class Backfill:
+    def __init__(self, name: str, table: Table, handler: BatchHandler, description: str, batch_size: int):
+        self.name = name
+        self.table = table
+        self.handler = handler
+        self.description = description
+        self.batch_size = batch_size
+
+_backfills: Dict[str, Backfill] = {}
+
+def backfill(name: str, table: Table, description: str = "", batch_size: int = 500):
+    """バックフィルを登録するデコレーター"""
+    def register(handler: BatchHandler) -> BatchHandler:
+        _backfills[name] = Backfill(name, table, handler, description, batch_size)
+        return handler
+    return register
+
+def backfills() -> Dict[str, Backfill]:
+    return dict(_backfills)
+
+class OnlineMigrationService:
+    @staticmethod
+    def get_checkpoint(db: Session, name: str) -> OnlineMigration:
+        checkpoint = db.query(OnlineMigration).get(name)
+        if checkpoint is None:
+            checkpoint = OnlineMigration(name=name, status=PENDING, last_id=0, rows_processed=0, batches=0)
+            db.add(checkpoint)
+            db.commit()
+        return checkpoint
+
+    @staticmethod
+    def is_complete(db: Session, name: str) -> bool:
+        """バックフィルが完了しているか（旧形式への対応を外してよいかの判断に使う）"""
+        return db.query(OnlineMigration.status).filter(OnlineMigration.name == name).scalar() == COMPLETED
+
+    @staticmethod
+    def reset(db: Session, name: str):
+        db.query(OnlineMigration).filter(OnlineMigration.name == name).delete(synchronize_session=False)
+        db.commit()
+
+    @staticmethod
+    def status(db: Session) -> List[dict]:
+        checkpoints = {c.name: c for c in db.query(OnlineMigration).all()}
+        result = []
+        for name in sorted(set(_backfills) | set(checkpoints)):
+            c = checkpoints.get(name)
+            result.append({
+                "name": name,
+                "description": _backfills[name].description if name in _backfills else None,
+                "status": c.status if c else PENDING,
+                "last_id": c.last_id if c else 0,
+                "max_id": c.max_id if c else None,
+                "rows_processed": c.rows_processed if c else 0,
+                "batches": c.batches if c else 0,
+                "error": c.error if c else None,
+                "updated_at": c.updated_at if c else None,
+            })
+        return result
+
+    @staticmethod
+    def run_backfill(
+        name: str,
+        batch_size: Optional[int] = None,
+        sleep: float = 0.0,
+        duty_cycle: float = 0.5,
+        max_replica_lag: Optional[float] = None,
+        max_batches: Optional[int] = None,
+        session_factory=SessionLocal
+    ) -> OnlineMigration:
+        """
+        バックフィルを実行（チェックポイントから再開）
+
+        duty_cycle は処理時間の割合（0.5 ならバッチにかかった時間と同じだけ休止する）。
+        sleep はそれに加えてバッチごとに休止する秒数。max_replica_lag を指定すると、
+        レプリカの遅延（秒）がそれ以下になるまで次のバッチを待つ（PostgreSQL）。
+        max_batches を指定するとその数のバッチで中断する（続きは再実行で再開）。
+        """
+        if name not in _backfills:
+            raise ValueError(f"不明なバックフィルです: {name}")
+        task = _backfills[name]
+        batch_size = batch_size or task.batch_size
+        id_column = task.table.c.id
+
+        db = session_factory()
+        try:
+            checkpoint = OnlineMigrationService.get_checkpoint(db, name)
+            if checkpoint.status == COMPLETED:
+                print(f"Backfill {name} is already completed")
+                return checkpoint
+
+            # 開始時点の最大 id までを対象にする（以降の行はアプリケーションが新しい形式で書き込む）
+            if checkpoint.max_id is None:
+                checkpoint.max_id = db.execute(select(func.max(id_column))).scalar() or 0
+            checkpoint.status = RUNNING
+            checkpoint.error = None
+            checkpoint.started_at = checkpoint.started_at or _utcnow()
+            db.commit()
+            print(f"Backfill {name} started: last_id={checkpoint.last_id}, max_id={checkpoint.max_id}")
+
+            batches = 0
+            while checkpoint.last_id < checkpoint.max_id:
+                if max_batches is not None and batches >= max_batches:
+                    print(f"Backfill {name} paused at id {checkpoint.last_id}")
+                    return checkpoint
+
+                lo = checkpoint.last_id
+                hi = OnlineMigrationService._batch_upper_bound(db, id_column, lo, batch_size, checkpoint.max_id)
+
+                started = time.monotonic()
+                for attempt in range(ONLINE_MIGRATION_MAX_RETRIES + 1):
+                    try:
+                        if _is_postgres:
+                            db.execute(text(f"SET LOCAL lock_timeout = {ONLINE_MIGRATION_LOCK_TIMEOUT_MS}"))
+                        updated = task.handler(db, lo, hi)
+                        checkpoint.last_id = hi
+                        checkpoint.rows_processed += updated
+                        checkpoint.batches += 1
+                        checkpoint.updated_at = _utcnow()
+                        db.commit()
+                        break
+                    except OperationalError as e:
+                        # ロック待ちのタイムアウトなど。アプリケーションの処理を優先して待ってから再試行
+                        db.rollback()
+                        if attempt >= ONLINE_MIGRATION_MAX_RETRIES:
+                            raise
+                        wait = min(2 ** attempt, 30)
+                        print(f"Backfill {name} batch ({lo}, {hi}] failed, retrying in {wait}s: {e}")
+                        time.sleep(wait)
+                batches += 1
+                elapsed = time.monotonic() - started
+
+                # 処理時間に応じて休止し、負荷と WAL の生成速度を抑える
+                pause = sleep + (elapsed * (1 - duty_cycle) / duty_cycle if 0 < duty_cycle < 1 else 0)
+                if pause > 0:
+                    time.sleep(pause)
+                if max_replica_lag is not None:
+                    OnlineMigrationService._wait_for_replicas(db, max_replica_lag)
+
+                if batches % 100 == 0:
+                    print(f"Backfill {name}: id {checkpoint.last_id}/{checkpoint.max_id}, {checkpoint.rows_processed} rows")
+
+            checkpoint.status = COMPLETED
+            checkpoint.finished_at = _utcnow()
+            db.commit()
+            print(f"Backfill {name} completed: {checkpoint.rows_processed} rows in {checkpoint.batches} batches")
+            return checkpoint
+
+        except Exception as e:
+            db.rollback()
+            db.query(OnlineMigration).filter(OnlineMigration.name == name).update(
+                {OnlineMigration.status: FAILED, OnlineMigration.error: str(e), OnlineMigration.updated_at: _utcnow()},
+                synchronize_session=False
+            )
+            db.commit()
+            raise
+        finally:
+            db.close()
+
+    @staticmethod
+    def _batch_upper_bound(db: Session, id_column, lo: int, batch_size: int, max_id: int) -> int:
+        """lo より後の batch_size 件目の id（削除で id が飛んでいてもバッチの行数がそろう。主キーのみを読む）"""
+        hi = db.execute(
+            select(id_column).where(id_column > lo).order_by(id_column).offset(batch_size - 1).limit(1)
+        ).scalar()
+        return min(hi, max_id) if hi is not None else max_id
+
+    @staticmethod
+    def _wait_for_replicas(db: Session, max_lag: float, poll: float = 1.0):
+        """レプリカの反映遅延が max_lag 秒以下になるまで待つ（取得できない環境では待たない）"""
+        if not _is_postgres:
+            return
+        while True:
+            try:
+                lag = db.execute(text(
+                    "SELECT COALESCE(MAX(EXTRACT(EPOCH FROM replay_lag)), 0) FROM pg_stat_replication"
+                )).scalar()
+                db.rollback()
+            except Exception as e:
+                db.rollback()
+                print(f"Replica lag is not available, continuing: {e}")
+                return
+            if lag is None or lag <= max_lag:
+                return
+            print(f"Replica lag {lag:.1f}s exceeds {max_lag}s, waiting")
+            time.sleep(poll)
+
+def create_index_concurrently(name: str, table: str, columns: Iterable[str], unique: bool = False):
+    """
+    書き込みを止めずにインデックスを作成
+
+    PostgreSQL では CREATE INDEX CONCURRENTLY を使う（トランザクション外で実行する必要がある）。
+    中断などで無効（INVALID）のまま残ったインデックスがあれば削除して作り直す。
+    それ以外のデータベースでは通常の CREATE INDEX を行う。
+    """
+    column_list = ", ".join(columns)
+    unique_sql = "UNIQUE " if unique else ""
+
+    if not _is_postgres:
+        with engine.begin() as conn:
+            conn.execute(text(f"CREATE {unique_sql}INDEX IF NOT EXISTS {name} ON {table} ({column_list})"))
+        return
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        valid = conn.execute(text(
+            "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name"
+        ), {"name": name}).scalar()
+        if valid is True:
+            print(f"Index {name} already exists")
+            return
+        if valid is False:
+            print(f"Dropping invalid index {name}")
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+        print(f"Creating index {name} concurrently")
+        conn.execute(text(f"CREATE {unique_sql}INDEX CONCURRENTLY {name} ON {table} ({column_list})"))
+
+@backfill(
+    "file_versions_content_hash",
+    FileVersion.__table__,
+    description="content_hash が未設定（NULL）の既存バージョンに SHA-256 を設定",
+    batch_size=200
+)
+def backfill_content_hash(db: Session, lo: int, hi: int) -> int:
+    # 読み取り側は NULL の場合にその場で計算するため、バックフィル中も動作は変わらない
+    # サイドカーへの参照を保存している行は、参照に含まれるハッシュをそのまま使う
+    if _is_postgres:
+        # コンテンツをアプリケーションへ転送せず、データベース内で計算する（PostgreSQL 11 以降）
+        return db.execute(text(
+            "UPDATE file_versions SET content_hash = CASE "
+            "WHEN length(file_content) = :ref_length AND substring(file_content FROM 1 FOR :marker_length) = :marker "
+            "THEN convert_from(substring(file_content FROM :marker_length + 1), 'UTF8') "
+            "ELSE encode(sha256(COALESCE(file_content, ''::bytea)), 'hex') END "
+            "WHERE id > :lo AND id <= :hi AND content_hash IS NULL"
+        ), {
+            "lo": lo, "hi": hi, "ref_length": REF_LENGTH,
+            "marker_length": len(REF_MARKER), "marker": REF_MARKER
+        }).rowcount
+
+    # 型変換を通さずに保存されている値（参照または行内の内容）を読む
+    stored = type_coerce(FileVersion.file_content, LargeBinary)
+    rows = db.query(FileVersion.id, stored.label("file_content")).filter(
+        FileVersion.id > lo,
+        FileVersion.id <= hi,
+        FileVersion.content_hash.is_(None)
+    ).all()
+    if not rows:
+        return 0
+    db.execute(
+        update(FileVersion.__table__)
+        .where(FileVersion.__table__.c.id == bindparam("version_id"))
+        .where(FileVersion.__table__.c.content_hash.is_(None))
+        .values(content_hash=bindparam("content_hash")),
+        [
+            {
+                "version_id": row.id,
+                "content_hash": ref_hash(row.file_content) or FileVersionService.compute_hash(bytes(row.file_content or b""))
+            }
+            for row in rows
+        ]
+    )
+    return len(rows)
+
+@backfill(
+    "file_versions_sidecar_blobs",
+    FileVersion.__table__,
+    description="行内に保存されている既存のコンテンツを BLOB_STORE_DIR のサイドカーへ移す",
+    batch_size=50
+)
+def backfill_sidecar_blobs(db: Session, lo: int, hi: int) -> int:
+    # 読み取り側は行内・参照のどちらにも対応するため、移行中も動作は変わらない
+    if not blob_store.enabled:
+        raise ValueError("BLOB_STORE_DIR が設定されていません")
+
+    stored = type_coerce(FileVersion.file_content, LargeBinary)
+    rows = db.query(FileVersion.id, stored).filter(
+        FileVersion.id > lo,
+        FileVersion.id <= hi,
+        func.length(FileVersion.file_content) > blob_store.inline_max
+    ).all()
+    params = [
+        # ファイルへの書き込み（fsync）が済んでから参照に置き換える
+        {"version_id": version_id, "content": blob_store.put(bytes(content))}
+        for version_id, content in rows
+        if not is_ref(content)
+    ]
+    if not params:
+        return 0
+    db.execute(text("UPDATE file_versions SET file_content = :content WHERE id = :version_id"), params)
+    return len(params)
+
+@backfill(
+    "file_versions_partition_copy",
+    FileVersion.__table__,
+    description="既存の file_versions の行をパーティション分割した新しいテーブルへコピー（partition_file_versions.py prepare の後に実行）",
+    batch_size=5000
+)
+def backfill_partition_copy(db: Session, lo: int, hi: int) -> int:
+    # コピー中の書き込みはトリガーで新しいテーブルにも反映される
+    return copy_batch(db, lo, hi)
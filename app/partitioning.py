@@ -0,0 +1,223 @@
+"""
+file_versions のハッシュパーティション分割（PostgreSQL、任意）
+
+大規模な環境では file_versions をファイル名のハッシュで FILE_VERSIONS_PARTITIONS 個に分割する。
+  - VACUUM やインデックスの肥大化はパーティション単位になり、1つあたりのサイズは 1/N になる
+  - FileVersionService のファイル単位の処理（最新版の取得、保持数を超えたバージョンの削除、
+    ダウンロードなど）はすべてファイル名を条件に含むため、対象のパーティションだけを読む
+  - フォルダ単位の一覧は全パーティションを読むが、各パーティションの (folder_id, filename, version) の
+    インデックスを使い、集約と結合はパーティションごとに行う
+  - 主キーは (id, filename)。id はシーケンスで採番するため全体で一意のまま（ORM 上の主キーも id）
+  - file_derivatives からの外部キーは張れないため、削除の連動はトリガーで行う
+  - ファイル名の変更は行のパーティション間の移動になる（PostgreSQL 11 以降）
+
+新規作成時は FILE_VERSIONS_PARTITIONS を設定して create_tables を実行する。既存のテーブルは
+partition_file_versions.py で、サービスを止めずに次の手順で移行する。
+  1. prepare: 分割した新しいテーブルを作成し、既存テーブルへの変更をそのまま反映するトリガーを設定
+  2. copy: 既存の行を id の範囲ごとにコピー（オンラインマイグレーションのバックフィル。中断・再開可能）
+  3. swap: 短い排他ロックの間に件数を確認してテーブル名を入れ替える
+     （旧テーブルは file_versions_unpartitioned として残し、以降の書き込みは反映しない）
+  4. drop-old: 動作を確認してから旧テーブルを削除
+"""
+from typing import List, Optional
+
+from sqlalchemy import text
+
+PARENT_TABLE = "file_versions"
+SHADOW_TABLE = "file_versions_partitioned"
+OLD_TABLE = "file_versions_unpartitioned"
+PARTITION_PREFIX = "file_versions_p"
+# 移行中の新しいテーブルのインデックス名の接頭辞（入れ替え時に元の名前へ変更する）
+_SHADOW_INDEX_PREFIX = "part_"
+_MAX_IDENTIFIER = 63
+
+def partition_ddl(parent: str, partitions: int) -> List[str]:
+    """パーティション（file_versions_p0 〜 p{N-1}）を作成するDDL"""
+    return [
+        f"CREATE TABLE {PARTITION_PREFIX}{i} PARTITION OF {parent} "
+        f"FOR VALUES WITH (MODULUS {partitions}, REMAINDER {i})"
+        for i in range(partitions)
+    ]
+
+# 外部キーの ON DELETE CASCADE の代わりに、バージョンの削除を派生データへ連動させる
+DERIVATIVE_CASCADE_DDL = [
+    f"""
+    CREATE OR REPLACE FUNCTION file_versions_delete_derivatives() RETURNS trigger AS $$
+    BEGIN
+        -- ファイル名の変更によるパーティション間の移動も DELETE として呼ばれるため、行が残っていれば何もしない
+        IF NOT EXISTS (SELECT 1 FROM {PARENT_TABLE} WHERE id = OLD.id) THEN
+            DELETE FROM file_derivatives WHERE version_id = OLD.id;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    f"DROP TRIGGER IF EXISTS file_versions_delete_derivatives ON {PARENT_TABLE}",
+    f"""
+    CREATE TRIGGER file_versions_delete_derivatives AFTER DELETE ON {PARENT_TABLE}
+    FOR EACH ROW EXECUTE FUNCTION file_versions_delete_derivatives()
+    """,
+]
+
+# 移行中、既存テーブルへの変更を新しいテーブルへ反映する
+_MIRROR_DDL = [
+    f"""
+    CREATE OR REPLACE FUNCTION file_versions_mirror() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            DELETE FROM {SHADOW_TABLE} WHERE id = OLD.id AND filename = OLD.filename;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            INSERT INTO {SHADOW_TABLE} SELECT NEW.* ON CONFLICT (id, filename) DO NOTHING;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    f"DROP TRIGGER IF EXISTS file_versions_mirror ON {PARENT_TABLE}",
+    f"""
+    CREATE TRIGGER file_versions_mirror AFTER INSERT OR UPDATE OR DELETE ON {PARENT_TABLE}
+    FOR EACH ROW EXECUTE FUNCTION file_versions_mirror()
+    """,
+]
+
+def _exists(connection, table: str) -> bool:
+    return connection.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": table}).scalar()
+
+def is_partitioned(connection, table: str = PARENT_TABLE) -> bool:
+    return connection.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:name))"
+    ), {"name": table}).scalar()
+
+def prepare(engine, partitions: int):
+    """分割した新しいテーブルを作成し、既存テーブルの変更を反映するトリガーを設定"""
+    if partitions < 2:
+        raise ValueError("パーティション数は2以上を指定してください")
+    with engine.begin() as connection:
+        if is_partitioned(connection):
+            raise ValueError(f"{PARENT_TABLE} は既にパーティション分割されています")
+        if _exists(connection, SHADOW_TABLE):
+            raise ValueError(f"{SHADOW_TABLE} は既に存在します（copy から再開してください）")
+
+        # 列・既定値（id のシーケンスを含む）・NOT NULL は既存テーブルと同じにする
+        connection.exec_driver_sql(
+            f"CREATE TABLE {SHADOW_TABLE} ("
+            f"LIKE {PARENT_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS, "
+            f"PRIMARY KEY (id, filename), "
+            f"FOREIGN KEY (folder_id) REFERENCES folders (id) ON DELETE CASCADE"
+            f") PARTITION BY HASH (filename)"
+        )
+        for statement in partition_ddl(SHADOW_TABLE, partitions):
+            connection.exec_driver_sql(statement)
+
+        # 主キー以外のインデックスを同じ定義で作成（空のテーブルなのですぐ終わる）
+        indexes = connection.execute(text(
+            "SELECT i.relname, pg_get_indexdef(i.oid) FROM pg_index x "
+            "JOIN pg_class i ON i.oid = x.indexrelid "
+            "WHERE x.indrelid = to_regclass(:table) AND NOT x.indisprimary"
+        ), {"table": PARENT_TABLE}).fetchall()
+        for name, definition in indexes:
+            shadow_name = (_SHADOW_INDEX_PREFIX + name)[:_MAX_IDENTIFIER]
+            head, _, columns = definition.partition(" USING ")
+            unique = "UNIQUE " if head.startswith("CREATE UNIQUE") else ""
+            connection.exec_driver_sql(f"CREATE {unique}INDEX {shadow_name} ON {SHADOW_TABLE} USING {columns}")
+
+        for statement in _MIRROR_DDL:
+            connection.exec_driver_sql(statement)
+
+    print(f"Prepared {SHADOW_TABLE} with {partitions} partitions and {len(indexes)} indexes")
+
+def copy_batch(db, lo: int, hi: int) -> int:
+    """lo < id <= hi の行を新しいテーブルへコピー（オンラインマイグレーションのバックフィルから呼ぶ）"""
+    if not _exists(db, SHADOW_TABLE):
+        raise ValueError(f"{SHADOW_TABLE} がありません（先に prepare を実行してください）")
+    # FOR SHARE で、コピー中の行への更新はコピーのコミット後に（トリガー経由で）反映されるようにする
+    return db.execute(text(
+        f"INSERT INTO {SHADOW_TABLE} "
+        f"SELECT * FROM {PARENT_TABLE} WHERE id > :lo AND id <= :hi FOR SHARE "
+        f"ON CONFLICT (id, filename) DO NOTHING"
+    ), {"lo": lo, "hi": hi}).rowcount
+
+def _rename_constraints(connection, table: str, old_prefix: str, new_prefix: str):
+    names = connection.execute(text(
+        "SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(:table)"
+    ), {"table": table}).scalars().all()
+    for name in names:
+        if name.startswith(old_prefix):
+            new_name = (new_prefix + name[len(old_prefix):])[:_MAX_IDENTIFIER]
+            connection.exec_driver_sql(f'ALTER TABLE {table} RENAME CONSTRAINT "{name}" TO "{new_name}"')
+
+def swap(engine, lock_timeout_ms: int = 5000):
+    """件数を確認してテーブルを入れ替える（この間だけ file_versions への読み書きを止める）"""
+    with engine.begin() as connection:
+        if not _exists(connection, SHADOW_TABLE):
+            raise ValueError(f"{SHADOW_TABLE} がありません（先に prepare と copy を実行してください）")
+        connection.exec_driver_sql(f"SET LOCAL lock_timeout = '{int(lock_timeout_ms)}ms'")
+        connection.exec_driver_sql(f"LOCK TABLE {PARENT_TABLE}, {SHADOW_TABLE}, file_derivatives IN ACCESS EXCLUSIVE MODE")
+
+        old_count = connection.execute(text(f"SELECT count(*) FROM {PARENT_TABLE}")).scalar()
+        new_count = connection.execute(text(f"SELECT count(*) FROM {SHADOW_TABLE}")).scalar()
+        if old_count != new_count:
+            raise ValueError(f"件数が一致しません（既存 {old_count} 件, 分割後 {new_count} 件）。copy を完了させてください")
+
+        connection.exec_driver_sql(f"DROP TRIGGER file_versions_mirror ON {PARENT_TABLE}")
+        connection.exec_driver_sql("DROP FUNCTION file_versions_mirror()")
+
+        # 他のテーブルからの外部キー（file_derivatives.version_id）は分割したテーブルには張れない
+        for table, name in connection.execute(text(
+            "SELECT conrelid::regclass::text, conname FROM pg_constraint "
+            "WHERE confrelid = to_regclass(:table) AND contype = 'f'"
+        ), {"table": PARENT_TABLE}).fetchall():
+            connection.exec_driver_sql(f'ALTER TABLE {table} DROP CONSTRAINT "{name}"')
+
+        # インデックスと制約の名前を元のテーブルのものに揃える
+        shadow_indexes = connection.execute(text(
+            "SELECT indexname FROM pg_indexes WHERE tablename = :table AND indexname LIKE :prefix"
+        ), {"table": SHADOW_TABLE, "prefix": _SHADOW_INDEX_PREFIX + "%"}).scalars().all()
+        for shadow_name in shadow_indexes:
+            name = shadow_name[len(_SHADOW_INDEX_PREFIX):]
+            connection.exec_driver_sql(f'ALTER INDEX IF EXISTS "{name}" RENAME TO "{(name + "_unpartitioned")[:_MAX_IDENTIFIER]}"')
+            connection.exec_driver_sql(f'ALTER INDEX "{shadow_name}" RENAME TO "{name}"')
+        _rename_constraints(connection, PARENT_TABLE, f"{PARENT_TABLE}_", f"{OLD_TABLE}_")
+        _rename_constraints(connection, SHADOW_TABLE, f"{SHADOW_TABLE}_", f"{PARENT_TABLE}_")
+
+        sequence = connection.execute(text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": PARENT_TABLE}).scalar()
+        connection.exec_driver_sql(f"ALTER TABLE {PARENT_TABLE} RENAME TO {OLD_TABLE}")
+        connection.exec_driver_sql(f"ALTER TABLE {SHADOW_TABLE} RENAME TO {PARENT_TABLE}")
+        if sequence:
+            # 旧テーブルを削除してもシーケンスが残るようにする
+            connection.exec_driver_sql(f"ALTER SEQUENCE {sequence} OWNED BY {PARENT_TABLE}.id")
+
+        for statement in DERIVATIVE_CASCADE_DDL:
+            connection.exec_driver_sql(statement)
+
+    print(f"Swapped {PARENT_TABLE} to the partitioned table ({new_count} rows); old table kept as {OLD_TABLE}")
+
+def drop_old(engine):
+    with engine.begin() as connection:
+        connection.exec_driver_sql(f"DROP TABLE IF EXISTS {OLD_TABLE}")
+    print(f"Dropped {OLD_TABLE}")
+
+def status(engine) -> dict:
+    """分割の状態とパーティションごとの行数（推定）・サイズ"""
+    with engine.connect() as connection:
+        partitioned = is_partitioned(connection)
+        target: Optional[str] = PARENT_TABLE if partitioned else (
+            SHADOW_TABLE if _exists(connection, SHADOW_TABLE) else None
+        )
+        partitions = []
+        if target is not None:
+            partitions = [
+                {"name": name, "rows": int(rows), "bytes": size}
+                for name, rows, size in connection.execute(text(
+                    "SELECT c.relname, GREATEST(c.reltuples, 0), pg_total_relation_size(c.oid) "
+                    "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                    "WHERE i.inhparent = to_regclass(:table) ORDER BY c.relname"
+                ), {"table": target})
+            ]
+        return {
+            "partitioned": partitioned,
+            "migrating": _exists(connection, SHADOW_TABLE),
+            "old_table": _exists(connection, OLD_TABLE),
+            "partitions": partitions,
+        }
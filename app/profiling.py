@@ -0,0 +1,221 @@
+"""
+リクエスト単位のプロファイラー（任意）
+
+PROFILER_ENABLED=1 のときだけミドルウェアとSQLの計測フックを組み込む（無効時は何も登録しないため負荷はない）。
+次のいずれかに該当したリクエストについて、cProfile による関数ごとの時間と、発行されたSQL文と
+その実行時間を記録し、PROFILER_DIR に JSON のレポートとして保存する（最大 PROFILER_MAX_REPORTS 件、
+古いものから削除）。
+  - X-Profile ヘッダーに PROFILER_TOKEN と同じ値が指定されている
+  - PROFILER_SAMPLE_RATE の確率で抽出された
+
+cProfile はイベントループのスレッドで動く処理を対象とし、同時に計測するのは1リクエストだけ
+（計測中に来た他のリクエストは計測対象にしないが、同じスレッドで並行して動いた処理は内訳に含まれうる）。
+スレッドプールで実行される同期処理の時間は関数ごとの内訳には現れないが、SQLはスレッドをまたいで
+そのリクエストの分だけが記録される。
+"""
+import contextvars
+import cProfile
+import hmac
+import io
+import json
+import os
+import pstats
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Optional
+
+from sqlalchemy import event
+from starlette.concurrency import run_in_threadpool
+
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "0") == "1"
+PROFILER_TOKEN = os.getenv("PROFILER_TOKEN", "")
+PROFILER_SAMPLE_RATE = float(os.getenv("PROFILER_SAMPLE_RATE", "0"))
+PROFILER_DIR = Path(os.getenv("PROFILER_DIR", "profiles"))
+PROFILER_MAX_REPORTS = int(os.getenv("PROFILER_MAX_REPORTS", "50"))
+# レポートに含める関数の数とSQL文の数・長さ
+PROFILER_TOP_FUNCTIONS = int(os.getenv("PROFILER_TOP_FUNCTIONS", "40"))
+PROFILER_MAX_STATEMENTS = int(os.getenv("PROFILER_MAX_STATEMENTS", "200"))
+_MAX_STATEMENT_LENGTH = 2000
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+# レポート参照用のエンドポイント自体は計測しない
+_EXCLUDED_PREFIX = "/admin/profiles"
+
+# 計測中のリクエストのSQL記録先（スレッドプールへもコンテキストごと引き継がれる）
+_current_statements: contextvars.ContextVar[Optional[List[dict]]] = contextvars.ContextVar(
+    "profiler_statements", default=None
+)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_statements.get() is not None:
+        conn.info.setdefault("profiler_started", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    statements = _current_statements.get()
+    if statements is None:
+        return
+    started = conn.info.get("profiler_started")
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    statements.append({
+        "sql": statement[:_MAX_STATEMENT_LENGTH],
+        "duration_ms": round(elapsed * 1000, 3),
+        "executemany": executemany,
+        "rows": cursor.rowcount,
+    })
+
+def install_sql_hooks(*engines):
+    """SQLの計測フックをエンジンに登録（プロファイラー有効時のみ呼ぶ）"""
+    for target in {id(e): e for e in engines}.values():
+        event.listen(target, "before_cursor_execute", _before_cursor_execute)
+        event.listen(target, "after_cursor_execute", _after_cursor_execute)
+
+def is_authorized(value: Optional[str], token: str = PROFILER_TOKEN) -> bool:
+    """X-Profile ヘッダーの値がトークンと一致するか（トークン未設定時は常に不一致）"""
+    return bool(token) and value is not None and hmac.compare_digest(value.encode(), token.encode())
+
+class ProfileStore:
+    """レポートをディスク上に上限件数まで保存する（古いものから削除）"""
+
+    def __init__(self, directory: Path = PROFILER_DIR, max_reports: int = PROFILER_MAX_REPORTS):
+        self.directory = directory
+        self.max_reports = max_reports
+        self._lock = threading.Lock()
+
+    def save(self, report: dict):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # ファイル名は時刻順に並ぶようにする
+        path = self.directory / f"{report['started_at_ns']:020d}_{report['id']}.json"
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            paths = sorted(self.directory.glob("*.json"))
+            for old in paths[:max(len(paths) - self.max_reports, 0)]:
+                old.unlink(missing_ok=True)
+
+    def list(self) -> List[dict]:
+        """新しい順の概要（関数・SQLの詳細は含まない）"""
+        summaries = []
+        for path in sorted(self.directory.glob("*.json"), reverse=True):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    report = json.load(f)
+            except (OSError, ValueError):
+                continue
+            summaries.append({
+                key: report.get(key)
+                for key in ("id", "started_at", "method", "path", "query", "status", "duration_ms", "trigger")
+            } | {"sql_count": report["sql"]["count"], "sql_ms": report["sql"]["total_ms"]})
+        return summaries
+
+    def get(self, profile_id: str) -> Optional[dict]:
+        for path in self.directory.glob(f"*_{profile_id}.json"):
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        return None
+
+store = ProfileStore()
+
+def _profile_summary(profiler: cProfile.Profile, limit: int) -> dict:
+    stats = pstats.Stats(profiler)
+    functions = []
+    for (filename, line, name), (calls, primitive_calls, total, cumulative, _) in stats.stats.items():
+        functions.append({
+            "function": f"{filename}:{line}({name})",
+            "calls": calls,
+            "primitive_calls": primitive_calls,
+            "total_ms": round(total * 1000, 3),
+            "cumulative_ms": round(cumulative * 1000, 3),
+        })
+    functions.sort(key=lambda f: f["cumulative_ms"], reverse=True)
+
+    text = io.StringIO()
+    pstats.Stats(profiler, stream=text).sort_stats("cumulative").print_stats(limit)
+    return {"functions": functions[:limit], "text": text.getvalue()}
+
+class ProfilerMiddleware:
+    """指定または抽出されたリクエストを計測するASGIミドルウェア（PROFILER_ENABLED=1 のときだけ組み込む）"""
+
+    def __init__(self, app, profile_store: ProfileStore = store, token: str = PROFILER_TOKEN, sample_rate: float = PROFILER_SAMPLE_RATE):
+        self.app = app
+        self.store = profile_store
+        self.token = token
+        self.sample_rate = sample_rate
+        self._active = False
+
+    def _trigger(self, scope) -> Optional[str]:
+        header = PROFILE_HEADER.lower().encode()
+        for name, value in scope.get("headers", []):
+            if name == header and is_authorized(value.decode("latin-1"), self.token):
+                return "header"
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return "sample"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self._active or scope["path"].startswith(_EXCLUDED_PREFIX):
+            await self.app(scope, receive, send)
+            return
+        trigger = self._trigger(scope)
+        if trigger is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = uuid.uuid4().hex[:16]
+        status = {"code": None}
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message = {**message, "headers": list(message.get("headers", [])) + [
+                    (PROFILE_ID_HEADER.lower().encode(), profile_id.encode())
+                ]}
+            await send(message)
+
+        statements: List[dict] = []
+        token = _current_statements.set(statements)
+        profiler = cProfile.Profile()
+        started_at = datetime.now(timezone.utc)
+        started_at_ns = time.time_ns()
+        started = time.perf_counter()
+        self._active = True
+        profiler.enable()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            profiler.disable()
+            self._active = False
+            duration = time.perf_counter() - started
+            _current_statements.reset(token)
+
+            report = {
+                "id": profile_id,
+                "started_at": started_at.isoformat(),
+                "started_at_ns": started_at_ns,
+                "method": scope["method"],
+                "path": scope["path"],
+                "query": scope.get("query_string", b"").decode("latin-1"),
+                "status": status["code"],
+                "duration_ms": round(duration * 1000, 3),
+                "trigger": trigger,
+                "sql": {
+                    "count": len(statements),
+                    "total_ms": round(sum(s["duration_ms"] for s in statements), 3),
+                    "statements": statements[:PROFILER_MAX_STATEMENTS],
+                },
+            }
+            try:
+                report["profile"] = _profile_summary(profiler, PROFILER_TOP_FUNCTIONS)
+                await run_in_threadpool(self.store.save, report)
+                print(f"Profile {profile_id} saved: {scope['method']} {scope['path']} {report['duration_ms']}ms")
+            except Exception as e:
+                print(f"Failed to save profile {profile_id}: {e}")
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Optional, List, Dict, Any
 from datetime import datetime
 
 class FolderBase(BaseModel):
@@ -12,10 +12,42 @@ class FolderCreate(FolderBase):
 class Folder(FolderBase):
     id: int
     created_at: datetime
+    file_count: int = 0
+    head_bytes: int = 0
+    retained_bytes: int = 0
+    # 子孫フォルダを含む集計値
+    subtree_file_count: int = 0
+    subtree_head_bytes: int = 0
+    subtree_retained_bytes: int = 0
     children: List['Folder'] = []
 
     class Config:
         from_attributes = True  # orm_modeの代わりにfrom_attributesを使用
 
+class FolderNode(FolderBase):
+    """遅延展開用のフォルダノード（children は要求された深さまでのみ含まれる）"""
+    id: int
+    created_at: datetime
+    file_count: int = 0
+    head_bytes: int = 0
+    retained_bytes: int = 0
+    child_count: int = 0
+    has_children: bool = False
+    children: List['FolderNode'] = []
+
+class FileRef(BaseModel):
+    filename: str
+    folder_id: Optional[int] = None
+
+class VersionBatchRequest(BaseModel):
+    """複数ファイルのバージョン履歴の一括取得（files を省略するとフォルダ内の全ファイル）"""
+    files: Optional[List[FileRef]] = None
+    folder_id: Optional[int] = None
+
+class JobCreate(BaseModel):
+    type: str
+    params: Dict[str, Any] = {}
+
 # 循環参照を解決するために、後から追加
-Folder.update_forward_refs()
\ No newline at end of file
+Folder.update_forward_refs()
+FolderNode.update_forward_refs()
\ No newline at end of file
@@ -1,10 +1,38 @@
 import os
-from sqlalchemy.orm import Session
-from sqlalchemy import desc, func
-from .database import FileVersion, Folder
-from typing import Optional, List, Dict, Union
+import hashlib
+from datetime import datetime, timezone
+from sqlalchemy.orm import Session, aliased, defer
+from sqlalchemy import and_, desc, func, or_, literal, literal_column, insert, select, text, tuple_, type_coerce, LargeBinary
+from .database import FileVersion, Folder, FileDerivative, UploadSession, DATABASE_URL
+from .derivatives import DerivativeService
+from .changes import ChangeLogService
+from .events import bus, ChangeEvent, FOLDER_CREATED, FOLDER_UPDATED, FOLDER_DELETED, FILE_VERSION_SAVED, VERSIONS_PRUNED, STATS_RECOMPUTED
+from typing import Optional, Iterator, List, Dict, Tuple, Union
 from io import BytesIO
 
+# 保持するバージョン数（最新版を含む）
+RETAINED_VERSIONS = 3
+
+# バージョン履歴の一括取得で一度に指定できるファイル数
+VERSION_BATCH_MAX_FILES = int(os.getenv("VERSION_BATCH_MAX_FILES", "1000"))
+
+def _as_db_time(value: datetime) -> datetime:
+    """比較用の時刻に変換（タイムゾーンなしはUTCとみなす。SQLiteはUTCのタイムゾーンなしで保存される）"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    if DATABASE_URL.startswith("sqlite"):
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+class FileConflictError(Exception):
+    """移動先・名前変更先に同名のファイルが既に存在する"""
+
+class FolderCycleError(Exception):
+    """フォルダを自身またはその子孫の下へ移動しようとした"""
+
+# フォルダの移動を直列化するアドバイザリロックのキー（PostgreSQL。循環の確認と更新の間に他の移動が入らないように）
+FOLDER_MOVE_LOCK_KEY = 0x66766D02
+
 class FolderService:
     @staticmethod
     def create_folder(
@@ -34,6 +62,9 @@ class FolderService:
         )
 
         db.add(new_folder)
+        db.flush()
+        bus.publish(db, ChangeEvent(type=FOLDER_CREATED, folder_id=new_folder.id))
+        ChangeLogService.record(db, "folder", "create", folder_id=new_folder.id)
         db.commit()
         db.refresh(new_folder)
 
@@ -41,18 +72,438 @@ class FolderService:
 
         return new_folder
 
+    @staticmethod
+    def ensure_folder_paths(
+        db: Session,
+        paths: List[Tuple[str, ...]],
+        parent_id: Optional[int] = None
+    ) -> Dict[Tuple[str, ...], Optional[int]]:
+        """
+        フォルダ階層をまとめて作成し、パス（名前のタプル）からフォルダIDへの対応を返す
+
+        既存のフォルダは再利用する。階層ごとに一括でINSERTし、コミットは1回だけ行う。
+        """
+        existing = {
+            (folder.parent_id, folder.name): folder.id
+            for folder in db.query(Folder.id, Folder.name, Folder.parent_id).all()
+        }
+        existing_ids = set(existing.values())
+
+        # 途中の階層も含めて、浅い順に作成する
+        all_paths = {path[:depth] for path in paths for depth in range(1, len(path) + 1)}
+        ids: Dict[Tuple[str, ...], Optional[int]] = {(): parent_id}
+        created = 0
+
+        for depth in sorted({len(path) for path in all_paths}):
+            new_folders = {}
+            for path in sorted(p for p in all_paths if len(p) == depth):
+                folder_parent_id = ids[path[:-1]]
+                folder_id = existing.get((folder_parent_id, path[-1]))
+                if folder_id is not None:
+                    ids[path] = folder_id
+                else:
+                    new_folders[path] = Folder(name=path[-1], parent_id=folder_parent_id)
+
+            if new_folders:
+                db.add_all(new_folders.values())
+                db.flush()
+                for path, folder in new_folders.items():
+                    ids[path] = folder.id
+                    existing[(folder.parent_id, folder.name)] = folder.id
+                    bus.publish(db, ChangeEvent(type=FOLDER_CREATED, folder_id=folder.id))
+                created += len(new_folders)
+
+        for path in sorted(all_paths, key=len):
+            if ids[path] not in existing_ids:
+                ChangeLogService.record(db, "folder", "create", folder_id=ids[path])
+
+        db.commit()
+        print(f"Ensured {len(all_paths)} folders ({created} created)")
+
+        return ids
+
     @staticmethod
     def get_folder_tree(db: Session) -> List[Folder]:
-        # ツリー状のフォルダ構造を取得
+        # ツリー状のフォルダ構造を取得（サブツリー全体の集計値も計算）
         def build_tree(parent_id=None):
             folders = db.query(Folder).filter(Folder.parent_id == parent_id).all()
             for folder in folders:
                 folder.children = build_tree(folder.id)
+                folder.subtree_file_count = (folder.file_count or 0) + sum(
+                    child.subtree_file_count for child in folder.children
+                )
+                folder.subtree_head_bytes = (folder.head_bytes or 0) + sum(
+                    child.subtree_head_bytes for child in folder.children
+                )
+                folder.subtree_retained_bytes = (folder.retained_bytes or 0) + sum(
+                    child.subtree_retained_bytes for child in folder.children
+                )
             return folders
 
         return build_tree()
 
+    @staticmethod
+    def get_folder_children(db: Session, parent_id: Optional[int] = None, depth: int = 1) -> List[dict]:
+        """
+        指定フォルダの子孫を depth 階層分だけ取得（parent_id が None の場合はルート直下から）
+
+        再帰CTEで1回のクエリにまとめ、各ノードの子フォルダ数も同じクエリで数える。
+        """
+        base = db.query(
+            Folder.id,
+            Folder.name,
+            Folder.parent_id,
+            Folder.created_at,
+            Folder.file_count,
+            Folder.head_bytes,
+            Folder.retained_bytes,
+            literal_column("1").label("depth")
+        )
+        if parent_id is None:
+            base = base.filter(Folder.parent_id.is_(None))
+        else:
+            base = base.filter(Folder.parent_id == parent_id)
+
+        subtree = base.cte("subtree", recursive=True)
+        child = aliased(Folder)
+        subtree = subtree.union_all(
+            db.query(
+                child.id,
+                child.name,
+                child.parent_id,
+                child.created_at,
+                child.file_count,
+                child.head_bytes,
+                child.retained_bytes,
+                subtree.c.depth + 1
+            ).join(subtree, child.parent_id == subtree.c.id).filter(subtree.c.depth < depth)
+        )
+
+        grandchild = aliased(Folder)
+        child_count = db.query(func.count(grandchild.id)).filter(
+            grandchild.parent_id == subtree.c.id
+        ).correlate(subtree).scalar_subquery()
+
+        rows = db.query(subtree, child_count.label("child_count")).order_by(
+            subtree.c.depth, subtree.c.name, subtree.c.id
+        ).all()
+
+        # 浅い順に並んでいるので、親ノードは常に先に作られている
+        nodes: Dict[int, dict] = {}
+        roots = []
+        for row in rows:
+            node = {
+                "id": row.id,
+                "name": row.name,
+                "parent_id": row.parent_id,
+                "created_at": row.created_at,
+                "file_count": row.file_count or 0,
+                "head_bytes": row.head_bytes or 0,
+                "retained_bytes": row.retained_bytes or 0,
+                "child_count": row.child_count,
+                "has_children": row.child_count > 0,
+                "children": []
+            }
+            nodes[row.id] = node
+            if row.depth == 1:
+                roots.append(node)
+            else:
+                nodes[row.parent_id]["children"].append(node)
+
+        return roots
+
+    @staticmethod
+    def _subtree_ids(db: Session, folder_id: int) -> List[int]:
+        """フォルダ自身とその子孫のIDを再帰CTEの1クエリで取得。UNION で重複を除くため循環があっても終わる"""
+        subtree = db.query(Folder.id).filter(Folder.id == folder_id).cte("subtree", recursive=True)
+        child = aliased(Folder)
+        subtree = subtree.union(
+            db.query(child.id).join(subtree, child.parent_id == subtree.c.id)
+        )
+        return [row.id for row in db.query(subtree.c.id).all()]
+
+    @staticmethod
+    def _ancestor_ids(db: Session, folder_id: int):
+        """フォルダ自身とその祖先のIDを返す再帰CTE（列名 id）"""
+        ancestors = db.query(Folder.id, Folder.parent_id).filter(Folder.id == folder_id).cte("ancestors", recursive=True)
+        parent = aliased(Folder)
+        return ancestors.union(
+            db.query(parent.id, parent.parent_id).join(ancestors, parent.id == ancestors.c.parent_id)
+        )
+
+    @staticmethod
+    def delete_folder(db: Session, folder_id: int, memo: Optional[str] = None) -> Dict[str, int]:
+        """
+        フォルダ以下の全ファイルを論理削除（フォルダは残し、各ファイルは保持期間内なら復元可能）
+
+        各ファイルの最新版が削除記録でなければ、次のバージョン番号の削除記録を INSERT ... SELECT で一括作成し、
+        保持数を超えたバージョンの削除と集計値の更新もそれぞれ1文で行う（バージョンやコンテンツは読み込まない）。
+        """
+        # 以降の一括更新は取得したIDで絞り込む（SQLite は WITH で始まる文の更新件数を返さないため）
+        subtree = FolderService._subtree_ids(db, folder_id)
+
+        heads = db.query(
+            FileVersion.filename,
+            FileVersion.folder_id,
+            func.max(FileVersion.version).label("max_version")
+        ).filter(
+            FileVersion.folder_id.in_(subtree)
+        ).group_by(FileVersion.filename, FileVersion.folder_id).subquery()
+
+        deleted = db.execute(
+            insert(FileVersion).from_select(
+                [
+                    FileVersion.filename,
+                    FileVersion.version,
+                    FileVersion.file_content,
+                    FileVersion.folder_id,
+                    FileVersion.memo,
+                    FileVersion.operation,
+                    FileVersion.file_size,
+                    FileVersion.content_hash
+                ],
+                select(
+                    FileVersion.filename,
+                    FileVersion.version + 1,
+                    literal(b"", FileVersion.file_content.type),
+                    FileVersion.folder_id,
+                    literal(memo or "フォルダ削除", FileVersion.memo.type),
+                    literal("delete"),
+                    literal(0, FileVersion.file_size.type),
+                    literal(FileVersionService.compute_hash(b""))
+                ).join(
+                    heads,
+                    (FileVersion.filename == heads.c.filename)
+                    & (FileVersion.folder_id == heads.c.folder_id)
+                    & (FileVersion.version == heads.c.max_version)
+                ).where(FileVersion.operation != "delete")
+            ).returning(FileVersion.folder_id, FileVersion.filename, FileVersion.version)
+        ).all()
+
+        # 保持数を超えたバージョンを削除（派生データは ON DELETE CASCADE で削除される）
+        newest = aliased(FileVersion)
+        max_version = select(func.max(newest.version)).where(
+            newest.filename == FileVersion.filename,
+            newest.folder_id == FileVersion.folder_id
+        ).scalar_subquery()
+        pruned = db.query(FileVersion).filter(
+            FileVersion.folder_id.in_(subtree),
+            FileVersion.version <= max_version - RETAINED_VERSIONS
+        ).delete(synchronize_session=False)
+
+        # 削除後は全ファイルが削除済みなので、件数・最新版サイズは0、保持サイズは残ったバージョンから求める
+        retained = select(func.coalesce(func.sum(FileVersion.file_size), 0)).where(
+            FileVersion.folder_id == Folder.id
+        ).scalar_subquery()
+        folders = db.query(Folder).filter(Folder.id.in_(subtree)).update({
+            Folder.file_count: 0,
+            Folder.head_bytes: 0,
+            Folder.retained_bytes: retained
+        }, synchronize_session=False)
+
+        for change_folder_id in {row.folder_id for row in deleted}:
+            bus.publish(db, ChangeEvent(type=FILE_VERSION_SAVED, folder_id=change_folder_id))
+        bus.publish(db, ChangeEvent(type=FOLDER_UPDATED, folder_id=folder_id))
+        ChangeLogService.record_many(db, [
+            {"entity": "file", "operation": "delete", "folder_id": row.folder_id,
+             "filename": row.filename, "version": row.version, "file_size": 0}
+            for row in deleted
+        ])
+
+        db.commit()
+        print(f"Logically deleted folder {folder_id}: {folders} folders, {len(deleted)} files, pruned {pruned} versions")
+
+        return {"folders": folders, "files": len(deleted), "pruned_versions": pruned}
+
+    @staticmethod
+    def purge_folder(db: Session, folder_id: int) -> Dict[str, int]:
+        """
+        フォルダとその子孫、含まれる全バージョンを物理削除
+
+        バージョンは1文の DELETE で削除し、子孫フォルダ・派生データ・アップロードセッションは
+        フォルダの DELETE からデータベースの ON DELETE CASCADE で削除する。読み込むのはフォルダIDだけ。
+        """
+        folder_ids = FolderService._subtree_ids(db, folder_id)
+        upload_ids = [
+            row.id for row in db.query(UploadSession.id).filter(UploadSession.folder_id.in_(folder_ids)).all()
+        ]
+
+        # ON DELETE の設定によらずルートへ移らないよう、バージョンは明示的に削除する
+        versions = db.query(FileVersion).filter(
+            FileVersion.folder_id.in_(folder_ids)
+        ).delete(synchronize_session=False)
+        db.query(Folder).filter(Folder.id == folder_id).delete(synchronize_session=False)
+
+        bus.publish(db, ChangeEvent(type=FOLDER_DELETED, folder_id=folder_id))
+        ChangeLogService.record_many(db, [
+            {"entity": "folder", "operation": "delete", "folder_id": deleted_id}
+            for deleted_id in folder_ids
+        ])
+
+        db.commit()
+
+        # 一時保存されていたチャンクを削除（セッションの行は CASCADE で削除済み）
+        from .uploads import UploadSessionService
+        for upload_id in upload_ids:
+            UploadSessionService.staging_path(upload_id).unlink(missing_ok=True)
+
+        print(f"Purged folder {folder_id}: {len(folder_ids)} folders, {versions} versions")
+
+        return {"folders": len(folder_ids), "versions": versions}
+
+    @staticmethod
+    def move_folder(db: Session, folder_id: int, target_parent_id: Optional[int]) -> Folder:
+        """
+        フォルダを別の親フォルダの下へ移動（target_parent_id が None の場合はルート）
+
+        子孫・ファイルは親子関係と folder_id で辿るため、更新はフォルダ1行だけ。移動先が自身または
+        その子孫の場合は FolderCycleError、移動先に同名のフォルダがある場合は FileConflictError。
+        """
+        folder = db.query(Folder).filter(Folder.id == folder_id).one()
+        if folder.parent_id == target_parent_id:
+            return folder
+
+        if DATABASE_URL.startswith("postgresql"):
+            db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": FOLDER_MOVE_LOCK_KEY})
+
+        if db.query(Folder.id).filter(
+            Folder.parent_id == target_parent_id,
+            Folder.name == folder.name,
+            Folder.id != folder_id
+        ).first():
+            db.rollback()
+            raise FileConflictError(f"移動先に '{folder.name}' が既に存在します")
+
+        db.query(Folder).filter(Folder.id == folder_id).update(
+            {Folder.parent_id: target_parent_id}, synchronize_session=False
+        )
+
+        # 更新後に移動先から祖先を辿り、自身に戻れば循環（SQLite では更新で書き込みロックを取ってから確認する）
+        if target_parent_id is not None:
+            ancestors = FolderService._ancestor_ids(db, target_parent_id)
+            if db.query(ancestors.c.id).filter(ancestors.c.id == folder_id).first():
+                db.rollback()
+                raise FolderCycleError("フォルダを自身またはその子孫の下へは移動できません")
+
+        bus.publish(db, ChangeEvent(type=FOLDER_UPDATED, folder_id=folder_id))
+        ChangeLogService.record(db, "folder", "update", folder_id=folder_id)
+        db.commit()
+        db.refresh(folder)
+
+        print(f"Moved folder {folder_id} under {target_parent_id}")
+
+        return folder
+
+    @staticmethod
+    def apply_stats_delta(
+        db: Session,
+        folder_id: Optional[int],
+        file_count: int = 0,
+        head_bytes: int = 0,
+        retained_bytes: int = 0
+    ):
+        """フォルダの集計値を差分で更新（コミットは呼び出し側で行う）"""
+        if folder_id is None or not (file_count or head_bytes or retained_bytes):
+            return
+
+        db.query(Folder).filter(Folder.id == folder_id).update({
+            Folder.file_count: Folder.file_count + file_count,
+            Folder.head_bytes: Folder.head_bytes + head_bytes,
+            Folder.retained_bytes: Folder.retained_bytes + retained_bytes
+        }, synchronize_session=False)
+
+    @staticmethod
+    def recompute_stats(db: Session) -> int:
+        """全フォルダの集計値を file_versions から一括で再計算"""
+        # 保持されている全バージョンの合計サイズ
+        retained = dict(
+            db.query(FileVersion.folder_id, func.sum(FileVersion.file_size))
+            .filter(FileVersion.folder_id.isnot(None))
+            .group_by(FileVersion.folder_id)
+            .all()
+        )
+
+        # 各ファイルの最新バージョン（削除済みを除く）の件数と合計サイズ
+        latest = db.query(
+            FileVersion.filename,
+            FileVersion.folder_id,
+            func.max(FileVersion.version).label("max_version")
+        ).filter(
+            FileVersion.folder_id.isnot(None)
+        ).group_by(FileVersion.filename, FileVersion.folder_id).subquery()
+
+        heads = {
+            folder_id: (count, size)
+            for folder_id, count, size in db.query(
+                FileVersion.folder_id,
+                func.count(FileVersion.id),
+                func.sum(FileVersion.file_size)
+            ).join(
+                latest,
+                (FileVersion.filename == latest.c.filename)
+                & (FileVersion.folder_id == latest.c.folder_id)
+                & (FileVersion.version == latest.c.max_version)
+            ).filter(
+                FileVersion.operation != "delete"
+            ).group_by(FileVersion.folder_id).all()
+        }
+
+        folder_ids = [folder_id for (folder_id,) in db.query(Folder.id).all()]
+        db.bulk_update_mappings(Folder, [
+            {
+                "id": folder_id,
+                "file_count": heads.get(folder_id, (0, 0))[0],
+                "head_bytes": heads.get(folder_id, (0, 0))[1] or 0,
+                "retained_bytes": retained.get(folder_id) or 0
+            }
+            for folder_id in folder_ids
+        ])
+        bus.publish(db, ChangeEvent(type=STATS_RECOMPUTED))
+        db.commit()
+
+        print(f"Recomputed stats for {len(folder_ids)} folders")
+        return len(folder_ids)
+
 class FileVersionService:
+    @staticmethod
+    def detect_operation(db: Session, filename: str, folder_id: Optional[int] = None) -> str:
+        """既存ファイルなら'update'、新規なら'create'"""
+        existing = db.query(FileVersion.id).filter(
+            FileVersion.filename == filename,
+            FileVersion.folder_id == folder_id
+        ).first()
+
+        return "update" if existing else "create"
+
+    @staticmethod
+    def compute_hash(file_content: bytes) -> str:
+        return hashlib.sha256(file_content).hexdigest()
+
+    @staticmethod
+    def get_identical_head(
+        db: Session,
+        filename: str,
+        content_hash: str,
+        file_size: int,
+        folder_id: Optional[int] = None
+    ) -> Optional[FileVersion]:
+        """最新バージョンが同一内容（サイズとSHA-256が一致）ならそのバージョンを返す"""
+        head = db.query(FileVersion).options(defer(FileVersion.file_content)).filter(
+            FileVersion.filename == filename,
+            FileVersion.folder_id == folder_id
+        ).order_by(desc(FileVersion.version)).first()
+
+        if not head or head.operation == "delete" or head.file_size != file_size:
+            return None
+
+        # ハッシュ未計算の古いバージョンはその場で計算して比較する（保存はオンライン移行のバックフィルに任せ、
+        # 呼び出し元のトランザクションをここでコミットしない）
+        head_hash = head.content_hash
+        if head_hash is None:
+            head_hash = FileVersionService.compute_hash(head.file_content or b"")
+
+        return head if head_hash == content_hash.lower() else None
+
     @staticmethod
     async def save_file_version(
         db: Session,
@@ -61,17 +512,33 @@ class FileVersionService:
         memo: Optional[str],
         operation: str,
         folder_id: Optional[int] = None,
-        mime_type: Optional[str] = None
+        mime_type: Optional[str] = None,
+        force: bool = False
     ) -> FileVersion:
         print(f"Saving file version: filename={filename}, folder_id={folder_id}, operation={operation}")
 
-        # 現在の最大バージョン番号を取得
-        max_version = db.query(func.max(FileVersion.version)).filter(
+        content_hash = FileVersionService.compute_hash(file_content)
+
+        # 最新バージョンと同一内容なら新しいバージョンを作らない（保持枠を無駄にしないため）
+        if not force and operation != "delete":
+            identical = FileVersionService.get_identical_head(
+                db, filename, content_hash, len(file_content), folder_id
+            )
+            if identical:
+                print(f"Content is identical to version {identical.version}, skipping new version")
+                return identical
+
+        # 現在の最新バージョンを取得（バージョン番号と集計値の差分計算に使用）
+        head = db.query(
+            FileVersion.version,
+            FileVersion.operation,
+            FileVersion.file_size
+        ).filter(
             FileVersion.filename == filename,
             FileVersion.folder_id == folder_id
-        ).scalar() or 0
+        ).order_by(desc(FileVersion.version)).first()
 
-        new_version = max_version + 1
+        new_version = (head.version if head else 0) + 1
 
         # データベースに記録（ファイルコンテンツも含む）
         db_version = FileVersion(
@@ -82,42 +549,488 @@ class FileVersionService:
             memo=memo,
             operation=operation,
             file_size=len(file_content),
-            mime_type=mime_type
+            mime_type=mime_type,
+            content_hash=content_hash
         )
 
         db.add(db_version)
+        db.flush()
+
+        # フォルダの集計値を同じトランザクションで更新
+        was_live = head is not None and head.operation != "delete"
+        is_live = operation != "delete"
+        FolderService.apply_stats_delta(
+            db,
+            folder_id,
+            file_count=int(is_live) - int(was_live),
+            head_bytes=(len(file_content) if is_live else 0) - ((head.file_size or 0) if was_live else 0),
+            retained_bytes=len(file_content)
+        )
+
+        # 古いバージョンをクリーンアップ（同じトランザクションでコミット）
+        await FileVersionService.cleanup_old_versions(db, filename, folder_id, commit=False)
+
+        bus.publish(db, ChangeEvent(
+            type=FILE_VERSION_SAVED,
+            folder_id=folder_id,
+            filename=filename,
+            version=new_version,
+            operation=operation
+        ))
+        ChangeLogService.record(
+            db, "file", operation,
+            folder_id=folder_id, filename=filename, version=new_version, file_size=len(file_content)
+        )
+
         db.commit()
         db.refresh(db_version)
 
         print(f"File version added to database: ID={db_version.id}, version={new_version}")
 
-        # 古いバージョンをクリーンアップ
-        await FileVersionService.cleanup_old_versions(db, filename, folder_id)
+        # プレビュー用の派生データをバックグラウンドで生成
+        if operation != "delete":
+            DerivativeService.schedule(db_version.id, file_content, mime_type)
 
         return db_version
 
     @staticmethod
-    async def cleanup_old_versions(db: Session, filename: str, folder_id: Optional[int] = None):
-        # 4バージョンより古いレコードを取得
+    async def cleanup_old_versions(
+        db: Session,
+        filename: str,
+        folder_id: Optional[int] = None,
+        commit: bool = True
+    ):
+        # 保持数より古いレコードを取得（ファイルコンテンツは読み込まない）
         query = db.query(FileVersion).filter(
-            FileVersion.filename == filename
+            FileVersion.filename == filename,
+            FileVersion.folder_id == folder_id
         )
 
-        if folder_id is not None:
-            query = query.filter(FileVersion.folder_id == folder_id)
-
         max_version = query.with_entities(func.max(FileVersion.version)).scalar() or 0
         old_versions = query.filter(
-            FileVersion.version <= max_version - 3
-        ).all()
+            FileVersion.version <= max_version - RETAINED_VERSIONS
+        ).with_entities(FileVersion.id, FileVersion.file_size).all()
 
-        # データベースレコードを削除（ファイルコンテンツも一緒に削除される）
-        for version in old_versions:
-            db.delete(version)
+        if old_versions:
+            old_version_ids = [version.id for version in old_versions]
 
-        db.commit()
+            # 派生データも一緒に削除
+            DerivativeService.evict(db, old_version_ids)
+
+            # データベースレコードを削除（ファイルコンテンツも一緒に削除される）
+            # ファイル名も条件に含め、パーティション分割時は対象のパーティションだけを削除する
+            db.query(FileVersion).filter(
+                FileVersion.filename == filename,
+                FileVersion.id.in_(old_version_ids)
+            ).delete(synchronize_session=False)
+
+            FolderService.apply_stats_delta(
+                db,
+                folder_id,
+                retained_bytes=-sum(version.file_size or 0 for version in old_versions)
+            )
+
+            bus.publish(db, ChangeEvent(type=VERSIONS_PRUNED, folder_id=folder_id, filename=filename))
+
+        if commit:
+            db.commit()
         print(f"Cleaned up {len(old_versions)} old versions for {filename}")
 
+    @staticmethod
+    def bulk_save_versions(db: Session, items: List[dict], commit: bool = True) -> List[dict]:
+        """
+        複数のバージョンを1トランザクションで保存
+
+        items の各要素は filename, file_content と任意の folder_id, memo, mime_type,
+        operation, content_hash, force を持つ。同じファイルが複数含まれる場合は items の順に
+        バージョン番号を採番する。最新バージョンと同一内容のものは（force でなければ）作成しない。
+        戻り値は items と同じ順の結果（filename, folder_id, version, operation, created）。
+        """
+        if not items:
+            return []
+
+        # 対象ファイルの保持中のバージョンを1回のクエリで取得（コンテンツは読み込まない）
+        names = {item["filename"] for item in items}
+        folder_ids = {item.get("folder_id") for item in items}
+        folder_filters = [FileVersion.folder_id.in_([f for f in folder_ids if f is not None])]
+        if None in folder_ids:
+            folder_filters.append(FileVersion.folder_id.is_(None))
+
+        retained: Dict[tuple, List[dict]] = {}
+        for row in db.query(
+            FileVersion.id,
+            FileVersion.filename,
+            FileVersion.folder_id,
+            FileVersion.version,
+            FileVersion.operation,
+            FileVersion.file_size,
+            FileVersion.content_hash
+        ).filter(
+            FileVersion.filename.in_(names),
+            or_(*folder_filters)
+        ).all():
+            retained.setdefault((row.filename, row.folder_id), []).append({
+                "id": row.id,
+                "version": row.version,
+                "operation": row.operation,
+                "file_size": row.file_size,
+                "content_hash": row.content_hash
+            })
+
+        heads = {key: max(rows, key=lambda r: r["version"]) for key, rows in retained.items()}
+        stats: Dict[Optional[int], List[int]] = {}
+        touched = set()
+        results = []
+
+        for item in items:
+            folder_id = item.get("folder_id")
+            key = (item["filename"], folder_id)
+            content = item["file_content"]
+            content_hash = item.get("content_hash") or FileVersionService.compute_hash(content)
+            head = heads.get(key)
+            operation = item.get("operation") or ("update" if head else "create")
+
+            if (
+                not item.get("force")
+                and operation != "delete"
+                and head is not None
+                and head["operation"] != "delete"
+                and head["file_size"] == len(content)
+                and head["content_hash"] == content_hash
+            ):
+                results.append({
+                    "filename": item["filename"],
+                    "folder_id": folder_id,
+                    "version": head["version"],
+                    "operation": "unchanged",
+                    "created": False
+                })
+                continue
+
+            db_version = FileVersion(
+                filename=item["filename"],
+                version=(head["version"] if head else 0) + 1,
+                file_content=content,
+                folder_id=folder_id,
+                memo=item.get("memo"),
+                operation=operation,
+                file_size=len(content),
+                mime_type=item.get("mime_type"),
+                content_hash=content_hash
+            )
+            db.add(db_version)
+
+            # フォルダの集計値の差分
+            was_live = head is not None and head["operation"] != "delete"
+            is_live = operation != "delete"
+            delta = stats.setdefault(folder_id, [0, 0, 0])
+            delta[0] += int(is_live) - int(was_live)
+            delta[1] += (len(content) if is_live else 0) - ((head["file_size"] or 0) if was_live else 0)
+            delta[2] += len(content)
+
+            new_head = {
+                "id": None,
+                "version": db_version.version,
+                "operation": operation,
+                "file_size": len(content),
+                "content_hash": content_hash,
+                "row": db_version
+            }
+            heads[key] = new_head
+            retained.setdefault(key, []).append(new_head)
+            touched.add(key)
+            results.append({
+                "filename": item["filename"],
+                "folder_id": folder_id,
+                "version": db_version.version,
+                "operation": operation,
+                "created": True,
+                "row": db_version
+            })
+
+        db.flush()
+
+        # 保持数を超えたバージョンをまとめて削除
+        prune_ids = []
+        prune_names = set()
+        for key in touched:
+            rows = retained[key]
+            max_version = max(r["version"] for r in rows)
+            for r in rows:
+                if r["version"] <= max_version - RETAINED_VERSIONS:
+                    prune_ids.append(r["id"] if r["id"] is not None else r["row"].id)
+                    prune_names.add(key[0])
+                    stats.setdefault(key[1], [0, 0, 0])[2] -= r["file_size"] or 0
+
+        for start in range(0, len(prune_ids), 1000):
+            chunk = prune_ids[start:start + 1000]
+            DerivativeService.evict(db, chunk)
+            # ファイル名も条件に含め、パーティション分割時は対象のパーティションだけを削除する
+            db.query(FileVersion).filter(
+                FileVersion.filename.in_(prune_names),
+                FileVersion.id.in_(chunk)
+            ).delete(synchronize_session=False)
+
+        for folder_id, (file_count, head_bytes, retained_bytes) in stats.items():
+            FolderService.apply_stats_delta(db, folder_id, file_count, head_bytes, retained_bytes)
+
+        # イベントはフォルダ単位でまとめて発行
+        for folder_id in {key[1] for key in touched}:
+            bus.publish(db, ChangeEvent(type=FILE_VERSION_SAVED, folder_id=folder_id))
+
+        for result in results:
+            if result["created"]:
+                ChangeLogService.record(
+                    db, "file", result["operation"],
+                    folder_id=result["folder_id"],
+                    filename=result["filename"],
+                    version=result["version"],
+                    file_size=result["row"].file_size
+                )
+
+        # コミット後の再読み込みを避けるため、IDはフラッシュ済みの今のうちに取り出す
+        for result in results:
+            row = result.pop("row", None)
+            if row is not None:
+                result["id"] = row.id
+
+        if commit:
+            db.commit()
+
+        print(f"Bulk saved {sum(r['created'] for r in results)}/{len(items)} versions, pruned {len(prune_ids)}")
+
+        return results
+
+    @staticmethod
+    def _head_metadata(db: Session, filename: str, folder_id: Optional[int]):
+        """最新バージョンのメタデータ（コンテンツは読み込まない）"""
+        return db.query(
+            FileVersion.id,
+            FileVersion.version,
+            FileVersion.operation,
+            FileVersion.file_size,
+            FileVersion.content_hash
+        ).filter(
+            FileVersion.filename == filename,
+            FileVersion.folder_id == folder_id
+        ).order_by(desc(FileVersion.version)).first()
+
+    @staticmethod
+    def get_version_metadata(
+        db: Session,
+        filename: str,
+        folder_id: Optional[int] = None,
+        version: Optional[int] = None
+    ):
+        """指定バージョン（省略時は最新）のメタデータ（コンテンツは読み込まない）"""
+        if version is None:
+            return FileVersionService._head_metadata(db, filename, folder_id)
+        return db.query(
+            FileVersion.id,
+            FileVersion.version,
+            FileVersion.operation,
+            FileVersion.file_size,
+            FileVersion.content_hash
+        ).filter(
+            FileVersion.filename == filename,
+            FileVersion.folder_id == folder_id,
+            FileVersion.version == version
+        ).first()
+
+    @staticmethod
+    async def save_version_from(
+        db: Session,
+        source_id: int,
+        filename: str,
+        folder_id: Optional[int] = None,
+        memo: Optional[str] = None,
+        force: bool = False,
+        source_filename: Optional[str] = None
+    ) -> Tuple[Optional[int], int, str, bool]:
+        """
+        既存バージョンのコンテンツから新しいバージョンを作成（復元・コピー用）
+
+        コンテンツは INSERT ... SELECT でデータベース内でコピーし、Pythonには読み込まない。
+        派生データも同様にコピーする。バージョン番号・集計値・保持数の扱いは通常のアップロードと同じ。
+        戻り値は (新しいバージョンのID, バージョン番号, 操作, 作成したか)。
+        最新バージョンと同一内容の場合は作成せず (最新のID, 最新のバージョン番号, 'unchanged', False) を返す。
+        source_filename を指定すると、パーティション分割時にコピー元の検索を1つのパーティションに限定できる。
+        コピー元のバージョンが存在しない（保持数の整理などで削除された）場合は ValueError。
+        """
+        source_filter = [FileVersion.id == source_id]
+        if source_filename is not None:
+            source_filter.append(FileVersion.filename == source_filename)
+
+        source = db.query(
+            FileVersion.file_size,
+            FileVersion.content_hash,
+            FileVersion.mime_type
+        ).filter(*source_filter).first()
+        if source is None:
+            raise ValueError(f"コピー元のバージョン {source_id} が見つかりません")
+        head = FileVersionService._head_metadata(db, filename, folder_id)
+
+        if (
+            not force
+            and head is not None
+            and head.operation != "delete"
+            and source.content_hash is not None
+            and head.file_size == source.file_size
+            and head.content_hash == source.content_hash
+        ):
+            print(f"Content is identical to version {head.version}, skipping new version")
+            return head.id, head.version, "unchanged", False
+
+        new_version = (head.version if head else 0) + 1
+        operation = "update" if head else "create"
+
+        new_id = db.execute(
+            insert(FileVersion).from_select(
+                [
+                    FileVersion.filename,
+                    FileVersion.version,
+                    FileVersion.file_content,
+                    FileVersion.folder_id,
+                    FileVersion.memo,
+                    FileVersion.operation,
+                    FileVersion.file_size,
+                    FileVersion.mime_type,
+                    FileVersion.content_hash
+                ],
+                select(
+                    literal(filename),
+                    literal(new_version),
+                    FileVersion.file_content,
+                    literal(folder_id, FileVersion.folder_id.type),
+                    literal(memo, FileVersion.memo.type),
+                    literal(operation),
+                    FileVersion.file_size,
+                    FileVersion.mime_type,
+                    FileVersion.content_hash
+                ).where(*source_filter)
+            ).returning(FileVersion.id)
+        ).scalar_one()
+
+        # プレビュー用の派生データもコピー（再生成しない）
+        db.execute(
+            insert(FileDerivative).from_select(
+                [
+                    FileDerivative.version_id,
+                    FileDerivative.kind,
+                    FileDerivative.content,
+                    FileDerivative.mime_type,
+                    FileDerivative.meta
+                ],
+                select(
+                    literal(new_id),
+                    FileDerivative.kind,
+                    FileDerivative.content,
+                    FileDerivative.mime_type,
+                    FileDerivative.meta
+                ).where(FileDerivative.version_id == source_id)
+            )
+        )
+
+        # フォルダの集計値を同じトランザクションで更新
+        size = source.file_size or 0
+        was_live = head is not None and head.operation != "delete"
+        FolderService.apply_stats_delta(
+            db,
+            folder_id,
+            file_count=1 - int(was_live),
+            head_bytes=size - ((head.file_size or 0) if was_live else 0),
+            retained_bytes=size
+        )
+
+        # 古いバージョンをクリーンアップ（同じトランザクションでコミット）
+        await FileVersionService.cleanup_old_versions(db, filename, folder_id, commit=False)
+
+        bus.publish(db, ChangeEvent(
+            type=FILE_VERSION_SAVED,
+            folder_id=folder_id,
+            filename=filename,
+            version=new_version,
+            operation=operation
+        ))
+        ChangeLogService.record(
+            db, "file", operation,
+            folder_id=folder_id, filename=filename, version=new_version, file_size=size
+        )
+
+        db.commit()
+        print(f"File version copied in database: source ID={source_id}, new ID={new_id}, version={new_version}")
+
+        return new_id, new_version, operation, True
+
+    @staticmethod
+    def relocate_file(
+        db: Session,
+        filename: str,
+        folder_id: Optional[int],
+        target_folder_id: Optional[int],
+        target_filename: str
+    ) -> int:
+        """
+        ファイルの全バージョンを別のフォルダ・ファイル名へ移動（移動・名前変更用）
+
+        バージョンの行を UPDATE するだけなので、コンテンツやバージョン番号はそのまま。
+        移動先に同名のファイルがある場合は FileConflictError。戻り値は移動したバージョン数。
+        """
+        if (target_filename, target_folder_id) == (filename, folder_id):
+            raise FileConflictError("移動元と移動先が同じです")
+
+        head = FileVersionService._head_metadata(db, filename, folder_id)
+        if head is None:
+            return 0
+
+        if db.query(FileVersion.id).filter(
+            FileVersion.filename == target_filename,
+            FileVersion.folder_id == target_folder_id
+        ).first():
+            raise FileConflictError(f"移動先に '{target_filename}' が既に存在します")
+
+        retained_bytes = db.query(func.coalesce(func.sum(FileVersion.file_size), 0)).filter(
+            FileVersion.filename == filename,
+            FileVersion.folder_id == folder_id
+        ).scalar()
+
+        moved = db.query(FileVersion).filter(
+            FileVersion.filename == filename,
+            FileVersion.folder_id == folder_id
+        ).update({
+            FileVersion.filename: target_filename,
+            FileVersion.folder_id: target_folder_id
+        }, synchronize_session=False)
+
+        # フォルダが変わる場合は集計値を移し替える
+        if target_folder_id != folder_id:
+            is_live = head.operation != "delete"
+            head_bytes = (head.file_size or 0) if is_live else 0
+            FolderService.apply_stats_delta(db, folder_id, -int(is_live), -head_bytes, -retained_bytes)
+            FolderService.apply_stats_delta(db, target_folder_id, int(is_live), head_bytes, retained_bytes)
+
+        # 変更フィードには移動元の削除と移動先の作成として記録する
+        for change_folder_id, change_filename, operation in (
+            (folder_id, filename, "delete"),
+            (target_folder_id, target_filename, "create")
+        ):
+            bus.publish(db, ChangeEvent(
+                type=FILE_VERSION_SAVED,
+                folder_id=change_folder_id,
+                filename=change_filename,
+                version=head.version,
+                operation=operation
+            ))
+            ChangeLogService.record(
+                db, "file", operation,
+                folder_id=change_folder_id, filename=change_filename, version=head.version, file_size=head.file_size
+            )
+
+        db.commit()
+        print(f"Relocated {moved} versions: {filename} (folder {folder_id}) -> {target_filename} (folder {target_folder_id})")
+
+        return moved
+
     @staticmethod
     def get_file_versions(
         db: Session,
@@ -133,6 +1046,60 @@ class FileVersionService:
 
         return query.order_by(desc(FileVersion.version)).all()
 
+    @staticmethod
+    def get_versions_batch(
+        db: Session,
+        files: Optional[List[Tuple[Optional[int], str]]] = None,
+        folder_id: Optional[int] = None
+    ) -> Dict[Tuple[Optional[int], str], List[dict]]:
+        """
+        複数ファイルの保持中のバージョン履歴を1回のクエリで取得（コンテンツは読み込まない）
+
+        files は (folder_id, filename) の組のリスト（folder_id が None はルート）。省略時は folder_id の
+        フォルダ内の全ファイル（削除済みを含む）。戻り値は (folder_id, filename) ごとの新しい順のメタデータ。
+        """
+        query = db.query(
+            FileVersion.filename,
+            FileVersion.folder_id,
+            FileVersion.version,
+            FileVersion.operation,
+            FileVersion.memo,
+            FileVersion.created_at,
+            FileVersion.file_size,
+            FileVersion.mime_type
+        )
+
+        if files is None:
+            query = query.filter(
+                FileVersion.folder_id.is_(None) if folder_id is None else FileVersion.folder_id == folder_id
+            )
+        else:
+            if not files:
+                return {}
+            # (folder_id, filename) の組そのもので絞り込む（NULL は IN で一致しないためルートは別条件）
+            pairs = sorted({(f, filename) for f, filename in files if f is not None})
+            root_names = sorted({filename for f, filename in files if f is None})
+            pair_filters = []
+            if pairs:
+                pair_filters.append(tuple_(FileVersion.folder_id, FileVersion.filename).in_(pairs))
+            if root_names:
+                pair_filters.append(and_(FileVersion.folder_id.is_(None), FileVersion.filename.in_(root_names)))
+            query = query.filter(or_(*pair_filters))
+
+        histories: Dict[Tuple[Optional[int], str], List[dict]] = {}
+        for row in query.order_by(FileVersion.folder_id, FileVersion.filename, desc(FileVersion.version)).all():
+            histories.setdefault((row.folder_id, row.filename), []).append({
+                "version": row.version,
+                "operation": row.operation,
+                "memo": row.memo,
+                "created_at": row.created_at,
+                "file_size": row.file_size,
+                "mime_type": row.mime_type,
+                "folder_id": row.folder_id
+            })
+
+        return histories
+
     @staticmethod
     def get_file_version(
         db: Session,
@@ -151,62 +1118,154 @@ class FileVersionService:
         return query.first()
 
     @staticmethod
-    def get_all_files(db: Session, folder_id: Optional[int] = None) -> List[dict]:
-        try:
-            # デバッグのためのログ出力
-            print(f"Starting get_all_files method with folder_id: {folder_id}")
+    def get_download_version(
+        db: Session,
+        filename: str,
+        version: Optional[int] = None,
+        folder_id: Optional[int] = None
+    ) -> Tuple[Optional[FileVersion], Optional[bytes]]:
+        """
+        ダウンロード用にバージョンと保存されている値をそのまま取得（version 省略時は最新版）
+
+        コンテンツはサイドカー参照を解決せずに返すため、本体がファイルにある場合は
+        呼び出し側でファイルから直接返せる（blob_store.ref_path で判定）。
+        """
+        stored = type_coerce(FileVersion.file_content, LargeBinary).label("stored_content")
+        query = db.query(FileVersion, stored).options(defer(FileVersion.file_content)).filter(
+            FileVersion.filename == filename
+        )
+        if version:
+            query = query.filter(FileVersion.version == version)
+        if folder_id is not None:
+            query = query.filter(FileVersion.folder_id == folder_id)
+
+        row = query.order_by(desc(FileVersion.version)).first()
+        if row is None:
+            return None, None
+        return row[0], row[1]
+
+    @staticmethod
+    def get_preview_version(
+        db: Session,
+        filename: str,
+        version: Optional[int] = None,
+        folder_id: Optional[int] = None
+    ) -> Optional[FileVersion]:
+        """
+        プレビュー用にバージョンを取得（version 省略時は最新版）
+
+        コンテンツは読み込まない（file_content は遅延読み込み）。派生データが生成済みの
+        リクエストでは本体を読まずに済み、未生成の場合だけ参照時に読み込まれる。
+        """
+        query = db.query(FileVersion).options(defer(FileVersion.file_content)).filter(
+            FileVersion.filename == filename
+        )
+        if version:
+            query = query.filter(FileVersion.version == version)
+        if folder_id is not None:
+            query = query.filter(FileVersion.folder_id == folder_id)
+
+        return query.order_by(desc(FileVersion.version)).first()
+
+    @staticmethod
+    def get_latest_version(
+        db: Session,
+        filename: str,
+        folder_id: Optional[int] = None
+    ) -> Optional[FileVersion]:
+        query = db.query(FileVersion).filter(
+            FileVersion.filename == filename
+        )
+
+        if folder_id is not None:
+            query = query.filter(FileVersion.folder_id == folder_id)
+
+        return query.order_by(desc(FileVersion.version)).first()
+
+    @staticmethod
+    def latest_version_ids(db: Session, folder_filter=None, as_of: Optional[datetime] = None):
+        """
+        各ファイル（ファイル名とフォルダの組）の最新バージョンのIDのサブクエリ（列名 filename, version_id）
 
+        結合はファイル名と ID の両方で行う（パーティション分割時にパーティション単位で結合できるように）。
+
+        as_of を指定すると、その時点以前に作成された中で最新のバージョン（削除記録を含む）を
+        ウィンドウ関数で1回のクエリで求める。保持数を超えて削除されたバージョンは対象外。
+        """
+        if as_of is None:
             # サブクエリの変更: 各ファイルの最新バージョンを取得
-            latest_version_query = db.query(
-                FileVersion.filename,
-                FileVersion.folder_id,
-                func.max(FileVersion.id).label('max_version_id')
-            ).group_by(FileVersion.filename, FileVersion.folder_id)
+            # グループ化は (folder_id, filename, version) のインデックスと同じ順にし、インデックス順の集約を可能にする
+            query = db.query(
+                FileVersion.filename.label('filename'),
+                func.max(FileVersion.id).label('version_id')
+            ).group_by(FileVersion.folder_id, FileVersion.filename)
+            if folder_filter is not None:
+                query = query.filter(folder_filter)
+            return query.subquery()
 
-            # フォルダIDでフィルタリングする場合
-            if folder_id is not None:
-                latest_version_query = latest_version_query.filter(
-                    FileVersion.folder_id == folder_id
-                )
+        ranked = db.query(
+            FileVersion.filename.label('filename'),
+            FileVersion.id.label('version_id'),
+            func.row_number().over(
+                partition_by=(FileVersion.folder_id, FileVersion.filename),
+                order_by=FileVersion.version.desc()
+            ).label('rank')
+        ).filter(FileVersion.created_at <= _as_db_time(as_of))
+        if folder_filter is not None:
+            ranked = ranked.filter(folder_filter)
+        ranked = ranked.subquery()
 
-            latest_version_subquery = latest_version_query.subquery()
+        return db.query(ranked.c.filename, ranked.c.version_id).filter(ranked.c.rank == 1).subquery()
 
-            print("Subquery created")
+    @staticmethod
+    def _latest_files_query(
+        db: Session,
+        folder_id: Optional[int] = None,
+        as_of: Optional[datetime] = None,
+        stream: bool = False
+    ):
+        """
+        各ファイルの最新バージョンの一覧クエリ（必要なカラムのみ、コンテンツは読み込まない）
 
-            # 最新バージョンのファイルを取得
-            latest_versions_query = db.query(FileVersion, Folder).outerjoin(
-                Folder,
-                FileVersion.folder_id == Folder.id
-            ).join(
-                latest_version_subquery,
-                FileVersion.id == latest_version_subquery.c.max_version_id
-            )
+        通常は更新日時の新しい順。stream=True の場合は (folder_id, filename) の順にする。
+        更新日時での並べ替えは全件の集約と並べ替えが終わるまで最初の行を返せないが、
+        (folder_id, filename) はインデックスの順のため、集約しながら先頭から返せる。
+        """
+        # フォルダIDでフィルタリングする場合
+        folder_filter = FileVersion.folder_id == folder_id if folder_id is not None else None
+        latest_version_subquery = FileVersionService.latest_version_ids(db, folder_filter, as_of)
 
-            # フォルダIDでフィルタリングする場合
-            if folder_id is not None:
-                latest_versions_query = latest_versions_query.filter(
-                    FileVersion.folder_id == folder_id
-                )
+        # 最新バージョンのファイルを取得
+        latest_versions_query = db.query(
+            FileVersion.filename,
+            FileVersion.version.label('latest_version'),
+            FileVersion.operation.label('latest_operation'),
+            FileVersion.created_at.label('latest_update'),
+            FileVersion.file_size,
+            FileVersion.mime_type,
+            Folder.name.label('folder_name'),
+            Folder.id.label('folder_id')
+        ).outerjoin(
+            Folder,
+            FileVersion.folder_id == Folder.id
+        ).join(
+            latest_version_subquery,
+            (FileVersion.filename == latest_version_subquery.c.filename)
+            & (FileVersion.id == latest_version_subquery.c.version_id)
+        )
 
-            latest_versions = latest_versions_query.order_by(desc(FileVersion.created_at)).all()
-
-            print(f"Found {len(latest_versions)} latest versions")
-
-            # 削除されたファイルも含めて表示
-            result = [
-                {
-                    "filename": version.filename,
-                    "latest_version": version.version,
-                    "latest_operation": version.operation,
-                    "latest_update": version.created_at,
-                    "file_size": version.file_size,
-                    "mime_type": version.mime_type,
-                    "folder_name": folder.name if folder else None,
-                    "folder_id": folder.id if folder else None
-                }
-                for version, folder in latest_versions
-                # 削除されたファイルも表示するように変更
-            ]
+        # 削除されたファイルも含めて表示
+        if stream:
+            return latest_versions_query.order_by(FileVersion.folder_id, FileVersion.filename)
+        return latest_versions_query.order_by(desc(FileVersion.created_at))
+
+    @staticmethod
+    def get_all_files(db: Session, folder_id: Optional[int] = None, as_of: Optional[datetime] = None) -> List[dict]:
+        try:
+            # デバッグのためのログ出力
+            print(f"Starting get_all_files method with folder_id: {folder_id}")
+
+            result = [row._asdict() for row in FileVersionService._latest_files_query(db, folder_id, as_of)]
 
             print(f"Returning {len(result)} files")
             return result
@@ -218,4 +1277,20 @@ class FileVersionService:
             traceback.print_exc()
 
             # エラーを再送出
-            raise
\ No newline at end of file
+            raise
+
+    @staticmethod
+    def iter_all_files(
+        db: Session,
+        folder_id: Optional[int] = None,
+        as_of: Optional[datetime] = None,
+        batch_size: int = 1000
+    ) -> Iterator[dict]:
+        """
+        get_all_files のストリーミング版（順序は (folder_id, filename)）
+
+        サーバーサイドカーソルから batch_size 行ずつ取り出すため、件数によらずメモリ使用量は一定。
+        """
+        query = FileVersionService._latest_files_query(db, folder_id, as_of, stream=True).yield_per(batch_size)
+        for row in query:
+            yield row._asdict()
\ No newline at end of file
@@ -0,0 +1,42 @@
+"""
+NDJSON（改行区切りJSON）のストリーミング応答
+
+1行1オブジェクトで逐次エンコードするため、件数によらず最初のバイトまでの時間とメモリは一定。
+orjson がインストールされていれば使い、なければ標準の json にフォールバックする。
+"""
+import json
+from datetime import date, datetime
+from typing import Iterable, Iterator
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# 1回の送信にまとめる行数
+NDJSON_FLUSH_ROWS = 500
+
+try:
+    import orjson
+
+    def encode_line(obj: dict) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+except ImportError:
+    def _default(value):
+        if isinstance(value, (datetime, date)):
+            return value.isoformat()
+        raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+    def encode_line(obj: dict) -> bytes:
+        return (json.dumps(obj, ensure_ascii=False, default=_default) + "\n").encode("utf-8")
+
+def wants_ndjson(accept: str) -> bool:
+    return NDJSON_MEDIA_TYPE in (accept or "")
+
+def ndjson_lines(rows: Iterable[dict], flush_rows: int = NDJSON_FLUSH_ROWS) -> Iterator[bytes]:
+    """行をNDJSONにエンコードし、flush_rows 行ごとにまとめて返す"""
+    buffer = []
+    for row in rows:
+        buffer.append(encode_line(row))
+        if len(buffer) >= flush_rows:
+            yield b"".join(buffer)
+            buffer = []
+    if buffer:
+        yield b"".join(buffer)
@@ -0,0 +1,256 @@
+"""
+再開可能なチャンクアップロード
+
+セッションを作成し、番号付きチャンクをオフセット指定で送信、現在のオフセットを問い合わせて
+途中から再開し、最後に確定するとFileVersionServiceで新しいバージョンが作成される。
+チャンクはディスク上の一時ファイルに追記し、放置されたセッションは期限切れで削除する。
+"""
+import asyncio
+import os
+import uuid
+import weakref
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import AsyncIterator, Optional, Tuple
+
+import aiofiles
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import ObjectDeletedError
+
+from .database import UploadSession, FileVersion
+from .services import FileVersionService
+
+UPLOAD_STAGING_DIR = Path(os.getenv("UPLOAD_STAGING_DIR", "upload_staging"))
+UPLOAD_SESSION_TTL = int(os.getenv("UPLOAD_SESSION_TTL", str(24 * 60 * 60)))  # 秒
+UPLOAD_MAX_CHUNK_SIZE = int(os.getenv("UPLOAD_MAX_CHUNK_SIZE", str(16 * 1024 * 1024)))
+
+class UploadOffsetMismatch(Exception):
+    """送信されたチャンクのオフセットがサーバー側の受信済みサイズと一致しない"""
+    def __init__(self, expected_offset: int, next_chunk: int):
+        super().__init__(f"expected offset {expected_offset}")
+        self.expected_offset = expected_offset
+        self.next_chunk = next_chunk
+
+class UploadSizeError(Exception):
+    """チャンクまたはファイル全体のサイズが不正"""
+
+class UploadBusyError(Exception):
+    """同じセッションへの別のリクエストが処理中、または既に確定・中止された"""
+
+# セッションごとのロック（このワーカー内で同じセッションへの書き込みを直列化する）
+_session_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+def _session_lock(upload_id: str) -> asyncio.Lock:
+    lock = _session_locks.get(upload_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        _session_locks[upload_id] = lock
+    return lock
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+def _as_utc(value: datetime) -> datetime:
+    # SQLiteではタイムゾーンなしで返るため、UTCとして扱う
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+class UploadSessionService:
+    @staticmethod
+    def staging_path(upload_id: str) -> Path:
+        return UPLOAD_STAGING_DIR / f"{upload_id}.part"
+
+    @staticmethod
+    def create_session(
+        db: Session,
+        filename: str,
+        folder_id: Optional[int] = None,
+        memo: Optional[str] = None,
+        mime_type: Optional[str] = None,
+        total_size: Optional[int] = None
+    ) -> UploadSession:
+        UploadSessionService.purge_expired(db)
+
+        UPLOAD_STAGING_DIR.mkdir(parents=True, exist_ok=True)
+
+        upload = UploadSession(
+            id=uuid.uuid4().hex,
+            filename=filename,
+            folder_id=folder_id,
+            memo=memo,
+            mime_type=mime_type,
+            total_size=total_size,
+            received_size=0,
+            next_chunk=0,
+            expires_at=_utcnow() + timedelta(seconds=UPLOAD_SESSION_TTL)
+        )
+        db.add(upload)
+        db.commit()
+        db.refresh(upload)
+
+        UploadSessionService.staging_path(upload.id).touch()
+        print(f"Upload session created: id={upload.id}, filename={filename}, folder_id={folder_id}")
+
+        return upload
+
+    @staticmethod
+    def get_session(db: Session, upload_id: str) -> Optional[UploadSession]:
+        upload = db.query(UploadSession).get(upload_id)
+        if upload and _as_utc(upload.expires_at) < _utcnow():
+            UploadSessionService.discard(db, upload)
+            return None
+        return upload
+
+    @staticmethod
+    def _claim(db: Session, upload: UploadSession):
+        """
+        セッションの行をロックして最新の状態を読み直す（ロックはコミットまで保持）
+
+        PostgreSQL では SELECT ... FOR UPDATE NOWAIT で他のワーカーの処理中を検出する。
+        待たずに失敗させるのは、待つ間イベントループが止まるため。SQLite では行ロックはなく、
+        ワーカー内のセッションごとのロックだけで直列化する。
+        """
+        try:
+            db.refresh(upload, with_for_update={"nowait": True})
+        except OperationalError:
+            db.rollback()
+            raise UploadBusyError("同じアップロードセッションへの別のリクエストが処理中です")
+        except ObjectDeletedError:
+            db.rollback()
+            raise UploadBusyError("アップロードセッションは既に確定または中止されています")
+
+    @staticmethod
+    async def append_chunk(
+        db: Session,
+        upload: UploadSession,
+        index: int,
+        offset: int,
+        chunks: AsyncIterator[bytes]
+    ) -> UploadSession:
+        """
+        チャンクを一時ファイルに追記（再送された受信済みチャンクは無視する）
+
+        同じセッションへの同時のリクエスト（応答待ちの間の再送など）が同じ一時ファイルを
+        切り詰め・書き込みしないよう、セッションをロックしてからオフセットを確認する。
+        """
+        async with _session_lock(upload.id):
+            UploadSessionService._claim(db, upload)
+            return await UploadSessionService._append_locked(db, upload, index, offset, chunks)
+
+    @staticmethod
+    async def _append_locked(
+        db: Session,
+        upload: UploadSession,
+        index: int,
+        offset: int,
+        chunks: AsyncIterator[bytes]
+    ) -> UploadSession:
+        if index < upload.next_chunk and offset < upload.received_size:
+            # 受信済みチャンクの再送（応答が届かなかった場合など）
+            async for _ in chunks:
+                pass
+            db.rollback()
+            return upload
+
+        if offset != upload.received_size or index != upload.next_chunk:
+            expected_offset, next_chunk = upload.received_size, upload.next_chunk
+            db.rollback()
+            raise UploadOffsetMismatch(expected_offset, next_chunk)
+
+        path = UploadSessionService.staging_path(upload.id)
+        written = 0
+        async with aiofiles.open(path, "r+b" if path.exists() else "wb") as f:
+            # 途中で切断されたチャンクの残骸を切り捨ててから追記
+            await f.seek(offset)
+            await f.truncate()
+            async for data in chunks:
+                written += len(data)
+                if written > UPLOAD_MAX_CHUNK_SIZE:
+                    await f.truncate(offset)
+                    db.rollback()
+                    raise UploadSizeError(f"チャンクサイズが上限（{UPLOAD_MAX_CHUNK_SIZE} バイト）を超えています")
+                if upload.total_size is not None and offset + written > upload.total_size:
+                    await f.truncate(offset)
+                    db.rollback()
+                    raise UploadSizeError("宣言されたファイルサイズを超えています")
+                await f.write(data)
+
+        upload.received_size = offset + written
+        upload.next_chunk = index + 1
+        upload.expires_at = _utcnow() + timedelta(seconds=UPLOAD_SESSION_TTL)
+        db.commit()
+        db.refresh(upload)
+
+        return upload
+
+    @staticmethod
+    async def finalize(db: Session, upload: UploadSession, force: bool = False) -> Tuple[FileVersion, bool]:
+        """
+        受信済みのデータから新しいバージョンを作成
+
+        最新バージョンと同一内容の場合は作成せず、(最新バージョン, False) を返す。
+        書き込み中のチャンクと同時に確定しないよう、append_chunk と同じくセッションをロックする。
+        """
+        async with _session_lock(upload.id):
+            UploadSessionService._claim(db, upload)
+            return await UploadSessionService._finalize_locked(db, upload, force)
+
+    @staticmethod
+    async def _finalize_locked(db: Session, upload: UploadSession, force: bool) -> Tuple[FileVersion, bool]:
+        if upload.total_size is not None and upload.received_size != upload.total_size:
+            raise UploadSizeError(
+                f"受信済みサイズ（{upload.received_size}）が宣言サイズ（{upload.total_size}）と一致しません"
+            )
+
+        path = UploadSessionService.staging_path(upload.id)
+        async with aiofiles.open(path, "rb") as f:
+            content = await f.read(upload.received_size)
+
+        if not force:
+            identical = FileVersionService.get_identical_head(
+                db, upload.filename, FileVersionService.compute_hash(content), len(content), upload.folder_id
+            )
+            if identical:
+                UploadSessionService.discard(db, upload)
+                return identical, False
+
+        operation = FileVersionService.detect_operation(db, upload.filename, upload.folder_id)
+        version = await FileVersionService.save_file_version(
+            db=db,
+            filename=upload.filename,
+            file_content=content,
+            memo=upload.memo,
+            operation=operation,
+            folder_id=upload.folder_id,
+            mime_type=upload.mime_type,
+            force=True
+        )
+
+        UploadSessionService.discard(db, upload)
+        return version, True
+
+    @staticmethod
+    def discard(db: Session, upload: UploadSession):
+        """セッションと一時ファイルを削除"""
+        path = UploadSessionService.staging_path(upload.id)
+        db.delete(upload)
+        db.commit()
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def purge_expired(db: Session) -> int:
+        """期限切れのセッションを削除"""
+        expired = db.query(UploadSession).filter(UploadSession.expires_at < _utcnow()).all()
+        for upload in expired:
+            try:
+                UploadSessionService.staging_path(upload.id).unlink()
+            except FileNotFoundError:
+                pass
+            db.delete(upload)
+        if expired:
+            db.commit()
+            print(f"Purged {len(expired)} expired upload sessions")
+        return len(expired)
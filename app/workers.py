@@ -0,0 +1,31 @@
+"""
+重い処理をリクエストパスの外で実行するためのワーカープール
+"""
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+
+from .database import MEMORY_BUDGET_MB
+
+# プロセス数（0の場合はスレッドで実行。SQLiteやテスト環境向け）
+# メモリ予算が小さい端末では、プロセスを増やさずスレッドで実行する
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "0" if 0 < MEMORY_BUDGET_MB < 1024 else "2"))
+
+_process_pool: Optional[Executor] = None
+
+def get_process_pool() -> Executor:
+    """CPU負荷の高い処理用のプールを取得（初回呼び出し時に生成）"""
+    global _process_pool
+    if _process_pool is None:
+        if WORKER_PROCESSES > 0:
+            _process_pool = ProcessPoolExecutor(max_workers=WORKER_PROCESSES)
+        else:
+            _process_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="worker")
+    return _process_pool
+
+def shutdown_pools():
+    """プールを停止"""
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
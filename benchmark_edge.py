@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+SQLite エッジ構成（Raspberry Pi など）でのアップロード・ダウンロードのスループット計測スクリプト
+
+一時ディレクトリに SQLite データベース（と BLOB_STORE_DIR）を作成し、アプリを同じプロセス内で
+起動して、指定したサイズのファイルを並列にアップロード・ダウンロードする。
+結果は MB/秒 と最大常駐メモリ（ru_maxrss）で表示する。
+
+  python benchmark_edge.py --files 200 --size-kb 256 --concurrency 4 --memory-budget-mb 256
+  python benchmark_edge.py --no-sidecar --memory-limit-mb 512
+
+--memory-limit-mb を指定すると、アプリの読み込み後にアドレス空間の上限（RLIMIT_AS）を設定し、
+メモリの少ない端末を模擬する（上限を超えると MemoryError で失敗する）。
+"""
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+def _peak_rss_mb() -> float:
+    # Linux では KB 単位
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _configure(args, workdir: Path):
+    """アプリの読み込み前に環境変数を設定（設定値はモジュールの読み込み時に決まるため）"""
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{workdir / 'edge.db'}")
+    if not args.no_sidecar:
+        os.environ.setdefault("BLOB_STORE_DIR", str(workdir / "blob_store"))
+    if args.memory_budget_mb:
+        os.environ.setdefault("MEMORY_BUDGET_MB", str(args.memory_budget_mb))
+    os.environ.setdefault("WORKER_PROCESSES", "0")
+    # 計測の妨げにならないよう、アップロードのレート制限は外す
+    os.environ.setdefault("UPLOAD_RATE_PER_CLIENT", "0")
+    os.environ.setdefault("UPLOAD_MAX_CONCURRENT_PER_CLIENT", "0")
+
+def run(args):
+    workdir = Path(tempfile.mkdtemp(prefix="edge_bench_"))
+    _configure(args, workdir)
+
+    from fastapi.testclient import TestClient
+    from app.database import create_tables, engine
+    from app.main import app
+
+    # SQL のログ出力は計測に影響するため止める
+    engine.echo = False
+    create_tables()
+
+    if args.memory_limit_mb:
+        limit = args.memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+    size = args.size_kb * 1024
+    total_mb = size * args.files / 1024 / 1024
+    filenames = [f"edge_bench_{i:05d}.bin" for i in range(args.files)]
+    print(f"データベース: {os.environ['DATABASE_URL']}")
+    print(f"サイドカー: {os.environ.get('BLOB_STORE_DIR') or '無効'}")
+    print(f"{args.files} ファイル × {args.size_kb} KB（合計 {total_mb:.1f} MB）, 並列数 {args.concurrency}")
+    print(f"読み込み後のメモリ: {_peak_rss_mb():.1f} MB")
+
+    with TestClient(app) as client:
+        def upload(filename: str):
+            # ファイルごとに内容を変える（同一内容はスキップされるため）
+            content = os.urandom(size)
+            response = client.post("/files/upload", files={"file": (filename, content, "application/octet-stream")})
+            response.raise_for_status()
+
+        def download(filename: str):
+            response = client.get(f"/files/{filename}/download")
+            response.raise_for_status()
+            if len(response.content) != size:
+                raise ValueError(f"サイズが一致しません: {filename}")
+
+        for label, action in (("アップロード", upload), ("ダウンロード", download)):
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                list(executor.map(action, filenames))
+            elapsed = time.perf_counter() - started
+            print(
+                f"{label}: {elapsed:.2f} 秒, {total_mb / elapsed:.1f} MB/秒, "
+                f"{args.files / elapsed:.1f} ファイル/秒, 最大メモリ {_peak_rss_mb():.1f} MB"
+            )
+
+    database_size = sum(p.stat().st_size for p in workdir.glob("edge.db*"))
+    print(f"データベースのサイズ: {database_size / 1024 / 1024:.1f} MB（作業ディレクトリ: {workdir}）")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SQLite エッジ構成のスループット計測")
+    parser.add_argument("--files", type=int, default=200, help="ファイル数（デフォルト: 200）")
+    parser.add_argument("--size-kb", type=int, default=256, help="1ファイルのサイズ（KB、デフォルト: 256）")
+    parser.add_argument("--concurrency", type=int, default=4, help="並列数（デフォルト: 4）")
+    parser.add_argument("--memory-budget-mb", type=int, default=None, help="MEMORY_BUDGET_MB として設定する値")
+    parser.add_argument("--memory-limit-mb", type=int, default=None, help="アドレス空間の上限（MB）")
+    parser.add_argument("--no-sidecar", action="store_true", help="コンテンツをデータベースの行内に保存する")
+
+    run(parser.parse_args())
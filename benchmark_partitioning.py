@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+file_versions のパーティション分割の効果を計測するスクリプト（PostgreSQL）
+
+計測用のスキーマ（bench_partitioning）に、file_versions と同じ列・インデックスを持つ
+分割なしのテーブルとファイル名のハッシュで分割したテーブルを作り、同じ合成データ（メタデータのみ、
+既定で1000万行）を投入して、次の処理の時間（中央値と p95）を比較する。
+  - list: フォルダ内の各ファイルの最新版の一覧（FileVersionService の一覧と同じ形のクエリ）
+  - head: ファイルの最新版の取得（アップロード・ダウンロード時の検索）
+  - prune: 保持数を超えたバージョンの削除（ロールバックするためデータは変わらない）
+  - vacuum: テーブル全体と1パーティションの VACUUM
+
+  python benchmark_partitioning.py --rows 10000000 --partitions 16 --folders 1000
+  python benchmark_partitioning.py --skip-load   # 投入済みのデータで再計測
+"""
+import argparse
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from sqlalchemy import create_engine, text
+
+from app.database import DATABASE_URL
+from app.services import RETAINED_VERSIONS
+
+SCHEMA = "bench_partitioning"
+PLAIN = f"{SCHEMA}.file_versions_plain"
+PARTITIONED = f"{SCHEMA}.file_versions_part"
+
+COLUMNS = """
+    id BIGINT NOT NULL,
+    filename VARCHAR NOT NULL,
+    version INTEGER NOT NULL,
+    file_content BYTEA,
+    folder_id INTEGER,
+    memo TEXT,
+    operation VARCHAR NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+    file_size BIGINT,
+    mime_type VARCHAR,
+    content_hash VARCHAR(64)
+"""
+
+LIST_SQL = """
+SELECT v.filename, v.version, v.operation, v.created_at, v.file_size, v.mime_type
+FROM {table} v
+JOIN (
+    SELECT filename, max(id) AS version_id FROM {table}
+    WHERE folder_id = :folder_id GROUP BY filename, folder_id
+) latest ON v.filename = latest.filename AND v.id = latest.version_id
+ORDER BY v.created_at DESC
+"""
+
+HEAD_SQL = """
+SELECT id, version, operation, file_size, content_hash FROM {table}
+WHERE filename = :filename AND folder_id = :folder_id ORDER BY version DESC LIMIT 1
+"""
+
+PRUNE_SQL = """
+DELETE FROM {table} WHERE filename = :filename AND id IN (
+    SELECT id FROM {table} WHERE filename = :filename AND folder_id = :folder_id
+    AND version <= (SELECT max(version) FROM {table} WHERE filename = :filename AND folder_id = :folder_id) - :retained
+)
+"""
+
+def load(engine, rows: int, partitions: int, folders: int, versions: int):
+    """2つのテーブルを作り直し、同じ合成データを投入する"""
+    with engine.begin() as connection:
+        connection.exec_driver_sql(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        connection.exec_driver_sql(f"CREATE SCHEMA {SCHEMA}")
+        connection.exec_driver_sql(f"CREATE TABLE {PLAIN} ({COLUMNS}, PRIMARY KEY (id))")
+        connection.exec_driver_sql(
+            f"CREATE TABLE {PARTITIONED} ({COLUMNS}, PRIMARY KEY (id, filename)) PARTITION BY HASH (filename)"
+        )
+        for i in range(partitions):
+            connection.exec_driver_sql(
+                f"CREATE TABLE {PARTITIONED}_p{i} PARTITION OF {PARTITIONED} "
+                f"FOR VALUES WITH (MODULUS {partitions}, REMAINDER {i})"
+            )
+
+    for table in (PLAIN, PARTITIONED):
+        started = time.perf_counter()
+        with engine.begin() as connection:
+            # ファイルごとに versions 個のバージョン。ファイルはフォルダに均等に配置する
+            connection.execute(text(f"""
+                INSERT INTO {table} (id, filename, version, folder_id, operation, created_at, file_size, mime_type, content_hash)
+                SELECT g + 1, 'file_' || (g / :versions), (g % :versions) + 1, ((g / :versions) % :folders) + 1,
+                       CASE WHEN g % :versions = 0 THEN 'create' ELSE 'update' END,
+                       now() - make_interval(secs => :rows - g), 1024 + g % 4096, 'text/plain', md5(g::text)
+                FROM generate_series(0, :rows - 1) AS g
+            """), {"rows": rows, "versions": versions, "folders": folders})
+            name = table.split(".")[1]
+            connection.exec_driver_sql(f"CREATE INDEX ix_{name}_filename ON {table} (filename)")
+            connection.exec_driver_sql(f"CREATE INDEX ix_{name}_id ON {table} (id)")
+            connection.exec_driver_sql(f"CREATE INDEX ix_{name}_folder_filename_version ON {table} (folder_id, filename, version)")
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.exec_driver_sql(f"VACUUM ANALYZE {table}")
+        print(f"{table}: {rows} 行を投入（{time.perf_counter() - started:.1f} 秒）")
+
+def _timings(connection, sql: str, params_list: list, rollback: bool = False) -> list:
+    timings = []
+    for params in params_list:
+        transaction = connection.begin()
+        started = time.perf_counter()
+        result = connection.execute(text(sql), params)
+        if not rollback:
+            result.fetchall()
+        timings.append((time.perf_counter() - started) * 1000)
+        transaction.rollback()
+    return timings
+
+def _summary(timings: list) -> str:
+    timings = sorted(timings)
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    return f"中央値 {statistics.median(timings):8.2f} ms, p95 {p95:8.2f} ms"
+
+def measure(engine, partitions: int, folders: int, samples: int):
+    with engine.connect() as connection:
+        files = connection.execute(text(f"SELECT count(DISTINCT filename) FROM {PLAIN}")).scalar()
+    rng = random.Random(0)
+    folder_params = [{"folder_id": rng.randint(1, folders)} for _ in range(samples)]
+    file_params = []
+    for _ in range(samples):
+        number = rng.randrange(files)
+        file_params.append({
+            "filename": f"file_{number}",
+            "folder_id": number % folders + 1,
+            "retained": RETAINED_VERSIONS,
+        })
+
+    results = {}
+    for label, table, partitionwise in (("分割なし", PLAIN, False), (f"{partitions}分割", PARTITIONED, True)):
+        with engine.connect() as connection:
+            if partitionwise:
+                # アプリと同じくパーティションごとの集約・結合を有効にする
+                connection.exec_driver_sql("SET enable_partitionwise_aggregate = on")
+                connection.exec_driver_sql("SET enable_partitionwise_join = on")
+                connection.commit()
+            results[label] = {
+                "list": _timings(connection, LIST_SQL.format(table=table), folder_params),
+                "head": _timings(connection, HEAD_SQL.format(table=table), file_params),
+                "prune": _timings(connection, PRUNE_SQL.format(table=table), file_params, rollback=True),
+            }
+
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            started = time.perf_counter()
+            connection.exec_driver_sql(f"VACUUM {table}")
+            results[label]["vacuum"] = [(time.perf_counter() - started) * 1000]
+            if partitionwise:
+                started = time.perf_counter()
+                connection.exec_driver_sql(f"VACUUM {PARTITIONED}_p0")
+                results[label]["vacuum (1パーティション)"] = [(time.perf_counter() - started) * 1000]
+
+    for label, timings in results.items():
+        print(f"\n[{label}]")
+        for name, values in timings.items():
+            print(f"  {name:<24} {_summary(values)}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="file_versions のパーティション分割の計測（PostgreSQL）")
+    parser.add_argument("--rows", type=int, default=10_000_000, help="行数（デフォルト: 10000000）")
+    parser.add_argument("--partitions", type=int, default=16, help="パーティション数（デフォルト: 16）")
+    parser.add_argument("--folders", type=int, default=1000, help="フォルダ数（デフォルト: 1000）")
+    parser.add_argument("--versions", type=int, default=RETAINED_VERSIONS + 1, help="1ファイルあたりのバージョン数（デフォルト: 保持数+1）")
+    parser.add_argument("--samples", type=int, default=50, help="各処理の計測回数（デフォルト: 50）")
+    parser.add_argument("--skip-load", action="store_true", help="投入済みのデータで計測する")
+    parser.add_argument("--drop", action="store_true", help="計測後に計測用のスキーマを削除する")
+    args = parser.parse_args()
+
+    if not DATABASE_URL.startswith("postgresql"):
+        print("この計測は PostgreSQL でのみ実行できます")
+        sys.exit(1)
+
+    engine = create_engine(DATABASE_URL)
+    if not args.skip_load:
+        load(engine, args.rows, args.partitions, args.folders, args.versions)
+    measure(engine, args.partitions, args.folders, args.samples)
+
+    if args.drop:
+        with engine.begin() as connection:
+            connection.exec_driver_sql(f"DROP SCHEMA {SCHEMA} CASCADE")
@@ -1,5 +1,5 @@
 import axios from 'axios'
-import type { UploadResponse, FilesListResponse, FileVersionsResponse } from './types'
+import type { UploadResponse, FilesListResponse, FileVersionsResponse, FileVersionsBatchResponse, FolderNode } from './types'
 
 const fileApiClient = axios.create({
   baseURL: '/files'
@@ -16,6 +16,13 @@ export const folderApi = {
     return { folders: response.data }
   },
 
+  // 子フォルダ取得（遅延展開用。folderId 省略時はルート直下）
+  async getFolderChildren(folderId?: number, depth = 1): Promise<FolderNode[]> {
+    const path = folderId !== undefined ? `/folders/${folderId}/children` : '/folders/children'
+    const response = await folderApiClient.get<FolderNode[]>(path, { params: { depth } })
+    return response.data
+  },
+
   // フォルダ作成
   async createFolder(name: string, parentId?: number): Promise<Folder> {
     const formData = new FormData()
@@ -37,8 +44,36 @@ export const fileApi = {
     return response.data
   },
 
+  // アップロード前の事前確認（最新版と同一内容なら本体を送信しない）
+  async precheckFile(file: File, folderId?: number): Promise<UploadResponse | null> {
+    // crypto.subtle はセキュアコンテキスト（HTTPS / localhost）でのみ利用可能
+    if (!window.crypto?.subtle) {
+      return null
+    }
+    const digest = await window.crypto.subtle.digest('SHA-256', await file.arrayBuffer())
+    const sha256 = Array.from(new Uint8Array(digest))
+      .map(b => b.toString(16).padStart(2, '0'))
+      .join('')
+
+    const formData = new FormData()
+    formData.append('filename', file.name)
+    formData.append('size', file.size.toString())
+    formData.append('sha256', sha256)
+    if (folderId !== undefined) {
+      formData.append('folder_id', folderId.toString())
+    }
+
+    const response = await fileApiClient.post<UploadResponse & { status: string }>('/precheck', formData)
+    return response.data.status === 'unchanged' ? response.data : null
+  },
+
   // ファイルアップロード
   async uploadFile(file: File, memo?: string, folderId?: number): Promise<UploadResponse> {
+    const unchanged = await this.precheckFile(file, folderId)
+    if (unchanged) {
+      return unchanged
+    }
+
     const formData = new FormData()
     formData.append('file', file)
     if (memo) {
@@ -72,6 +107,18 @@ export const fileApi = {
     return response.data
   },
 
+  // 複数ファイルのバージョン履歴を一括取得（files 省略時はフォルダ内の全ファイル）
+  async getFileVersionsBatch(
+    files?: { filename: string; folderId?: number }[],
+    folderId?: number
+  ): Promise<FileVersionsBatchResponse> {
+    const body = files !== undefined
+      ? { files: files.map(f => ({ filename: f.filename, folder_id: f.folderId ?? null })) }
+      : { folder_id: folderId ?? null }
+    const response = await fileApiClient.post<FileVersionsBatchResponse>('/versions/batch', body)
+    return response.data
+  },
+
   // ファイルダウンロードURL取得
   getDownloadUrl(filename: string, version?: number, folderId?: number): string {
     const params = new URLSearchParams()
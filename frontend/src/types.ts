@@ -5,6 +5,20 @@ export interface Folder {
   children?: Folder[]
 }
 
+// 遅延展開用のフォルダノード（children は要求した深さまで）
+export interface FolderNode {
+  id: number
+  name: string
+  parent_id?: number
+  created_at: string
+  file_count: number
+  head_bytes: number
+  retained_bytes: number
+  child_count: number
+  has_children: boolean
+  children: FolderNode[]
+}
+
 export interface FileVersion {
   version: number
   operation: 'create' | 'update' | 'delete'
@@ -38,6 +52,7 @@ export interface UploadResponse {
   version: number
   memo?: string
   operation: string
+  unchanged?: boolean
   folder_id?: number
 }
 
@@ -46,6 +61,14 @@ export interface FileVersionsResponse {
   versions: FileVersion[]
 }
 
+export interface FileVersionsBatchResponse {
+  files: {
+    filename: string
+    folder_id: number | null
+    versions: FileVersion[]
+  }[]
+}
+
 export interface FilesListResponse {
   files: FileInfo[]
 }
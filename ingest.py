@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+ローカルのディレクトリツリーを一括で取り込むスクリプト
+
+  1. ディレクトリを走査し、フォルダ階層を1回のパスでまとめて作成
+  2. スレッドプールでファイルを読み込み、SHA-256を計算（先読みはバイト数の上限まで）
+  3. バッチ単位（件数・バイト数の上限）で1トランザクションにまとめてバージョンを作成
+
+最新バージョンと同一内容のファイルはスキップされるため、同じコマンドを再実行しても
+重複したバージョンは作成されない。
+"""
+import argparse
+import hashlib
+import mimetypes
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+# プロジェクトルートをPythonパスに追加
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from app.database import get_db
+from app.services import FolderService, FileVersionService
+
+FileEntry = Tuple[Tuple[str, ...], Path, int]
+
+def walk_tree(source: Path) -> Tuple[List[Tuple[str, ...]], List[FileEntry]]:
+    """ディレクトリ（相対パスのタプル）とファイル（所属ディレクトリ, パス, サイズ）の一覧を返す"""
+    directories = []
+    files = []
+    for current, dirnames, filenames in os.walk(source):
+        dirnames.sort()
+        relative = Path(current).relative_to(source).parts
+        if relative:
+            directories.append(relative)
+        for filename in sorted(filenames):
+            path = Path(current) / filename
+            try:
+                size = path.stat().st_size
+            except OSError:
+                # 読み込み時にエラーとして報告される
+                size = 0
+            files.append((relative, path, size))
+    return directories, files
+
+def read_file(entry: FileEntry) -> Tuple[Tuple[str, ...], Path, Optional[bytes], Optional[str]]:
+    """ファイルを読み込む（スレッドプールで実行）"""
+    directory, path, _ = entry
+    try:
+        with open(path, "rb") as f:
+            return directory, path, f.read(), None
+    except Exception as e:
+        return directory, path, None, str(e)
+
+def read_ahead(executor: Executor, read, files: List[FileEntry], limit_bytes: int) -> Iterator[tuple]:
+    """
+    ファイルを順番に読み込んで返す
+
+    読み込み済みでまだ返していない分（走査時のサイズ）が limit_bytes を超えないよう先読みする。
+    上限より大きなファイルは、先読み中のものが無い場合に1件だけ読み込む。
+    """
+    pending = deque()
+    pending_bytes = 0
+    index = 0
+    while index < len(files) or pending:
+        while index < len(files) and (not pending or pending_bytes + files[index][2] <= limit_bytes):
+            size = files[index][2]
+            pending.append((size, executor.submit(read, files[index])))
+            pending_bytes += size
+            index += 1
+        size, future = pending.popleft()
+        pending_bytes -= size
+        yield future.result()
+
+def ingest(
+    source: Path,
+    folder_id: Optional[int] = None,
+    memo: Optional[str] = None,
+    batch_size: int = 500,
+    batch_bytes: int = 256 * 1024 * 1024,
+    workers: int = 8,
+    read_ahead_bytes: int = 64 * 1024 * 1024
+):
+    """
+    ディレクトリツリーを取り込む
+
+    メモリに保持する内容は、書き込み中のバッチ（batch_bytes まで）と先読み分（read_ahead_bytes まで）に限られる。
+    """
+    print(f"取り込みを開始します: {source}")
+
+    directories, files = walk_tree(source)
+    print(f"{len(directories)} ディレクトリ, {len(files)} ファイルを検出しました")
+
+    db = next(get_db())
+    stats = {"created": 0, "skipped": 0, "errors": 0, "bytes": 0}
+    started = time.monotonic()
+
+    try:
+        folder_ids = FolderService.ensure_folder_paths(db, directories, parent_id=folder_id)
+
+        def hash_and_read(entry):
+            directory, path, content, error = read_file(entry)
+            content_hash = hashlib.sha256(content).hexdigest() if content is not None else None
+            return directory, path, content, content_hash, error
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # 先読みはDBへの書き込みと並行して進む（書き込み中もバイト数の上限までは読み込みを続ける）
+            items = []
+            items_bytes = 0
+            for directory, path, content, content_hash, error in read_ahead(
+                executor, hash_and_read, files, read_ahead_bytes
+            ):
+                if error:
+                    print(f"スキップ: {path}: {error}")
+                    stats["errors"] += 1
+                    continue
+                items.append({
+                    "filename": path.name,
+                    "file_content": content,
+                    "content_hash": content_hash,
+                    "folder_id": folder_ids[directory],
+                    "memo": memo,
+                    "mime_type": mimetypes.guess_type(path.name)[0]
+                })
+                items_bytes += len(content)
+
+                # 件数またはバイト数の上限に達したら書き込む
+                if len(items) >= batch_size or items_bytes >= batch_bytes:
+                    save_batch(db, items, stats, started)
+                    items = []
+                    items_bytes = 0
+
+            save_batch(db, items, stats, started)
+    except Exception as e:
+        print(f"取り込み中にエラーが発生しました: {e}")
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    elapsed = max(time.monotonic() - started, 1e-6)
+    print(f"\n取り込み完了:")
+    print(f"  作成: {stats['created']} ファイル")
+    print(f"  スキップ（変更なし）: {stats['skipped']} ファイル")
+    print(f"  エラー: {stats['errors']} ファイル")
+    print(f"  合計: {stats['bytes'] / 1024 / 1024:.1f} MB, {elapsed:.1f} 秒")
+
+def save_batch(db, items: list, stats: dict, started: float):
+    if not items:
+        return
+    batch_started = time.monotonic()
+    results = FileVersionService.bulk_save_versions(db, items)
+
+    batch_bytes = sum(len(item["file_content"]) for item in items)
+    created = sum(1 for result in results if result["created"])
+    stats["created"] += created
+    stats["skipped"] += len(results) - created
+    stats["bytes"] += batch_bytes
+
+    batch_elapsed = max(time.monotonic() - batch_started, 1e-6)
+    total_elapsed = max(time.monotonic() - started, 1e-6)
+    print(
+        f"バッチ完了: {created}/{len(items)} 件作成, "
+        f"{len(items) / batch_elapsed:.1f} 件/秒, {batch_bytes / batch_elapsed / 1024 / 1024:.1f} MB/秒 "
+        f"（累計 {stats['created'] + stats['skipped']} 件, "
+        f"{(stats['created'] + stats['skipped']) / total_elapsed:.1f} 件/秒）"
+    )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ローカルのディレクトリツリーを一括で取り込む")
+    parser.add_argument("source", help="取り込むディレクトリ")
+    parser.add_argument("--folder-id", type=int, default=None, help="取り込み先の親フォルダID（省略時はルート）")
+    parser.add_argument("--memo", default=None, help="作成するバージョンに付けるメモ")
+    parser.add_argument("--batch-size", type=int, default=500, help="1トランザクションの最大ファイル数（デフォルト: 500）")
+    parser.add_argument("--batch-mb", type=int, default=256, help="1トランザクションの最大サイズ（MB、デフォルト: 256）")
+    parser.add_argument("--workers", type=int, default=8, help="ファイル読み込みのスレッド数（デフォルト: 8）")
+    parser.add_argument("--read-ahead-mb", type=int, default=64, help="先読みする最大サイズ（MB、デフォルト: 64）")
+    args = parser.parse_args()
+
+    source = Path(args.source)
+    if not source.is_dir():
+        print(f"ディレクトリが見つかりません: {source}")
+        sys.exit(1)
+
+    ingest(
+        source,
+        folder_id=args.folder_id,
+        memo=args.memo,
+        batch_size=args.batch_size,
+        batch_bytes=args.batch_mb * 1024 * 1024,
+        workers=args.workers,
+        read_ahead_bytes=args.read_ahead_mb * 1024 * 1024
+    )
@@ -1,91 +1,246 @@
-#!/usr/bin/env python3
-"""
-既存のファイルシステムベースのファイルをデータベースに移行するスクリプト
-"""
-import os
-import sys
-from pathlib import Path
-from sqlalchemy.orm import Session
-from app.database import get_db, create_tables, FileVersion, Folder, engine
-from app.services import FileVersionService
-
-def migrate_files_to_db():
-    """既存のファイルをデータベースに移行"""
-    print("ファイルシステムからデータベースへの移行を開始します...")
-
-    # テーブルを作成
-    create_tables()
-
-    # データベースセッションを取得
-    db = next(get_db())
-
-    try:
-        # 既存のFileVersionレコードを取得
-        existing_versions = db.query(FileVersion).all()
-
-        migrated_count = 0
-        error_count = 0
-
-        for version in existing_versions:
-            try:
-                # ファイルパスが存在するかチェック
-                if hasattr(version, 'file_path') and version.file_path and os.path.exists(version.file_path):
-                    print(f"移行中: {version.filename} v{version.version}")
-
-                    # ファイルを読み込み
-                    with open(version.file_path, 'rb') as f:
-                        file_content = f.read()
-
-                    # データベースのfile_contentフィールドを更新
-                    version.file_content = file_content
-
-                    # file_pathフィールドを削除（新しいスキーマでは不要）
-                    if hasattr(version, 'file_path'):
-                        delattr(version, 'file_path')
-
-                    migrated_count += 1
-
-                    # 物理ファイルを削除
-                    try:
-                        os.remove(version.file_path)
-                        # 空のディレクトリも削除
-                        version_dir = Path(version.file_path).parent
-                        if version_dir.exists() and not any(version_dir.iterdir()):
-                            version_dir.rmdir()
-                    except Exception as e:
-                        print(f"警告: 物理ファイルの削除に失敗しました {version.file_path}: {e}")
-
-                else:
-                    print(f"スキップ: ファイルが見つかりません {version.filename} v{version.version}")
-                    error_count += 1
-
-            except Exception as e:
-                print(f"エラー: {version.filename} v{version.version} の移行に失敗: {e}")
-                error_count += 1
-
-        # 変更をコミット
-        db.commit()
-
-        print(f"\n移行完了:")
-        print(f"  成功: {migrated_count} ファイル")
-        print(f"  エラー: {error_count} ファイル")
-
-        # uploadsディレクトリを削除
-        uploads_dir = Path("uploads")
-        if uploads_dir.exists():
-            try:
-                import shutil
-                shutil.rmtree(uploads_dir)
-                print(f"uploadsディレクトリを削除しました: {uploads_dir}")
-            except Exception as e:
-                print(f"警告: uploadsディレクトリの削除に失敗: {e}")
-
-    except Exception as e:
-        print(f"移行中にエラーが発生しました: {e}")
-        db.rollback()
-        raise
-    finally:
-        db.close()
-
-if __name__ == "__main__":
-    migrate_files_to_db()
+#!/usr/bin/env python3
+"""
+既存のファイルシステムベースのファイルをデータベースに移行するスクリプト
+
+file_versions を id 順にバッチ単位で処理する:
+  1. file_content が未設定の行を id > チェックポイント で取得（メタデータのみ）
+  2. 合計サイズが上限に収まる分だけ、スレッドプールで物理ファイルを読み込み
+  3. バッチごとに file_content を更新してコミット
+  4. 書き込まれたサイズと SHA-256 を検証してからチェックポイントを記録し、元ファイルを削除
+
+途中で中断しても、同じコマンドを再実行すればチェックポイントから再開できる。
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional, Tuple
+
+from sqlalchemy import bindparam, create_engine, inspect, text
+
+# プロジェクトルートをPythonパスに追加
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from app.database import DATABASE_URL
+
+DEFAULT_CHECKPOINT = ".migrate_to_db_storage.checkpoint.json"
+
+def load_checkpoint(path: Path) -> dict:
+    if path.exists():
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {"last_id": 0, "migrated": 0, "errors": 0, "bytes": 0}
+
+def save_checkpoint(path: Path, checkpoint: dict):
+    # 書き込み途中で中断されても壊れないように一時ファイル経由で置き換える
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+def read_file(row) -> Tuple[int, str, Optional[bytes], Optional[str]]:
+    """物理ファイルを読み込む（スレッドプールで実行）"""
+    version_id, file_path = row
+    try:
+        if not file_path or not os.path.exists(file_path):
+            return version_id, file_path, None, "ファイルが見つかりません"
+        with open(file_path, "rb") as f:
+            return version_id, file_path, f.read(), None
+    except Exception as e:
+        return version_id, file_path, None, str(e)
+
+def source_size(file_path: str) -> int:
+    try:
+        return os.path.getsize(file_path) if file_path else 0
+    except OSError:
+        # 読み込み時にエラーとして報告される
+        return 0
+
+def take_within_bytes(rows, limit_bytes: int) -> list:
+    """先頭から合計サイズが limit_bytes に収まる行を返す（上限より大きなファイルも1件目なら含める）"""
+    taken = []
+    total = 0
+    for row in rows:
+        size = source_size(row[1])
+        if taken and total + size > limit_bytes:
+            break
+        taken.append(row)
+        total += size
+    return taken
+
+def stored_digests(connection, ids: list) -> dict:
+    """書き込まれた内容の {id: (サイズ, SHA-256)} を返す"""
+    if connection.dialect.name == "postgresql":
+        # データベース側で計算し、内容を転送しない
+        rows = connection.execute(text(
+            "SELECT id, length(file_content), encode(sha256(file_content), 'hex') "
+            "FROM file_versions WHERE id IN :ids"
+        ).bindparams(bindparam("ids", expanding=True)), {"ids": ids})
+        return {row[0]: (row[1], row[2]) for row in rows}
+
+    rows = connection.execute(text(
+        "SELECT id, file_content FROM file_versions WHERE id IN :ids"
+    ).bindparams(bindparam("ids", expanding=True)), {"ids": ids})
+    return {
+        row[0]: (len(row[1]), hashlib.sha256(row[1]).hexdigest()) if row[1] is not None else (None, None)
+        for row in rows
+    }
+
+def remove_source(file_path: str):
+    try:
+        os.remove(file_path)
+        # 空のディレクトリも削除
+        version_dir = Path(file_path).parent
+        if version_dir.exists() and not any(version_dir.iterdir()):
+            version_dir.rmdir()
+    except Exception as e:
+        print(f"警告: 物理ファイルの削除に失敗しました {file_path}: {e}")
+
+def migrate_files_to_db(
+    batch_size: int = 200,
+    batch_bytes: int = 256 * 1024 * 1024,
+    workers: int = 8,
+    checkpoint_path: Path = Path(DEFAULT_CHECKPOINT),
+    keep_files: bool = False
+):
+    """既存のファイルをデータベースに移行"""
+    print("ファイルシステムからデータベースへの移行を開始します...")
+
+    engine = create_engine(DATABASE_URL)
+
+    columns = {column["name"] for column in inspect(engine).get_columns("file_versions")}
+    if "file_path" not in columns:
+        print("file_versions に file_path カラムがありません。移行対象はありません。")
+        return
+
+    checkpoint = load_checkpoint(checkpoint_path)
+    if checkpoint["last_id"]:
+        print(f"チェックポイントから再開します: id > {checkpoint['last_id']}")
+
+    select_batch = text(
+        "SELECT id, file_path FROM file_versions "
+        "WHERE id > :last_id AND file_content IS NULL "
+        "ORDER BY id LIMIT :limit"
+    )
+    # content_hash カラムが既に追加されていればハッシュも記録する
+    assignments = "file_content = :content, file_size = :size"
+    if "content_hash" in columns:
+        assignments += ", content_hash = :content_hash"
+    update_content = text(f"UPDATE file_versions SET {assignments} WHERE id = :id")
+
+    started = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            batch_started = time.monotonic()
+
+            with engine.connect() as connection:
+                rows = connection.execute(
+                    select_batch, {"last_id": checkpoint["last_id"], "limit": batch_size}
+                ).fetchall()
+
+            if not rows:
+                break
+
+            # 合計サイズの上限を超える分は次のバッチに回す
+            rows = take_within_bytes(rows, batch_bytes)
+
+            # 物理ファイルを並列に読み込み
+            results = list(executor.map(read_file, [(row[0], row[1]) for row in rows]))
+
+            updates = []
+            sources = {}
+            for version_id, file_path, content, error in results:
+                if error:
+                    print(f"スキップ: id={version_id} {file_path}: {error}")
+                    checkpoint["errors"] += 1
+                    continue
+                updates.append({
+                    "id": version_id,
+                    "content": content,
+                    "size": len(content),
+                    "content_hash": hashlib.sha256(content).hexdigest()
+                })
+                sources[version_id] = (file_path, len(content), updates[-1]["content_hash"])
+
+            # バッチ単位でコミット
+            if updates:
+                with engine.begin() as connection:
+                    connection.execute(update_content, updates)
+
+            # コミット後に書き込まれたサイズとハッシュを検証
+            verified = []
+            if sources:
+                with engine.connect() as connection:
+                    stored = stored_digests(connection, list(sources))
+                for version_id, (file_path, size, content_hash) in sources.items():
+                    if stored.get(version_id) == (size, content_hash):
+                        verified.append(file_path)
+                    else:
+                        print(f"警告: 検証に失敗しました id={version_id}（元ファイルは削除しません）")
+                        checkpoint["errors"] += 1
+
+            batch_bytes = sum(update["size"] for update in updates)
+            checkpoint["last_id"] = rows[-1][0]
+            checkpoint["migrated"] += len(verified)
+            checkpoint["bytes"] += batch_bytes
+            save_checkpoint(checkpoint_path, checkpoint)
+
+            # 検証済みのものだけ元ファイルを削除
+            if not keep_files:
+                for file_path in verified:
+                    remove_source(file_path)
+
+            batch_elapsed = max(time.monotonic() - batch_started, 1e-6)
+            total_elapsed = max(time.monotonic() - started, 1e-6)
+            print(
+                f"バッチ完了: id <= {checkpoint['last_id']}, {len(verified)}/{len(rows)} 件, "
+                f"{len(rows) / batch_elapsed:.1f} 件/秒, {batch_bytes / batch_elapsed / 1024 / 1024:.1f} MB/秒 "
+                f"（累計 {checkpoint['migrated']} 件, {checkpoint['bytes'] / total_elapsed / 1024 / 1024:.1f} MB/秒）"
+            )
+
+    print(f"\n移行完了:")
+    print(f"  成功: {checkpoint['migrated']} ファイル")
+    print(f"  エラー: {checkpoint['errors']} ファイル")
+    print(f"  合計: {checkpoint['bytes'] / 1024 / 1024:.1f} MB")
+
+    # 空になったuploadsディレクトリを削除
+    uploads_dir = Path("uploads")
+    if not keep_files and uploads_dir.exists():
+        for directory in sorted(uploads_dir.rglob("*"), reverse=True):
+            if directory.is_dir() and not any(directory.iterdir()):
+                directory.rmdir()
+        if not any(uploads_dir.iterdir()):
+            uploads_dir.rmdir()
+            print(f"uploadsディレクトリを削除しました: {uploads_dir}")
+        else:
+            print(f"uploadsディレクトリに未移行のファイルが残っています: {uploads_dir}")
+
+    print("フォルダの集計値を更新するには python repair_folder_stats.py を実行してください")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ファイルシステム上のファイルをデータベースへ移行")
+    parser.add_argument("--batch-size", type=int, default=200, help="1バッチの行数（デフォルト: 200）")
+    parser.add_argument("--batch-mb", type=int, default=256, help="1バッチの最大サイズ（MB、デフォルト: 256）")
+    parser.add_argument("--workers", type=int, default=8, help="ファイル読み込みのスレッド数（デフォルト: 8）")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT, help="チェックポイントファイル")
+    parser.add_argument("--keep-files", action="store_true", help="移行後も元ファイルを削除しない")
+    parser.add_argument("--reset", action="store_true", help="チェックポイントを破棄して最初からやり直す")
+    args = parser.parse_args()
+
+    checkpoint_path = Path(args.checkpoint)
+    if args.reset and checkpoint_path.exists():
+        checkpoint_path.unlink()
+
+    migrate_files_to_db(
+        batch_size=args.batch_size,
+        batch_bytes=args.batch_mb * 1024 * 1024,
+        workers=args.workers,
+        checkpoint_path=checkpoint_path,
+        keep_files=args.keep_files
+    )
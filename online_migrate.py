@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+オンラインマイグレーション（バックフィル・インデックス作成）を実行するスクリプト
+
+サービスを止めずに、既存の行を id の範囲ごとの短いトランザクションで書き換える。
+進捗は online_migrations テーブルに記録され、中断しても同じコマンドで再開できる。
+
+  python online_migrate.py status
+  python online_migrate.py backfill file_versions_content_hash --batch-size 200 --duty-cycle 0.5
+  python online_migrate.py create-index ix_file_versions_content_hash file_versions content_hash
+"""
+import argparse
+import sys
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from app.database import get_db
+from app.online_migration import OnlineMigrationService, backfills, create_index_concurrently
+
+def show_status():
+    db = next(get_db())
+    try:
+        for item in OnlineMigrationService.status(db):
+            progress = f"{item['last_id']}/{item['max_id']}" if item["max_id"] is not None else "-"
+            print(f"{item['name']}: {item['status']} (id {progress}, {item['rows_processed']} 行, {item['batches']} バッチ)")
+            if item["description"]:
+                print(f"    {item['description']}")
+            if item["error"]:
+                print(f"    エラー: {item['error']}")
+    finally:
+        db.close()
+
+def run_backfill(args):
+    if args.reset:
+        db = next(get_db())
+        try:
+            OnlineMigrationService.reset(db, args.name)
+            print(f"チェックポイントを破棄しました: {args.name}")
+        finally:
+            db.close()
+
+    checkpoint = OnlineMigrationService.run_backfill(
+        args.name,
+        batch_size=args.batch_size,
+        sleep=args.sleep,
+        duty_cycle=args.duty_cycle,
+        max_replica_lag=args.max_replica_lag,
+        max_batches=args.max_batches
+    )
+    print(f"{args.name}: {checkpoint.status}（{checkpoint.rows_processed} 行, id {checkpoint.last_id}/{checkpoint.max_id}）")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="オンラインマイグレーションの実行")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("status", help="登録されているバックフィルと進捗を表示")
+
+    backfill_parser = subparsers.add_parser("backfill", help="バックフィルを実行（チェックポイントから再開）")
+    backfill_parser.add_argument("name", choices=sorted(backfills()), help="バックフィル名")
+    backfill_parser.add_argument("--batch-size", type=int, default=None, help="1バッチの行数（省略時はバックフィルごとの既定値）")
+    backfill_parser.add_argument("--sleep", type=float, default=0.0, help="バッチごとの休止秒数（デフォルト: 0）")
+    backfill_parser.add_argument(
+        "--duty-cycle", type=float, default=0.5,
+        help="処理時間の割合。0.5 ならバッチと同じ時間だけ休止する（デフォルト: 0.5、1 で休止なし）"
+    )
+    backfill_parser.add_argument("--max-replica-lag", type=float, default=None, help="レプリカの遅延がこの秒数以下になるまで待つ（PostgreSQL）")
+    backfill_parser.add_argument("--max-batches", type=int, default=None, help="このバッチ数で中断する（続きは再実行で再開）")
+    backfill_parser.add_argument("--reset", action="store_true", help="チェックポイントを破棄して最初からやり直す")
+
+    index_parser = subparsers.add_parser("create-index", help="書き込みを止めずにインデックスを作成")
+    index_parser.add_argument("index_name", help="インデックス名")
+    index_parser.add_argument("table", help="テーブル名")
+    index_parser.add_argument("columns", nargs="+", help="列名")
+    index_parser.add_argument("--unique", action="store_true", help="一意インデックスにする")
+
+    args = parser.parse_args()
+
+    if args.command == "status":
+        show_status()
+    elif args.command == "backfill":
+        run_backfill(args)
+    elif args.command == "create-index":
+        create_index_concurrently(args.index_name, args.table, args.columns, unique=args.unique)
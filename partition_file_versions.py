@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+既存の file_versions をハッシュパーティション分割したテーブルへ移行するスクリプト（PostgreSQL）
+
+サービスを止めずに、次の順に実行する（詳細は app/partitioning.py）。
+copy は中断しても同じコマンドで再開できる。swap の間だけ file_versions への読み書きが止まる。
+
+  python partition_file_versions.py prepare --partitions 16
+  python partition_file_versions.py copy --batch-size 5000 --duty-cycle 0.5
+  python partition_file_versions.py swap
+  python partition_file_versions.py drop-old
+
+移行後は FILE_VERSIONS_PARTITIONS を同じ値に設定してアプリを再起動する。
+"""
+import argparse
+import sys
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from app.database import engine, DATABASE_URL
+from app import partitioning
+from app.online_migration import OnlineMigrationService
+
+COPY_BACKFILL = "file_versions_partition_copy"
+
+def show_status():
+    state = partitioning.status(engine)
+    if state["partitioned"]:
+        print(f"{partitioning.PARENT_TABLE}: パーティション分割済み（{len(state['partitions'])} パーティション）")
+    elif state["migrating"]:
+        print(f"{partitioning.PARENT_TABLE}: 移行中（{partitioning.SHADOW_TABLE} へコピー中）")
+    else:
+        print(f"{partitioning.PARENT_TABLE}: 分割されていません")
+    for partition in state["partitions"]:
+        print(f"  {partition['name']}: 約 {partition['rows']} 行, {partition['bytes'] / 1024 / 1024:.1f} MB")
+    if state["old_table"]:
+        print(f"旧テーブル {partitioning.OLD_TABLE} が残っています（確認後に drop-old で削除）")
+
+def run_copy(args):
+    checkpoint = OnlineMigrationService.run_backfill(
+        COPY_BACKFILL,
+        batch_size=args.batch_size,
+        sleep=args.sleep,
+        duty_cycle=args.duty_cycle,
+        max_replica_lag=args.max_replica_lag,
+        max_batches=args.max_batches
+    )
+    print(f"{COPY_BACKFILL}: {checkpoint.status}（{checkpoint.rows_processed} 行, id {checkpoint.last_id}/{checkpoint.max_id}）")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="file_versions のパーティション分割への移行")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("status", help="分割の状態とパーティションごとの行数・サイズを表示")
+
+    prepare_parser = subparsers.add_parser("prepare", help="分割した新しいテーブルと変更を反映するトリガーを作成")
+    prepare_parser.add_argument("--partitions", type=int, default=16, help="パーティション数（デフォルト: 16）")
+
+    copy_parser = subparsers.add_parser("copy", help="既存の行をコピー（チェックポイントから再開）")
+    copy_parser.add_argument("--batch-size", type=int, default=None, help="1バッチの行数（デフォルト: 5000）")
+    copy_parser.add_argument("--sleep", type=float, default=0.0, help="バッチごとの休止秒数（デフォルト: 0）")
+    copy_parser.add_argument("--duty-cycle", type=float, default=0.5, help="処理時間の割合（デフォルト: 0.5、1 で休止なし）")
+    copy_parser.add_argument("--max-replica-lag", type=float, default=None, help="レプリカの遅延がこの秒数以下になるまで待つ")
+    copy_parser.add_argument("--max-batches", type=int, default=None, help="このバッチ数で中断する（続きは再実行で再開）")
+
+    swap_parser = subparsers.add_parser("swap", help="件数を確認してテーブルを入れ替える")
+    swap_parser.add_argument("--lock-timeout-ms", type=int, default=5000, help="テーブルロックを待つ上限（ミリ秒、デフォルト: 5000）")
+
+    subparsers.add_parser("drop-old", help=f"入れ替え前のテーブル（{partitioning.OLD_TABLE}）を削除")
+
+    args = parser.parse_args()
+
+    if not DATABASE_URL.startswith("postgresql"):
+        print("パーティション分割は PostgreSQL でのみ利用できます")
+        sys.exit(1)
+
+    if args.command == "status":
+        show_status()
+    elif args.command == "prepare":
+        partitioning.prepare(engine, args.partitions)
+    elif args.command == "copy":
+        run_copy(args)
+    elif args.command == "swap":
+        partitioning.swap(engine, args.lock_timeout_ms)
+    elif args.command == "drop-old":
+        partitioning.drop_old(engine)
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""
+フォルダの集計値（ファイル数・最新版サイズ・保持中の全バージョンサイズ）を再計算するスクリプト
+
+通常は差分更新で維持されるが、移行直後や不整合が疑われる場合に実行する。
+"""
+import sys
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from app.database import get_db
+from app.services import FolderService
+
+def repair_folder_stats():
+    """全フォルダの集計値を再計算"""
+    print("フォルダの集計値を再計算しています...")
+
+    db = next(get_db())
+
+    try:
+        count = FolderService.recompute_stats(db)
+        print(f"再計算が完了しました: {count} フォルダ")
+    except Exception as e:
+        print(f"再計算中にエラーが発生しました: {e}")
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    repair_folder_stats()
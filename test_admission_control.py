@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+アップロードのアドミッション制御のテストスクリプト
+"""
+import sys
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from app import admission
+from app.admission import AdmissionController, AdmissionControlMiddleware
+import asyncio
+
+def _run_chunked_upload(controller: AdmissionController, chunks: list) -> list:
+    """Content-Length の無いアップロードをミドルウェアに通し、受信ごとの受信中バイト数を返す"""
+    observed = []
+    messages = [{"type": "http.request", "body": chunk, "more_body": True} for chunk in chunks]
+    messages.append({"type": "http.request", "body": b"", "more_body": False})
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        pass
+
+    async def app(scope, receive, send):
+        while True:
+            message = await receive()
+            observed.append(controller.bytes_in_flight)
+            if not message.get("more_body"):
+                break
+
+    scope = {"type": "http", "method": "POST", "path": "/files/upload", "headers": [], "client": ("client-a", 1)}
+    asyncio.run(AdmissionControlMiddleware(app, controller)(scope, receive, send))
+    return observed
+
+def test_admission_control():
+    """アドミッション制御のテスト"""
+    print("アドミッション制御のテストを開始します...")
+
+    # 同時実行数の制限
+    print("1. クライアントごと・全体の同時アップロード数を制限...")
+    controller = AdmissionController(
+        max_concurrent=2, max_concurrent_per_client=1, max_bytes_in_flight=0, rate_per_client=0
+    )
+    if controller.try_acquire("client-a", 10) is not None:
+        print("   ✗ 最初のアップロードが拒否されました")
+        return False
+    rejection = controller.try_acquire("client-a", 10)
+    if not rejection or rejection[0] != 429:
+        print(f"   ✗ クライアントの上限で429になりません: {rejection}")
+        return False
+    if controller.try_acquire("client-b", 10) is not None:
+        print("   ✗ 別のクライアントのアップロードが拒否されました")
+        return False
+    rejection = controller.try_acquire("client-c", 10)
+    if not rejection or rejection[0] != 503:
+        print(f"   ✗ 全体の上限で503になりません: {rejection}")
+        return False
+    controller.release("client-a", 10)
+    if controller.try_acquire("client-c", 10) is not None:
+        print("   ✗ 解放後のアップロードが拒否されました")
+        return False
+    print("   ✓ 上限を超えたアップロードは即座に拒否されました")
+
+    # 受信中バイト数の予算
+    print("2. 受信中のバイト数の予算を確認...")
+    controller = AdmissionController(
+        max_concurrent=0, max_concurrent_per_client=0, max_bytes_in_flight=100, rate_per_client=0
+    )
+    if controller.try_acquire("client-a", 150) is not None:
+        print("   ✗ 他に受信中のものがないのに予算超過のアップロードが拒否されました")
+        return False
+    rejection = controller.try_acquire("client-b", 1)
+    if not rejection or rejection[1] != "bytes_in_flight":
+        print(f"   ✗ 予算超過で拒否されません: {rejection}")
+        return False
+    controller.release("client-a", 150)
+    if controller.metrics()["bytes_in_flight"] != 0:
+        print("   ✗ 解放後も受信中のバイト数が残っています")
+        return False
+    print("   ✓ 予算を超える受信は拒否されました")
+
+    # Content-Length の無いチャンク転送
+    print("3. Content-Length の無いアップロードは既定サイズを予約し、超えた分を加算...")
+    controller = AdmissionController(
+        max_concurrent=0, max_concurrent_per_client=0, max_bytes_in_flight=100, rate_per_client=0
+    )
+    saved_reserve = admission.UPLOAD_UNKNOWN_LENGTH_RESERVE
+    admission.UPLOAD_UNKNOWN_LENGTH_RESERVE = 50
+    try:
+        observed = _run_chunked_upload(controller, [b"x" * 30, b"x" * 30, b"x" * 30])
+    finally:
+        admission.UPLOAD_UNKNOWN_LENGTH_RESERVE = saved_reserve
+    if observed != [50, 60, 90, 90]:
+        print(f"   ✗ 受信中のバイト数が不正です: {observed}")
+        return False
+    if controller.metrics()["bytes_in_flight"] != 0 or controller.metrics()["in_flight"] != 0:
+        print(f"   ✗ 完了後も予約が残っています: {controller.metrics()}")
+        return False
+    print(f"   ✓ 予約 50 バイトから受信量に合わせて増え、完了後に解放されました: {observed}")
+
+    # トークンバケット
+    print("4. トークンバケットによるレート制限...")
+    controller = AdmissionController(
+        max_concurrent=0, max_concurrent_per_client=0, max_bytes_in_flight=0, rate_per_client=1, rate_burst=2
+    )
+    results = []
+    for _ in range(3):
+        rejection = controller.try_acquire("client-a", 0)
+        results.append(rejection)
+        if rejection is None:
+            controller.release("client-a", 0)
+    if results[0] is not None or results[1] is not None or not results[2] or results[2][0] != 429 or results[2][2] <= 0:
+        print(f"   ✗ レート制限の結果が不正です: {results}")
+        return False
+    print(f"   ✓ バースト超過で429（Retry-After {results[2][2]:.2f} 秒）")
+
+    metrics = controller.metrics()
+    if metrics["admitted"] != 2 or metrics["rejected"]["rate_limited"] != 1:
+        print(f"   ✗ メトリクスが不正です: {metrics}")
+        return False
+
+    print("\n🎉 すべてのテストが成功しました！")
+    return True
+
+if __name__ == "__main__":
+    success = test_admission_control()
+    sys.exit(0 if success else 1)
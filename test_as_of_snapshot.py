@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+時点指定のスナップショット（GET /files?as_of=...）のテストスクリプト
+"""
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from app.database import get_db, create_tables, engine, FileVersion
+from app.services import FileVersionService, FolderService
+from app.main import app
+import asyncio
+
+# 作成日時を固定するための基準時刻（UTC）
+BASE = datetime(2024, 1, 1, 12, 0, 0)
+
+async def _save_at(db, filename: str, content: bytes, folder_id: int, hours: int, operation: str = None):
+    version = await FileVersionService.save_file_version(
+        db=db, filename=filename, file_content=content, memo=None,
+        operation=operation or FileVersionService.detect_operation(db, filename, folder_id),
+        folder_id=folder_id, force=False
+    )
+    db.query(FileVersion).filter(FileVersion.id == version.id).update(
+        {FileVersion.created_at: BASE + timedelta(hours=hours)}, synchronize_session=False
+    )
+    db.commit()
+
+async def test_as_of_snapshot():
+    """時点指定のスナップショットのテスト"""
+    print("時点指定のスナップショットのテストを開始します...")
+
+    # テーブルを作成
+    create_tables()
+
+    # データベースセッションを取得
+    db = next(get_db())
+    client = TestClient(app)
+    folder = FolderService.create_folder(db, f"スナップショット_{int(time.time())}")
+    folder_id = folder.id
+
+    def snapshot(as_of=None) -> dict:
+        params = {"folder_id": folder_id}
+        if as_of is not None:
+            params["as_of"] = as_of.isoformat()
+        response = client.get("/files", params=params)
+        return {f["filename"]: (f["latest_version"], f["latest_operation"]) for f in response.json()["files"]}
+
+    try:
+        # x: 0時間後に作成、3時間後に更新 / y: 0時間後に作成、2時間後に削除 / z: 4時間後に作成
+        await _save_at(db, "x.txt", b"x1", folder_id, 0)
+        await _save_at(db, "y.txt", b"y1", folder_id, 0)
+        await _save_at(db, "y.txt", b"", folder_id, 2, operation="delete")
+        await _save_at(db, "x.txt", b"x2", folder_id, 3)
+        await _save_at(db, "z.txt", b"z1", folder_id, 4)
+
+        print("1. 指定なしでは現在の最新バージョンを返す...")
+        expected = {"x.txt": (2, "update"), "y.txt": (2, "delete"), "z.txt": (1, "create")}
+        if snapshot() != expected:
+            print(f"   ✗ 一覧が不正です: {snapshot()}")
+            return False
+        print("   ✓ x v2、y は削除記録、z v1")
+
+        print("2. 削除と更新の間の時点を指定...")
+        statements = []
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            if "FROM file_versions" in statement:
+                statements.append(statement)
+        event.listen(engine, "before_cursor_execute", capture)
+        try:
+            result = snapshot(BASE + timedelta(hours=2, minutes=30))
+        finally:
+            event.remove(engine, "before_cursor_execute", capture)
+        if result != {"x.txt": (1, "create"), "y.txt": (2, "delete")}:
+            print(f"   ✗ スナップショットが不正です: {result}")
+            return False
+        if len(statements) != 1 or "row_number" not in statements[0].lower():
+            print(f"   ✗ ウィンドウ関数の1クエリで求められていません: {len(statements)}")
+            return False
+        print("   ✓ x v1、y は削除済みとして返され、z は含まれません（1クエリ）")
+
+        print("3. 削除前の時点では削除されたファイルも元の内容で返す...")
+        result = snapshot(BASE + timedelta(hours=1))
+        if result != {"x.txt": (1, "create"), "y.txt": (1, "create")}:
+            print(f"   ✗ スナップショットが不正です: {result}")
+            return False
+        print("   ✓ y v1 が返されました")
+
+        print("4. 境界とタイムゾーンの扱いを確認...")
+        if snapshot(BASE + timedelta(hours=4)) != expected:
+            print("   ✗ 作成日時ちょうどの時点でそのバージョンが含まれません")
+            return False
+        # UTC+9 の 21:00 は UTC の 12:00（x, y の作成時刻）
+        jst = timezone(timedelta(hours=9))
+        if snapshot(BASE.replace(hour=21, tzinfo=jst)) != {"x.txt": (1, "create"), "y.txt": (1, "create")}:
+            print("   ✗ タイムゾーン付きの時刻が UTC に変換されていません")
+            return False
+        if snapshot(BASE - timedelta(hours=1)):
+            print("   ✗ 作成前の時点でファイルが返されました")
+            return False
+        print("   ✓ 作成日時ちょうどは含まれ、タイムゾーン付きの時刻は UTC として比較されました")
+
+        print("\n🎉 すべてのテストが成功しました！")
+        return True
+
+    except Exception as e:
+        print(f"\n❌ テスト中にエラーが発生しました: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    success = asyncio.run(test_as_of_snapshot())
+    sys.exit(0 if success else 1)
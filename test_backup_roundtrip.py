@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+バックアップ（フル＋増分）とリストアの往復のテストスクリプト
+"""
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from sqlalchemy import create_engine, text
+from app.database import get_db, create_tables, engine, Base, FileVersion
+from app.services import FileVersionService, FolderService
+import backup
+import asyncio
+
+SNAPSHOT_SQL = "SELECT id, filename, version, folder_id, operation, content_hash, file_content FROM file_versions ORDER BY id"
+FOLDERS_SQL = "SELECT id, name, parent_id FROM folders ORDER BY id"
+
+def _snapshot(target_engine):
+    with target_engine.connect() as connection:
+        versions = [tuple(bytes(v) if isinstance(v, (bytes, memoryview)) else v for v in row)
+                    for row in connection.execute(text(SNAPSHOT_SQL))]
+        folders = [tuple(row) for row in connection.execute(text(FOLDERS_SQL))]
+    return versions, folders
+
+async def _save(db, filename: str, content: bytes, folder_id=None):
+    return await FileVersionService.save_file_version(
+        db=db, filename=filename, file_content=content, memo=None,
+        operation=FileVersionService.detect_operation(db, filename, folder_id), folder_id=folder_id
+    )
+
+async def test_backup_roundtrip():
+    """バックアップとリストアの往復のテスト"""
+    print("バックアップとリストアのテストを開始します...")
+
+    # テーブルを作成
+    create_tables()
+
+    # データベースセッションを取得
+    db = next(get_db())
+    workdir = Path(tempfile.mkdtemp(prefix="backup_test_"))
+    suffix = int(time.time())
+    source_url = backup.DATABASE_URL
+    target_url = f"sqlite:///{workdir / 'restored.db'}"
+    target_engine = create_engine(target_url)
+    Base.metadata.create_all(target_engine)
+
+    try:
+        print("1. フルバックアップを作成...")
+        folder = FolderService.create_folder(db, f"バックアップ_{suffix}")
+        moved = FolderService.create_folder(db, f"移動する_{suffix}")
+        purged = FolderService.create_folder(db, f"削除する_{suffix}")
+        for i in range(2):
+            await _save(db, "a.txt", f"a {i}".encode("utf-8"), folder.id)
+        purged_id = purged.id
+        await _save(db, "p.txt", b"purged", purged_id)
+        first_a = FileVersionService.get_version_metadata(db, "a.txt", folder.id, 1).id
+
+        # 採番後・コミット前にスナップショットが取られたバージョンを再現するため、一度削除して後から同じ id で戻す
+        late = await _save(db, "late.txt", b"late", folder.id)
+        late_id = late.id
+        late_row = {
+            "id": late_id, "filename": "late.txt", "version": 1, "file_content": b"late",
+            "folder_id": folder.id, "operation": "create", "file_size": 4,
+            "content_hash": FileVersionService.compute_hash(b"late")
+        }
+        db.query(FileVersion).filter(FileVersion.id == late_id).delete()
+        db.commit()
+
+        backup.export_backup(workdir / "full")
+        print("   ✓ フルバックアップを作成しました")
+
+        print("2. 変更後に増分バックアップを作成...")
+        with engine.begin() as connection:
+            connection.execute(FileVersion.__table__.insert(), late_row)
+        for i in range(2, 4):
+            await _save(db, "a.txt", f"a {i}".encode("utf-8"), folder.id)
+        FolderService.move_folder(db, moved.id, folder.id)
+        FolderService.purge_folder(db, purged_id)
+
+        backup.export_backup(workdir / "inc", since=workdir / "full")
+        manifest = backup.read_manifest(workdir / "inc")
+        exported_ids = {v["id"] for v in manifest["versions"]}
+        deleted_ids = {i for lo, hi in manifest["deleted_version_ids"] for i in range(lo, hi + 1)}
+        if late_id not in exported_ids:
+            print("   ✗ 前回より小さい id で後からコミットされたバージョンが含まれていません")
+            return False
+        if first_a not in deleted_ids or purged_id not in manifest["deleted_folder_ids"]:
+            print(f"   ✗ 削除されたバージョン・フォルダが記録されていません: {sorted(deleted_ids)}")
+            return False
+        print(f"   ✓ 追加 {len(exported_ids)} 件、削除 {len(deleted_ids)} 件が記録されました")
+
+        print("3. フル＋増分を別のデータベースへリストア...")
+        backup.DATABASE_URL = target_url
+        backup.restore_backup([workdir / "full", workdir / "inc"], workers=1)
+        if _snapshot(target_engine) != _snapshot(engine):
+            print("   ✗ リストア結果が元のデータベースと一致しません")
+            return False
+        with target_engine.connect() as connection:
+            a_versions = connection.execute(text(
+                "SELECT count(*) FROM file_versions WHERE filename = 'a.txt' AND folder_id = :folder_id"
+            ), {"folder_id": folder.id}).scalar()
+        if a_versions != 3:
+            print(f"   ✗ 保持数を超えたバージョンが復活しています: {a_versions}")
+            return False
+        print("   ✓ 元のデータベースと一致しました（保持数を超えたバージョンは含まれません）")
+
+        print("4. 同じ増分の再実行は投入済みとして扱われることを確認...")
+        backup.restore_backup([workdir / "inc"], workers=1)
+        if _snapshot(target_engine) != _snapshot(engine):
+            print("   ✗ 再実行で内容が変わりました")
+            return False
+        print("   ✓ 内容は変わりませんでした")
+
+        print("5. 内容の異なる同じ id のバージョンは競合として報告...")
+        with target_engine.begin() as connection:
+            connection.execute(text("UPDATE file_versions SET content_hash = :hash WHERE id = :id"),
+                               {"hash": "0" * 64, "id": late_id})
+        try:
+            backup.restore_backup([workdir / "inc"], workers=1)
+            print("   ✗ 競合が報告されませんでした")
+            return False
+        except backup.RestoreConflictError:
+            pass
+        print("   ✓ 競合として報告され、リストアは中止されました")
+
+        print("\n🎉 すべてのテストが成功しました！")
+        return True
+
+    except Exception as e:
+        print(f"\n❌ テスト中にエラーが発生しました: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+    finally:
+        backup.DATABASE_URL = source_url
+        db.close()
+
+if __name__ == "__main__":
+    success = asyncio.run(test_backup_roundtrip())
+    sys.exit(0 if success else 1)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+サイドカー保存（BLOB_STORE_DIR）のテストスクリプト
+"""
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from fastapi.testclient import TestClient
+from sqlalchemy import LargeBinary, type_coerce
+from app.database import get_db, create_tables, engine, FileVersion
+from app.services import FileVersionService
+from app.blobstore import blob_store, is_ref
+from app.online_migration import OnlineMigrationService, COMPLETED
+from app.main import app
+import asyncio
+
+async def test_blob_store():
+    """サイドカー保存のテスト"""
+    print("サイドカー保存のテストを開始します...")
+
+    # テーブルを作成
+    create_tables()
+
+    # 一時ディレクトリへの保存を有効にする
+    saved_settings = (blob_store.enabled, blob_store.directory, blob_store.inline_max)
+    blob_store.enabled = True
+    blob_store.directory = Path(tempfile.mkdtemp())
+    blob_store.inline_max = 16
+
+    # データベースセッションを取得
+    db = next(get_db())
+    prefix = f"blob_test_{int(time.time())}"
+    content = "サイドカーに保存される内容".encode("utf-8") * 10
+
+    try:
+        print("1. 大きな内容はサイドカーに、小さな内容は行内に保存...")
+        for name, data in ((f"{prefix}_a.txt", content), (f"{prefix}_b.txt", content), (f"{prefix}_small.txt", b"small")):
+            await FileVersionService.save_file_version(db=db, filename=name, file_content=data, memo=None, operation="create")
+        stored = dict(db.query(FileVersion.filename, type_coerce(FileVersion.file_content, LargeBinary)).filter(
+            FileVersion.filename.like(f"{prefix}_%")
+        ).all())
+        if not is_ref(stored[f"{prefix}_a.txt"]) or stored[f"{prefix}_small.txt"] != b"small":
+            print("   ✗ 保存先が不正です")
+            return False
+        files = list(blob_store.iter_files())
+        if len(files) != 1:
+            print(f"   ✗ 同じ内容が1つのファイルにまとめられていません: {len(files)}")
+            return False
+        print("   ✓ 同じ内容の2件が1つのファイルを共有しています")
+
+        print("2. 読み取り・ダウンロードで元の内容が返ることを確認...")
+        db.expire_all()
+        version = FileVersionService.get_file_version(db, f"{prefix}_b.txt", 1)
+        response = TestClient(app).get(f"/files/{prefix}_a.txt/download")
+        if version.file_content != content or response.status_code != 200 or response.content != content:
+            print("   ✗ 内容が一致しません")
+            return False
+        print("   ✓ 内容が一致しました")
+
+        print("3. 参照されなくなったファイルを削除...")
+        with engine.connect() as connection:
+            blob_store.gc(connection, grace_seconds=0)
+        if len(list(blob_store.iter_files())) != 1:
+            print("   ✗ 参照中のファイルが削除されました")
+            return False
+        db.query(FileVersion).filter(FileVersion.filename.like(f"{prefix}_%")).delete(synchronize_session=False)
+        db.commit()
+        with engine.connect() as connection:
+            removed, _ = blob_store.gc(connection, grace_seconds=0)
+        if removed != 1 or list(blob_store.iter_files()):
+            print(f"   ✗ ファイルが削除されていません: {removed}")
+            return False
+        print("   ✓ 参照中のファイルは残り、不要なファイルだけが削除されました")
+
+        print("4. gc の走査中に古いファイルが再び参照された場合は残すことを確認...")
+        old_content = "再び参照される内容".encode("utf-8") * 10
+        old_path = blob_store.ref_path(blob_store.put(old_content))
+        old_time = time.time() - 7200
+        os.utime(old_path, (old_time, old_time))
+
+        # 参照の集計が終わった後、ファイルの走査の前に同じ内容が保存される状況を再現する
+        original_iter_files = blob_store.iter_files
+        def iter_files_after_put():
+            blob_store.put(old_content)
+            return original_iter_files()
+        blob_store.iter_files = iter_files_after_put
+        try:
+            with engine.connect() as connection:
+                removed, _ = blob_store.gc(connection, grace_seconds=3600)
+        finally:
+            blob_store.iter_files = original_iter_files
+        if removed != 0 or not old_path.exists():
+            print("   ✗ 再び参照されたファイルが削除されました")
+            return False
+        print("   ✓ 再び参照されたファイルは猶予期間に含まれ、削除されませんでした")
+
+        print("5. ハッシュのバックフィルは参照ではなく内容のハッシュを設定することを確認...")
+        backfill_name = f"{prefix}_backfill.txt"
+        await FileVersionService.save_file_version(db=db, filename=backfill_name, file_content=content, memo=None, operation="create")
+        db.query(FileVersion).filter(FileVersion.filename == backfill_name).update(
+            {FileVersion.content_hash: None}, synchronize_session=False
+        )
+        db.commit()
+        OnlineMigrationService.reset(db, "file_versions_content_hash")
+        # 参照に含まれるハッシュを使い、サイドカーの本体は読まないこと
+        original_load = blob_store.load
+        def load_not_expected(value):
+            raise AssertionError("サイドカーの本体が読み込まれました")
+        blob_store.load = load_not_expected
+        try:
+            checkpoint = OnlineMigrationService.run_backfill("file_versions_content_hash", duty_cycle=1)
+        finally:
+            blob_store.load = original_load
+        db.expire_all()
+        head = FileVersionService.get_latest_version(db, backfill_name)
+        if checkpoint.status != COMPLETED or head.content_hash != FileVersionService.compute_hash(content):
+            print(f"   ✗ ハッシュが不正です: {checkpoint.status} {head.content_hash}")
+            return False
+        print("   ✓ 内容の SHA-256 が設定されました")
+
+        print("\n🎉 すべてのテストが成功しました！")
+        return True
+
+    except Exception as e:
+        print(f"\n❌ テスト中にエラーが発生しました: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+    finally:
+        blob_store.enabled, blob_store.directory, blob_store.inline_max = saved_settings
+        db.close()
+
+if __name__ == "__main__":
+    success = asyncio.run(test_blob_store())
+    sys.exit(0 if success else 1)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+変更フィード（change_log）のテストスクリプト
+"""
+import sys
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from app.database import get_db, create_tables
+from app.services import FileVersionService, FolderService
+from app.changes import ChangeLogService
+import asyncio
+
+async def test_change_feed():
+    """変更フィードのテスト"""
+    print("変更フィードのテストを開始します...")
+
+    # テーブルを作成
+    create_tables()
+
+    # データベースセッションを取得
+    db = next(get_db())
+
+    try:
+        cursor = ChangeLogService.latest_cursor(db)
+
+        # フォルダ作成・ファイル作成・更新・削除
+        print("1. フォルダとファイルを作成・更新・削除...")
+        test_folder = FolderService.create_folder(db, "変更フィードテストフォルダ")
+        for operation, content in (("create", b"v1"), ("update", b"v2"), ("delete", b"")):
+            await FileVersionService.save_file_version(
+                db=db,
+                filename="change_feed_test.txt",
+                file_content=content,
+                memo=f"変更フィードテスト（{operation}）",
+                operation=operation,
+                folder_id=test_folder.id,
+                mime_type="text/plain"
+            )
+
+        # カーソル以降の変更を取得
+        print("2. カーソル以降の変更を取得...")
+        changes, next_cursor, has_more = ChangeLogService.get_changes(db, cursor)
+        summary = [(c["entity"], c["operation"], c["version"]) for c in changes]
+        expected = [("folder", "create", None), ("file", "create", 1), ("file", "update", 2), ("file", "delete", 3)]
+        if summary != expected or has_more:
+            print(f"   ✗ 変更が期待と異なります: {summary}")
+            return False
+        print(f"   ✓ {len(changes)} 件の変更を取得しました（次のカーソル: {next_cursor}）")
+
+        # ページング
+        print("3. 件数を制限して続きから取得...")
+        first_page, page_cursor, has_more = ChangeLogService.get_changes(db, cursor, limit=3)
+        second_page, _, _ = ChangeLogService.get_changes(db, page_cursor, limit=3)
+        if len(first_page) != 3 or not has_more or [c["cursor"] for c in first_page + second_page] != [c["cursor"] for c in changes]:
+            print("   ✗ ページングの結果が不正です")
+            return False
+        print("   ✓ カーソルで続きを取得できました")
+
+        # 変更がない場合
+        print("4. 最新のカーソル以降は空であることを確認...")
+        empty, same_cursor, _ = ChangeLogService.get_changes(db, next_cursor)
+        if empty or same_cursor != next_cursor:
+            print("   ✗ 最新のカーソル以降に変更が返されました")
+            return False
+        print("   ✓ 変更はありません")
+
+        print("\n🎉 すべてのテストが成功しました！")
+        return True
+
+    except Exception as e:
+        print(f"\n❌ テスト中にエラーが発生しました: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    success = asyncio.run(test_change_feed())
+    sys.exit(0 if success else 1)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+レスポンス圧縮のテストスクリプト
+"""
+import gzip
+import sys
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from fastapi import FastAPI
+from fastapi.responses import Response
+from fastapi.testclient import TestClient
+from app.compression import CompressionMiddleware, negotiate_encoding, is_compressible
+
+TEXT = ("圧縮テスト\n" * 1000).encode("utf-8")
+
+def create_app() -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware)
+
+    @app.get("/text")
+    async def text():
+        return Response(content=TEXT, media_type="text/plain")
+
+    @app.get("/gzip")
+    async def already_gzip():
+        return Response(content=gzip.compress(TEXT), media_type="application/gzip")
+
+    @app.get("/encoded")
+    async def already_encoded():
+        return Response(content=gzip.compress(TEXT), media_type="text/plain", headers={"Content-Encoding": "gzip"})
+
+    return app
+
+def test_compression():
+    """レスポンス圧縮のテスト"""
+    print("レスポンス圧縮のテストを開始します...")
+
+    # Accept-Encoding のネゴシエーション
+    print("1. Accept-Encoding から圧縮方式を選択...")
+    cases = {"gzip, deflate": "gzip", "gzip;q=0": None, "identity": None, "br;q=0, zstd;q=0, *": "gzip", "": None}
+    for header, expected in cases.items():
+        if negotiate_encoding(header) != expected:
+            print(f"   ✗ '{header}' の選択結果が不正です: {negotiate_encoding(header)}")
+            return False
+    if not is_compressible("application/json") or is_compressible("text/event-stream") or is_compressible("image/png"):
+        print("   ✗ 圧縮対象の判定が不正です")
+        return False
+    print("   ✓ 圧縮方式と対象の判定は正しく動作しました")
+
+    client = TestClient(create_app())
+
+    # テキストは圧縮される
+    print("2. テキストのレスポンスを圧縮...")
+    response = client.get("/text", headers={"Accept-Encoding": "gzip"})
+    if response.headers.get("content-encoding") != "gzip" or response.content != TEXT:
+        print(f"   ✗ 圧縮されていません: {response.headers}")
+        return False
+    if "accept-encoding" not in response.headers.get("vary", "").lower():
+        print("   ✗ Vary ヘッダがありません")
+        return False
+    print("   ✓ gzip で圧縮され、展開後の内容も一致しました")
+
+    # 圧縮済みの内容はそのまま
+    print("3. 圧縮済みの内容は再圧縮しないことを確認...")
+    response = client.get("/gzip", headers={"Accept-Encoding": "gzip"})
+    if response.headers.get("content-encoding") is not None or gzip.decompress(response.content) != TEXT:
+        print("   ✗ 圧縮済みの形式が再圧縮されました")
+        return False
+    response = client.get("/encoded", headers={"Accept-Encoding": "gzip"})
+    if response.content != TEXT:
+        print("   ✗ Content-Encoding 付きのレスポンスが二重に圧縮されました")
+        return False
+    print("   ✓ 圧縮済みの内容はそのまま返されました")
+
+    print("\n🎉 すべてのテストが成功しました！")
+    return True
+
+if __name__ == "__main__":
+    success = test_compression()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+プレビュー用派生データのテストスクリプト
+"""
+import os
+import sys
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from app.database import get_db, create_tables, engine, FileVersion, FileDerivative
+from app.services import FileVersionService, FolderService
+from app.derivatives import DerivativeService, generate_derivatives
+from app.main import app
+import asyncio
+
+async def test_file_preview():
+    """プレビュー用派生データのテスト"""
+    print("プレビュー用派生データのテストを開始します...")
+
+    # テーブルを作成
+    create_tables()
+
+    # データベースセッションを取得
+    db = next(get_db())
+
+    try:
+        # テストフォルダを作成
+        print("1. テストフォルダを作成...")
+        test_folder = FolderService.create_folder(db, "プレビューテストフォルダ")
+        print(f"   フォルダ作成完了: ID={test_folder.id}, 名前={test_folder.name}")
+
+        # テキスト冒頭の生成
+        print("2. テキストの派生データを生成...")
+        text_content = "\n".join(f"{i}行目" for i in range(200)).encode('utf-8')
+        derivatives = generate_derivatives(text_content, "text/plain")
+        if derivatives[0]["kind"] == "text" and derivatives[0]["meta"]["truncated"]:
+            print(f"   ✓ テキスト冒頭 {derivatives[0]['meta']['lines']} 行を生成しました")
+        else:
+            print(f"   ✗ テキストの派生データが不正です: {derivatives}")
+            return False
+
+        # PDFページ数の取得
+        print("3. PDFのページ数を取得...")
+        pdf_content = b"%PDF-1.4\n1 0 obj << /Type /Pages /Count 2 >>\n2 0 obj << /Type /Page >>\n3 0 obj << /Type/Page >>\n"
+        derivatives = generate_derivatives(pdf_content, "application/pdf")
+        if derivatives[0]["meta"].get("page_count") == 2:
+            print("   ✓ ページ数 2 を取得しました")
+        else:
+            print(f"   ✗ ページ数が不正です: {derivatives}")
+            return False
+        if derivatives[0]["meta"].get("page_count_approximate"):
+            print("   ✗ 概数として扱われています")
+            return False
+        compressed_pdf = b"%PDF-1.5\n1 0 obj << /Type /ObjStm /N 3 /Length 50 /Filter /FlateDecode >>\n"
+        derivatives = generate_derivatives(compressed_pdf, "application/pdf")
+        meta = derivatives[0]["meta"]
+        if meta.get("page_count_approximate") is not True or meta.get("page_count") is not None:
+            print(f"   ✗ オブジェクトストリームを含むPDFのページ数が不明として扱われていません: {meta}")
+            return False
+        print("   ✓ オブジェクトストリームを含むPDFは概数（不明）として扱われました")
+
+        # 派生データの保存と古いバージョン削除時の追従
+        print("4. 派生データを保存し、古いバージョン削除時に一緒に削除されることを確認...")
+        first_version = await FileVersionService.save_file_version(
+            db=db,
+            filename="preview_test.txt",
+            file_content=text_content,
+            memo="プレビューテスト用ファイル",
+            operation="create",
+            folder_id=test_folder.id,
+            mime_type="text/plain"
+        )
+        first_version_id = first_version.id
+        DerivativeService.store(first_version_id, generate_derivatives(text_content, "text/plain"))
+
+        if "text" not in DerivativeService.get_derivatives(db, first_version_id):
+            print("   ✗ 派生データが保存されていません")
+            return False
+
+        for i in range(3):
+            await FileVersionService.save_file_version(
+                db=db,
+                filename="preview_test.txt",
+                file_content=f"更新 {i}".encode('utf-8'),
+                memo=f"更新 {i}",
+                operation="update",
+                folder_id=test_folder.id,
+                mime_type="text/plain"
+            )
+
+        remaining = db.query(FileDerivative).filter(FileDerivative.version_id == first_version_id).count()
+        if remaining == 0:
+            print("   ✓ 削除されたバージョンの派生データも削除されました")
+        else:
+            print(f"   ✗ 派生データが残っています: {remaining} 件")
+            return False
+
+        # 生成済みのプレビューでは本体を読み込まないこと
+        print("5. 生成済みのプレビュー取得でファイル内容を読み込まないことを確認...")
+        latest = FileVersionService.get_latest_version(db, "preview_test.txt", test_folder.id)
+        DerivativeService.store(latest.id, generate_derivatives(latest.file_content, "text/plain"))
+        statements = []
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            if "FROM file_versions" in statement:
+                statements.append(statement)
+        event.listen(engine, "before_cursor_execute", capture)
+        try:
+            response = TestClient(app).get(f"/files/preview_test.txt/preview?folder_id={test_folder.id}")
+        finally:
+            event.remove(engine, "before_cursor_execute", capture)
+        if response.status_code != 200 or response.json().get("kind") != "text":
+            print(f"   ✗ 応答が不正です: {response.status_code} {response.text}")
+            return False
+        if not statements or any("file_content" in statement for statement in statements):
+            print(f"   ✗ ファイル内容が読み込まれました: {statements}")
+            return False
+        print("   ✓ ファイル内容を読み込まずに返されました")
+
+        print("\n✓ すべてのテストが成功しました！")
+        return True
+
+    except Exception as e:
+        print(f"\n✗ テスト中にエラーが発生しました: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    success = asyncio.run(test_file_preview())
+    sys.exit(0 if success else 1)
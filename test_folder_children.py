@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+フォルダの遅延展開（/folders/{id}/children?depth=N）のテストスクリプト
+"""
+import sys
+import time
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from app.database import get_db, create_tables, engine
+from app.services import FileVersionService, FolderService
+from app.main import app
+import asyncio
+
+async def test_folder_children():
+    """フォルダの遅延展開のテスト"""
+    print("フォルダの遅延展開のテストを開始します...")
+
+    # テーブルを作成
+    create_tables()
+
+    # データベースセッションを取得
+    db = next(get_db())
+    client = TestClient(app)
+    suffix = int(time.time())
+
+    try:
+        # top ─┬ b ─ b1 ─ b11
+        #      └ a ─ a1
+        top = FolderService.create_folder(db, f"展開_{suffix}")
+        b = FolderService.create_folder(db, "b", top.id)
+        a = FolderService.create_folder(db, "a", top.id)
+        b1 = FolderService.create_folder(db, "b1", b.id)
+        FolderService.create_folder(db, "a1", a.id)
+        FolderService.create_folder(db, "b11", b1.id)
+        await FileVersionService.save_file_version(
+            db=db, filename="file.txt", file_content=b"12345", memo=None, operation="create", folder_id=b1.id
+        )
+
+        print("1. depth=1 では直下の子だけを返す...")
+        url = f"/folders/{top.id}/children"
+        statements = []
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            if "folders" in statement:
+                statements.append(statement)
+        event.listen(engine, "before_cursor_execute", count_statement)
+        try:
+            response = client.get(url)
+        finally:
+            event.remove(engine, "before_cursor_execute", count_statement)
+        nodes = response.json()
+        if response.status_code != 200 or [n["name"] for n in nodes] != ["a", "b"]:
+            print(f"   ✗ 応答が不正です: {response.status_code} {response.text}")
+            return False
+        if any(n["children"] for n in nodes) or [n["child_count"] for n in nodes] != [1, 1] or not all(n["has_children"] for n in nodes):
+            print(f"   ✗ 子の有無・件数が不正です: {nodes}")
+            return False
+        # 存在確認と CTE の2回（階層ごとのクエリにならないこと）
+        if len(statements) > 2:
+            print(f"   ✗ クエリが多すぎます: {len(statements)}")
+            return False
+        print("   ✓ 名前順に2件、子の件数付きで返されました")
+
+        print("2. depth を指定した階層まで展開...")
+        nodes = client.get(f"/folders/{top.id}/children?depth=2").json()
+        by_name = {n["name"]: n for n in nodes}
+        if [c["name"] for c in by_name["b"]["children"]] != ["b1"] or by_name["b"]["children"][0]["children"]:
+            print(f"   ✗ 2階層目の展開が不正です: {nodes}")
+            return False
+        b1_node = by_name["b"]["children"][0]
+        if b1_node["file_count"] != 1 or b1_node["head_bytes"] != 5 or not b1_node["has_children"]:
+            print(f"   ✗ 集計値・子の有無が不正です: {b1_node}")
+            return False
+        nodes = client.get(f"/folders/{top.id}/children?depth=3").json()
+        deepest = {n["name"]: n for n in nodes}["b"]["children"][0]["children"]
+        if [n["name"] for n in deepest] != ["b11"] or deepest[0]["has_children"]:
+            print(f"   ✗ 3階層目の展開が不正です: {deepest}")
+            return False
+        print("   ✓ 指定した深さで打ち切られ、末端は has_children=false")
+
+        print("3. ルート直下の取得と入力の検証...")
+        roots = client.get("/folders/children").json()
+        if top.id not in {n["id"] for n in roots} or any(n["parent_id"] is not None for n in roots):
+            print("   ✗ ルート直下のフォルダが返されていません")
+            return False
+        if client.get(f"/folders/{10 ** 9}/children").status_code != 404:
+            print("   ✗ 存在しないフォルダが404になりません")
+            return False
+        if client.get(f"/folders/{top.id}/children?depth=0").status_code != 422:
+            print("   ✗ depth=0 が拒否されません")
+            return False
+        print("   ✓ ルート直下が返され、不正な指定は拒否されました")
+
+        print("\n🎉 すべてのテストが成功しました！")
+        return True
+
+    except Exception as e:
+        print(f"\n❌ テスト中にエラーが発生しました: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    success = asyncio.run(test_folder_children())
+    sys.exit(0 if success else 1)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+フォルダの一括削除・移動のテストスクリプト
+"""
+import sys
+import time
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from sqlalchemy import event
+from app.database import get_db, create_tables, engine, Folder, FileVersion, FileDerivative
+from app.services import FileVersionService, FolderService, FileConflictError, FolderCycleError
+import asyncio
+
+async def _build_tree(db, name: str):
+    """ルート → 子2つ → 孫1つのツリーを作り、各フォルダにファイルを2つずつ置く"""
+    root = FolderService.create_folder(db, name)
+    left = FolderService.create_folder(db, "左", root.id)
+    right = FolderService.create_folder(db, "右", root.id)
+    leaf = FolderService.create_folder(db, "孫", left.id)
+    folders = [root, left, right, leaf]
+    for folder in folders:
+        for i in range(2):
+            for version in range(4):
+                await FileVersionService.save_file_version(
+                    db=db,
+                    filename=f"file_{i}.txt",
+                    file_content=f"{folder.id} {i} {version}".encode('utf-8'),
+                    memo=None,
+                    operation="create" if version == 0 else "update",
+                    folder_id=folder.id,
+                    mime_type="text/plain"
+                )
+    return [folder.id for folder in folders]
+
+async def test_folder_operations():
+    """フォルダの一括削除・移動のテスト"""
+    print("フォルダの一括削除・移動のテストを開始します...")
+
+    # テーブルを作成
+    create_tables()
+
+    # データベースセッションを取得
+    db = next(get_db())
+    suffix = int(time.time())
+
+    try:
+        print("1. フォルダ以下を論理削除...")
+        ids = await _build_tree(db, f"論理削除_{suffix}")
+        result = FolderService.delete_folder(db, ids[0], "まとめて削除")
+        if result["files"] != 8 or result["folders"] != 4:
+            print(f"   ✗ 削除件数が不正です: {result}")
+            return False
+        for folder_id in ids:
+            head = FileVersionService.get_version_metadata(db, "file_0.txt", folder_id)
+            if head.operation != "delete" or head.version != 5:
+                print(f"   ✗ 削除記録が作成されていません: folder={folder_id}")
+                return False
+            if len(FileVersionService.get_file_versions(db, "file_0.txt", folder_id)) != 3:
+                print("   ✗ 保持数を超えたバージョンが削除されていません")
+                return False
+        db.expire_all()
+        stats = db.query(Folder).filter(Folder.id.in_(ids)).all()
+        if any(folder.file_count or folder.head_bytes for folder in stats):
+            print("   ✗ 集計値が更新されていません")
+            return False
+        before = [folder.retained_bytes for folder in stats]
+        FolderService.recompute_stats(db)
+        db.expire_all()
+        if before != [folder.retained_bytes for folder in db.query(Folder).filter(Folder.id.in_(ids)).all()]:
+            print("   ✗ 保持サイズが再計算の結果と一致しません")
+            return False
+        if FolderService.delete_folder(db, ids[0])["files"] != 0:
+            print("   ✗ 削除済みのファイルに削除記録が重ねて作成されました")
+            return False
+        print("   ✓ 8ファイルに削除記録が作成され、集計値も再計算と一致しました")
+
+        print("2. フォルダを移動...")
+        ids = await _build_tree(db, f"移動_{suffix}")
+        target = FolderService.create_folder(db, f"移動先_{suffix}")
+        moved = FolderService.move_folder(db, ids[1], target.id)
+        if moved.parent_id != target.id:
+            print("   ✗ 親フォルダが変わっていません")
+            return False
+        try:
+            FolderService.move_folder(db, target.id, ids[3])
+            print("   ✗ 子孫の下への移動が拒否されませんでした")
+            return False
+        except FolderCycleError:
+            pass
+        try:
+            FolderService.move_folder(db, ids[1], ids[1])
+            print("   ✗ 自身の下への移動が拒否されませんでした")
+            return False
+        except FolderCycleError:
+            pass
+        FolderService.create_folder(db, "左", ids[0])
+        try:
+            FolderService.move_folder(db, ids[1], ids[0])
+            print("   ✗ 同名のフォルダがある移動先への移動が拒否されませんでした")
+            return False
+        except FileConflictError:
+            pass
+        db.expire_all()
+        if db.query(Folder.parent_id).filter(Folder.id == target.id).scalar() is not None:
+            print("   ✗ 拒否された移動が反映されています")
+            return False
+        print("   ✓ 移動でき、循環と名前の重複は拒否されました")
+
+        print("3. フォルダ以下を物理削除...")
+        ids = await _build_tree(db, f"物理削除_{suffix}")
+        version_ids = [row.id for row in db.query(FileVersion.id).filter(FileVersion.folder_id.in_(ids)).all()]
+        db.add(FileDerivative(version_id=version_ids[0], kind="text", content=b"preview"))
+        db.commit()
+
+        statements = []
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        event.listen(engine, "before_cursor_execute", count_statement)
+        try:
+            result = FolderService.purge_folder(db, ids[0])
+        finally:
+            event.remove(engine, "before_cursor_execute", count_statement)
+
+        if result["folders"] != 4 or result["versions"] != 24:
+            print(f"   ✗ 削除件数が不正です: {result}")
+            return False
+        if db.query(Folder).filter(Folder.id.in_(ids)).count() or db.query(FileVersion).filter(FileVersion.id.in_(version_ids)).count():
+            print("   ✗ フォルダまたはバージョンが残っています")
+            return False
+        if db.query(FileDerivative).filter(FileDerivative.version_id.in_(version_ids)).count():
+            print("   ✗ 派生データが残っています")
+            return False
+        if len(statements) > 10:
+            print(f"   ✗ 発行された文が多すぎます: {len(statements)}")
+            return False
+        print(f"   ✓ 4フォルダ・24バージョンを {len(statements)} 文で削除しました")
+
+        print("\n🎉 すべてのテストが成功しました！")
+        return True
+
+    except Exception as e:
+        print(f"\n❌ テスト中にエラーが発生しました: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    success = asyncio.run(test_folder_operations())
+    sys.exit(0 if success else 1)
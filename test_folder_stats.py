@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+フォルダの集計値（ファイル数・最新版サイズ・保持中の全バージョンサイズ）の差分更新のテストスクリプト
+"""
+import sys
+import time
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from fastapi.testclient import TestClient
+from app.database import get_db, create_tables, Folder
+from app.services import FileVersionService, FolderService, RETAINED_VERSIONS
+from app.main import app
+import asyncio
+
+def _stats(db, folder_id: int) -> tuple:
+    db.expire_all()
+    folder = db.query(Folder).filter(Folder.id == folder_id).one()
+    return folder.file_count, folder.head_bytes, folder.retained_bytes
+
+async def _save(db, filename: str, size: int, folder_id: int, operation: str = None):
+    return await FileVersionService.save_file_version(
+        db=db, filename=filename, file_content=f"{filename}:{time.time_ns()}".encode("utf-8").ljust(size, b".")[:size],
+        memo=None, operation=operation or FileVersionService.detect_operation(db, filename, folder_id),
+        folder_id=folder_id, force=False
+    )
+
+async def test_folder_stats():
+    """フォルダの集計値のテスト"""
+    print("フォルダの集計値のテストを開始します...")
+
+    # テーブルを作成
+    create_tables()
+
+    # データベースセッションを取得
+    db = next(get_db())
+    suffix = int(time.time())
+
+    try:
+        parent = FolderService.create_folder(db, f"集計_{suffix}")
+        child = FolderService.create_folder(db, f"集計_子_{suffix}", parent.id)
+
+        print("1. 作成・更新で集計値が増えることを確認...")
+        await _save(db, "a.txt", 100, parent.id)
+        await _save(db, "a.txt", 200, parent.id)
+        await _save(db, "b.txt", 50, parent.id)
+        if _stats(db, parent.id) != (2, 250, 350):
+            print(f"   ✗ 集計値が不正です: {_stats(db, parent.id)}")
+            return False
+        print("   ✓ ファイル数 2、最新版 250 バイト、保持中 350 バイト")
+
+        print("2. 削除で件数と最新版サイズが減ることを確認...")
+        await FileVersionService.save_file_version(
+            db=db, filename="b.txt", file_content=b"", memo=None, operation="delete", folder_id=parent.id, force=False
+        )
+        if _stats(db, parent.id) != (1, 200, 350):
+            print(f"   ✗ 集計値が不正です: {_stats(db, parent.id)}")
+            return False
+        await _save(db, "b.txt", 70, parent.id)
+        if _stats(db, parent.id) != (2, 270, 420):
+            print(f"   ✗ 削除後の再作成で集計値が不正です: {_stats(db, parent.id)}")
+            return False
+        print("   ✓ 削除で減り、再作成で戻りました")
+
+        print("3. 保持数を超えて削除されたバージョンの分だけ保持中サイズが減ることを確認...")
+        for size in (300, 400, 500):
+            await _save(db, "a.txt", size, parent.id)
+        # a.txt は最新の RETAINED_VERSIONS 件（300, 400, 500）だけが残る
+        retained_a = sum((300, 400, 500)[-RETAINED_VERSIONS:])
+        if _stats(db, parent.id) != (2, 570, retained_a + 120):
+            print(f"   ✗ 集計値が不正です: {_stats(db, parent.id)}")
+            return False
+        print(f"   ✓ 保持中 {retained_a + 120} バイト")
+
+        print("4. 一括再計算の結果が差分更新と一致することを確認...")
+        await _save(db, "c.txt", 30, child.id)
+        incremental = {folder_id: _stats(db, folder_id) for folder_id in (parent.id, child.id)}
+        db.query(Folder).filter(Folder.id.in_([parent.id, child.id])).update(
+            {Folder.file_count: 0, Folder.head_bytes: 0, Folder.retained_bytes: 0}, synchronize_session=False
+        )
+        db.commit()
+        FolderService.recompute_stats(db)
+        recomputed = {folder_id: _stats(db, folder_id) for folder_id in (parent.id, child.id)}
+        if recomputed != incremental:
+            print(f"   ✗ 一致しません: 差分 {incremental}, 再計算 {recomputed}")
+            return False
+        print("   ✓ 一致しました")
+
+        print("5. フォルダ一覧でサブツリー全体の合計が返されることを確認...")
+        folders = {folder["id"]: folder for folder in TestClient(app).get("/folders").json()}
+        node = folders.get(parent.id)
+        if not node or (node["subtree_file_count"], node["subtree_head_bytes"]) != (3, 600):
+            print(f"   ✗ サブツリーの合計が不正です: {node}")
+            return False
+        print("   ✓ 子フォルダを含めてファイル数 3、最新版 600 バイト")
+
+        print("\n🎉 すべてのテストが成功しました！")
+        return True
+
+    except Exception as e:
+        print(f"\n❌ テスト中にエラーが発生しました: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    success = asyncio.run(test_folder_stats())
+    sys.exit(0 if success else 1)
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+フォルダツリーのキャッシュと無効化のテストスクリプト
+"""
+import sys
+import time
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.database import get_db, create_tables, DATABASE_URL
+from app.services import FolderService
+from app.events import bus, ChangeEvent, FOLDER_CREATED
+from app import events, main
+import asyncio
+
+async def test_folder_tree_cache():
+    """フォルダツリーのキャッシュのテスト"""
+    print("フォルダツリーのキャッシュのテストを開始します...")
+
+    # テーブルを作成
+    create_tables()
+
+    # データベースセッションを取得
+    db = next(get_db())
+    client = TestClient(main.app)
+    suffix = int(time.time())
+
+    def names():
+        return {folder["name"] for folder in client.get("/folders").json()}
+
+    try:
+        print("1. 取得結果がキャッシュされることを確認...")
+        main._folder_tree_cache.clear()
+        first = FolderService.create_folder(db, f"キャッシュ_{suffix}_1")
+        if first.name not in names() or "tree" not in main._folder_tree_cache:
+            print("   ✗ キャッシュされていません")
+            return False
+        print("   ✓ キャッシュされました")
+
+        print("2. フォルダ作成で無効化されることを確認...")
+        second = FolderService.create_folder(db, f"キャッシュ_{suffix}_2")
+        if "tree" in main._folder_tree_cache or second.name not in names():
+            print("   ✗ 無効化されていません")
+            return False
+        print("   ✓ 無効化され、新しいフォルダが返されました")
+
+        print("3. 読み込み中に無効化された結果はキャッシュしないことを確認...")
+        main._folder_tree_cache.clear()
+        original_get_folder_tree = FolderService.__dict__["get_folder_tree"]
+        def get_folder_tree_then_invalidate(session):
+            folders = original_get_folder_tree.__func__(session)
+            # 読み込みの後、キャッシュへの保存の前に他のワーカーの変更通知が届く状況を再現する
+            bus.dispatch(ChangeEvent(type=FOLDER_CREATED))
+            return folders
+        FolderService.get_folder_tree = staticmethod(get_folder_tree_then_invalidate)
+        try:
+            names()
+        finally:
+            FolderService.get_folder_tree = original_get_folder_tree
+        if "tree" in main._folder_tree_cache:
+            print("   ✗ 無効化前の結果がキャッシュされました")
+            return False
+        names()
+        if "tree" not in main._folder_tree_cache:
+            print("   ✗ 次の取得でキャッシュされていません")
+            return False
+        print("   ✓ 保存されず、次の取得でキャッシュされました")
+
+        print("4. 他のワーカーの変更でも無効化されることを確認（SQLite）...")
+        saved_interval = events.EVENT_POLL_SECONDS
+        events.EVENT_POLL_SECONDS = 0.05
+        bus.start()
+        # イベントバスを経由しない別の接続（別プロセスのワーカー相当）
+        other_engine = create_engine(DATABASE_URL)
+        other_db = sessionmaker(bind=other_engine)()
+        try:
+            await asyncio.sleep(0.2)
+            names()
+            if "tree" not in main._folder_tree_cache:
+                print("   ✗ キャッシュされていません")
+                return False
+            third = FolderService.create_folder(other_db, f"キャッシュ_{suffix}_3")
+            for _ in range(40):
+                if "tree" not in main._folder_tree_cache:
+                    break
+                await asyncio.sleep(0.05)
+            if third.name not in names():
+                print("   ✗ 他のワーカーで作成されたフォルダが返されません")
+                return False
+        finally:
+            bus.stop()
+            events.EVENT_POLL_SECONDS = saved_interval
+            other_db.close()
+            other_engine.dispose()
+        print("   ✓ 無効化され、他のワーカーで作成されたフォルダが返されました")
+
+        print("\n🎉 すべてのテストが成功しました！")
+        return True
+
+    except Exception as e:
+        print(f"\n❌ テスト中にエラーが発生しました: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    success = asyncio.run(test_folder_tree_cache())
+    sys.exit(0 if success else 1)
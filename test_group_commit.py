@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+グループコミットのテストスクリプト
+"""
+import sys
+import time
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from app.database import get_db, create_tables
+from app.services import FileVersionService, FolderService
+from app.group_commit import GroupCommitWriter
+from app.derivatives import DerivativeService
+import asyncio
+
+async def test_group_commit():
+    """グループコミットのテスト"""
+    print("グループコミットのテストを開始します...")
+
+    # テーブルを作成
+    create_tables()
+
+    # データベースセッションを取得
+    db = next(get_db())
+    writer = GroupCommitWriter(window_ms=20, max_items=50)
+    writer.start()
+    filename = f"group_commit_test_{int(time.time())}.txt"
+
+    try:
+        folder = FolderService.create_folder(db, "グループコミット用フォルダ")
+
+        # 同時に届いた保存が1つのトランザクションにまとめられる
+        print("1. 同じファイルへの同時アップロードをまとめて保存...")
+        results = await asyncio.gather(*[
+            writer.submit({"filename": filename, "file_content": f"内容 {i}".encode("utf-8"), "folder_id": folder.id})
+            for i in range(5)
+        ])
+        if [r["version"] for r in results] != [1, 2, 3, 4, 5] or writer.batches != 1:
+            print(f"   ✗ バージョン番号またはバッチ数が不正です: {[r['version'] for r in results]}, batches={writer.batches}")
+            return False
+        print("   ✓ 到着順に採番され、1回のコミットで保存されました")
+
+        # 保持数の整理
+        print("2. 保持数を超えた古いバージョンが削除されることを確認...")
+        db.expire_all()
+        versions = FileVersionService.get_file_versions(db, filename, folder.id)
+        if [v.version for v in versions] != [5, 4, 3] or versions[0].file_content != "内容 4".encode("utf-8"):
+            print(f"   ✗ 保持されているバージョンが不正です: {[v.version for v in versions]}")
+            return False
+        print("   ✓ 最新の3バージョンだけが保持されています")
+
+        # 失敗した保存は他に影響しない
+        print("3. 失敗した保存が同じバッチの他の保存に影響しないことを確認...")
+        outcomes = await asyncio.gather(
+            writer.submit({"filename": filename, "file_content": "内容 5".encode("utf-8"), "folder_id": folder.id}),
+            writer.submit({"filename": filename, "file_content": None, "folder_id": folder.id}),
+            return_exceptions=True
+        )
+        if not isinstance(outcomes[1], Exception) or isinstance(outcomes[0], Exception) or outcomes[0]["version"] != 6:
+            print(f"   ✗ 失敗の扱いが不正です: {outcomes}")
+            return False
+        print("   ✓ 失敗した呼び出し元にだけ例外が返されました")
+
+        # 通常の保存と同じくプレビュー用の派生データが生成される
+        print("4. まとめて保存したバージョンの派生データが生成されることを確認...")
+        result = await writer.submit({
+            "filename": f"preview_{filename}", "file_content": "プレビュー".encode("utf-8"),
+            "folder_id": folder.id, "mime_type": "text/plain"
+        })
+        for _ in range(100):
+            db.expire_all()
+            derivatives = DerivativeService.get_derivatives(db, result["id"])
+            if derivatives and not DerivativeService.is_pending(result["id"]):
+                break
+            await asyncio.sleep(0.05)
+        if "text" not in derivatives:
+            print(f"   ✗ 派生データが生成されていません: {list(derivatives)}")
+            return False
+        print("   ✓ テキストの派生データが保存されました")
+
+        print("\n🎉 すべてのテストが成功しました！")
+        return True
+
+    except Exception as e:
+        print(f"\n❌ テスト中にエラーが発生しました: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+    finally:
+        await writer.stop()
+        db.close()
+
+if __name__ == "__main__":
+    success = asyncio.run(test_group_commit())
+    sys.exit(0 if success else 1)
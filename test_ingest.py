@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+一括取り込み（ingest.py）のテストスクリプト
+"""
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from app.database import get_db, create_tables, FileVersion, Folder
+from app.services import FolderService
+import ingest
+import asyncio
+
+async def test_ingest():
+    """一括取り込みのテスト"""
+    print("一括取り込みのテストを開始します...")
+
+    # テーブルを作成
+    create_tables()
+
+    # データベースセッションを取得
+    db = next(get_db())
+    source = Path(tempfile.mkdtemp(prefix="ingest_test_"))
+    file_size = 1000
+    for directory in ("", "sub", "sub/deep"):
+        (source / directory).mkdir(parents=True, exist_ok=True)
+        for i in range(15):
+            (source / directory / f"file_{i}.txt").write_bytes(f"{directory}/{i}".encode("utf-8").ljust(file_size, b"."))
+    total_files = 45
+
+    # 読み込んだバイト数と、バッチ書き込み時点でメモリに保持している量を記録する
+    counters = {"read": 0, "saved": 0, "held": []}
+    original_read_file = ingest.read_file
+    original_save_batch = ingest.save_batch
+    def counting_read_file(entry):
+        result = original_read_file(entry)
+        counters["read"] += len(result[2] or b"")
+        return result
+    def recording_save_batch(db, items, stats, started):
+        counters["held"].append(counters["read"] - counters["saved"])
+        original_save_batch(db, items, stats, started)
+        counters["saved"] += sum(len(item["file_content"]) for item in items)
+    ingest.read_file = counting_read_file
+    ingest.save_batch = recording_save_batch
+
+    try:
+        print("1. ディレクトリツリーを取り込み...")
+        parent = FolderService.create_folder(db, f"取り込み_{int(time.time())}")
+        batch_bytes = 4 * file_size
+        read_ahead_bytes = 3 * file_size
+        ingest.ingest(source, folder_id=parent.id, batch_size=500, batch_bytes=batch_bytes,
+                      workers=4, read_ahead_bytes=read_ahead_bytes)
+        db.expire_all()
+        sub = db.query(Folder).filter(Folder.parent_id == parent.id, Folder.name == "sub").first()
+        deep = db.query(Folder).filter(Folder.parent_id == sub.id, Folder.name == "deep").first() if sub else None
+        folder_ids = [parent.id] + ([sub.id] if sub else []) + ([deep.id] if deep else [])
+        created = db.query(FileVersion).filter(FileVersion.folder_id.in_(folder_ids)).count()
+        if deep is None or created != total_files:
+            print(f"   ✗ 取り込み結果が不正です: フォルダ {folder_ids}, {created} 件")
+            return False
+        print(f"   ✓ 3階層のフォルダと {created} ファイルが作成されました")
+
+        print("2. 保持する内容がバッチと先読みの上限に収まることを確認...")
+        limit = batch_bytes + file_size + read_ahead_bytes
+        if not counters["held"] or max(counters["held"]) > limit:
+            print(f"   ✗ 上限（{limit} バイト）を超えて読み込まれました: {counters['held']}")
+            return False
+        print(f"   ✓ 最大 {max(counters['held'])} バイト（{len(counters['held'])} バッチ）")
+
+        print("3. 再実行では変更のないファイルをスキップ...")
+        ingest.ingest(source, folder_id=parent.id, batch_size=10, batch_bytes=batch_bytes,
+                      workers=4, read_ahead_bytes=read_ahead_bytes)
+        db.expire_all()
+        if db.query(FileVersion).filter(FileVersion.folder_id.in_(folder_ids)).count() != total_files:
+            print("   ✗ 重複したバージョンが作成されました")
+            return False
+        print("   ✓ 新しいバージョンは作成されませんでした")
+
+        print("\n🎉 すべてのテストが成功しました！")
+        return True
+
+    except Exception as e:
+        print(f"\n❌ テスト中にエラーが発生しました: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+    finally:
+        ingest.read_file = original_read_file
+        ingest.save_batch = original_save_batch
+        db.close()
+
+if __name__ == "__main__":
+    success = asyncio.run(test_ingest())
+    sys.exit(0 if success else 1)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+バックグラウンドジョブのテストスクリプト
+"""
+import os
+import sys
+import time
+from pathlib import Path
+
+os.environ.setdefault("JOB_POLL_SECONDS", "0.2")
+
+# プロジェクトルートをPythonパスに追加
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from app.database import get_db, create_tables
+from app.jobs import JobService, JobRunner, job_handler, SUCCEEDED, CANCELLED, FINISHED_STATUSES
+
+@job_handler("test_sleep", concurrency=1)
+def test_sleep(context, db):
+    """テスト用：指定秒数かけて進捗を報告する"""
+    steps = context.params.get("steps", 5)
+    for step in range(steps):
+        time.sleep(context.params.get("interval", 0.1))
+        context.progress((step + 1) / steps, force=True)
+    return {"steps": steps}
+
+def wait_for(db, job_id, statuses, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        db.expire_all()
+        job = JobService.get_job(db, job_id)
+        if job.status in statuses:
+            return job
+        time.sleep(0.1)
+    return JobService.get_job(db, job_id)
+
+def test_jobs():
+    """バックグラウンドジョブのテスト"""
+    print("バックグラウンドジョブのテストを開始します...")
+
+    # テーブルを作成
+    create_tables()
+
+    # データベースセッションを取得
+    db = next(get_db())
+    runner = JobRunner(threads=2)
+    runner.start()
+
+    try:
+        # 実行と結果
+        print("1. ジョブを登録して完了を待つ...")
+        job = JobService.enqueue(db, "test_sleep", {"steps": 3})
+        job = wait_for(db, job.id, FINISHED_STATUSES)
+        if job.status != SUCCEEDED or job.progress != 1.0 or JobService.to_dict(job)["result"] != {"steps": 3}:
+            print(f"   ✗ ジョブが正常に完了しませんでした: {JobService.to_dict(job)}")
+            return False
+        print("   ✓ ジョブが完了しました")
+
+        # 種別ごとの同時実行数
+        print("2. 同時実行数（1）を超えて実行されないことを確認...")
+        first = JobService.enqueue(db, "test_sleep", {"steps": 5, "interval": 0.2})
+        second = JobService.enqueue(db, "test_sleep", {"steps": 1})
+        first = wait_for(db, first.id, ("running",))
+        time.sleep(0.5)
+        db.expire_all()
+        if JobService.get_job(db, second.id).status != "queued":
+            print("   ✗ 同時実行数の上限を超えて実行されました")
+            return False
+        print("   ✓ 2つ目のジョブは待機しています")
+
+        # 実行中のキャンセル
+        print("3. 実行中のジョブをキャンセル...")
+        JobService.cancel(db, first)
+        first = wait_for(db, first.id, FINISHED_STATUSES)
+        if first.status != CANCELLED:
+            print(f"   ✗ キャンセルされませんでした: {first.status}")
+            return False
+        second = wait_for(db, second.id, FINISHED_STATUSES)
+        if second.status != SUCCEEDED:
+            print(f"   ✗ 待機していたジョブが実行されませんでした: {second.status}")
+            return False
+        print("   ✓ キャンセル後に待機中のジョブが実行されました")
+
+        # 不明な種別
+        print("4. 不明なジョブ種別は登録できないことを確認...")
+        try:
+            JobService.enqueue(db, "unknown_job_type")
+            print("   ✗ 不明な種別が登録されました")
+            return False
+        except ValueError:
+            print("   ✓ 登録は拒否されました")
+
+        print("\n🎉 すべてのテストが成功しました！")
+        return True
+
+    except Exception as e:
+        print(f"\n❌ テスト中にエラーが発生しました: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+    finally:
+        runner.stop()
+        db.close()
+
+if __name__ == "__main__":
+    success = test_jobs()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+ファイル一覧の NDJSON ストリーミングのテストスクリプト
+"""
+import json
+import sys
+import time
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from app.database import get_db, create_tables, engine
+from app.services import FileVersionService, FolderService
+from app.main import app
+import asyncio
+
+async def test_ndjson_listing():
+    """ファイル一覧の NDJSON ストリーミングのテスト"""
+    print("NDJSON ストリーミングのテストを開始します...")
+
+    # テーブルを作成
+    create_tables()
+
+    # データベースセッションを取得
+    db = next(get_db())
+    client = TestClient(app)
+    suffix = int(time.time())
+
+    try:
+        folders = [FolderService.create_folder(db, f"ndjson_{suffix}_{i}") for i in range(2)]
+        names = ["c.txt", "a.txt", "b.txt"]
+        for folder in folders:
+            for name in names:
+                for version in range(2):
+                    await FileVersionService.save_file_version(
+                        db=db,
+                        filename=name,
+                        file_content=f"{folder.id} {name} {version}".encode("utf-8"),
+                        memo=None,
+                        operation="create" if version == 0 else "update",
+                        folder_id=folder.id
+                    )
+
+        print("1. NDJSON で一覧をストリーミング...")
+        statements = []
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            if "FROM file_versions" in statement and "ORDER BY" in statement:
+                statements.append(statement)
+        event.listen(engine, "before_cursor_execute", capture)
+        try:
+            lines = []
+            with client.stream("GET", "/files", headers={"Accept": "application/x-ndjson"}) as response:
+                if response.status_code != 200 or not response.headers["content-type"].startswith("application/x-ndjson"):
+                    print(f"   ✗ 応答が不正です: {response.status_code} {response.headers.get('content-type')}")
+                    return False
+                for line in response.iter_lines():
+                    if line:
+                        lines.append(json.loads(line))
+        finally:
+            event.remove(engine, "before_cursor_execute", capture)
+
+        streamed = [(f["folder_id"], f["filename"]) for f in lines if f["folder_id"] in {f.id for f in folders}]
+        expected = sorted((folder.id, name) for folder in folders for name in names)
+        if streamed != expected:
+            print(f"   ✗ (folder_id, filename) の順に返されていません: {streamed}")
+            return False
+        if any(f["latest_version"] != 2 for f in lines if f["folder_id"] in {f.id for f in folders}):
+            print("   ✗ 最新バージョンが返されていません")
+            return False
+        print(f"   ✓ {len(lines)} 行がフォルダID・ファイル名の順に返されました")
+
+        print("2. ストリーミングのクエリが更新日時で並べ替えないことを確認...")
+        order_by = statements[-1].rsplit("ORDER BY", 1)[1] if statements else ""
+        if "created_at" in order_by or "folder_id" not in order_by:
+            print(f"   ✗ 並べ替えの条件が不正です: {order_by.strip()}")
+            return False
+        print(f"   ✓ ORDER BY {order_by.strip()}")
+
+        print("3. JSON の一覧と同じファイルが返されることを確認...")
+        listed = client.get("/files").json()["files"]
+        if sorted((f["folder_id"] or 0, f["filename"]) for f in listed) != sorted((f["folder_id"] or 0, f["filename"]) for f in lines):
+            print("   ✗ JSON の一覧と一致しません")
+            return False
+        print("   ✓ 一致しました")
+
+        print("\n🎉 すべてのテストが成功しました！")
+        return True
+
+    except Exception as e:
+        print(f"\n❌ テスト中にエラーが発生しました: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    success = asyncio.run(test_ndjson_listing())
+    sys.exit(0 if success else 1)
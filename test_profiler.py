@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+リクエストプロファイラーのテストスクリプト
+"""
+import sys
+import tempfile
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from fastapi import FastAPI, Depends
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from app.database import get_db, engine
+from app.profiling import ProfilerMiddleware, ProfileStore, install_sql_hooks, PROFILE_ID_HEADER
+
+def create_app(store: ProfileStore) -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(ProfilerMiddleware, profile_store=store, token="test-token", sample_rate=0)
+
+    @app.get("/slow")
+    def slow(db=Depends(get_db)):
+        db.execute(text("SELECT 1")).scalar()
+        db.execute(text("SELECT 2")).scalar()
+        return {"ok": True}
+
+    return app
+
+def test_profiler():
+    """リクエストプロファイラーのテスト"""
+    print("リクエストプロファイラーのテストを開始します...")
+
+    install_sql_hooks(engine)
+    store = ProfileStore(Path(tempfile.mkdtemp()), max_reports=2)
+    client = TestClient(create_app(store))
+
+    # トークンなしでは計測しない
+    print("1. トークンのないリクエストは計測しないことを確認...")
+    response = client.get("/slow", headers={"X-Profile": "wrong"})
+    if PROFILE_ID_HEADER in response.headers or store.list():
+        print("   ✗ トークンなしで計測されました")
+        return False
+    print("   ✓ 計測されませんでした")
+
+    # トークン付きで計測
+    print("2. トークン付きのリクエストを計測...")
+    response = client.get("/slow", headers={"X-Profile": "test-token"})
+    profile_id = response.headers.get(PROFILE_ID_HEADER)
+    report = store.get(profile_id) if profile_id else None
+    if report is None:
+        print("   ✗ レポートが保存されていません")
+        return False
+    statements = [s["sql"] for s in report["sql"]["statements"]]
+    if statements != ["SELECT 1", "SELECT 2"] or not report["profile"]["functions"]:
+        print(f"   ✗ レポートの内容が不正です: {statements}")
+        return False
+    print(f"   ✓ SQL {report['sql']['count']} 件と関数ごとの時間が記録されました")
+
+    # 件数の上限
+    print("3. 上限を超えたレポートは古いものから削除されることを確認...")
+    for _ in range(3):
+        client.get("/slow", headers={"X-Profile": "test-token"})
+    reports = store.list()
+    if len(reports) != 2 or store.get(profile_id) is not None:
+        print(f"   ✗ 保存件数が不正です: {len(reports)}")
+        return False
+    print("   ✓ 最新の2件だけが保存されています")
+
+    print("\n🎉 すべてのテストが成功しました！")
+    return True
+
+if __name__ == "__main__":
+    success = test_profiler()
+    sys.exit(0 if success else 1)
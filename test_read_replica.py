@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+読み取りレプリカへの振り分けのテストスクリプト
+
+READ_REPLICA_URL が未設定の場合は一時的なSQLiteファイルをレプリカとして使う
+（レプリケーションは行わないため、プライマリへの書き込みはレプリカに見えない）。
+"""
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+os.environ.setdefault(
+    "READ_REPLICA_URL",
+    f"sqlite:///{Path(tempfile.gettempdir()) / 'fvm_test_replica.db'}"
+)
+
+# プロジェクトルートをPythonパスに追加
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+from app.database import (
+    Base, get_read_db, create_tables, read_engine, is_replica_session,
+    mark_primary_sticky, PRIMARY_STICKY_COOKIE, PRIMARY_STICKY_HEADER
+)
+from app.services import FileVersionService
+import asyncio
+
+def make_request(headers: dict = None) -> Request:
+    raw_headers = [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]
+    return Request({"type": "http", "method": "GET", "path": "/files", "headers": raw_headers})
+
+async def test_read_replica():
+    """読み取りレプリカへの振り分けのテスト"""
+    print("読み取りレプリカへの振り分けのテストを開始します...")
+
+    # プライマリとレプリカの両方にテーブルを作成
+    create_tables()
+    Base.metadata.create_all(bind=read_engine)
+
+    filename = f"replica_test_{int(time.time())}.txt"
+
+    # プライマリに書き込み
+    print("1. プライマリにファイルを作成...")
+    primary_gen = get_read_db(make_request({PRIMARY_STICKY_HEADER: "1"}))
+    primary_db = next(primary_gen)
+    try:
+        await FileVersionService.save_file_version(
+            db=primary_db,
+            filename=filename,
+            file_content=b"replica test",
+            memo="レプリカテスト用ファイル",
+            operation="create",
+            mime_type="text/plain"
+        )
+        if is_replica_session(primary_db):
+            print("   ✗ ヘッダー指定時にレプリカが使われています")
+            return False
+        print("   ✓ ヘッダー指定時はプライマリが使われました")
+    finally:
+        primary_gen.close()
+
+    # 通常の読み取りはレプリカへ
+    print("2. 通常の読み取りがレプリカへ振り分けられることを確認...")
+    replica_gen = get_read_db(make_request())
+    replica_db = next(replica_gen)
+    try:
+        if not is_replica_session(replica_db):
+            print("   ✗ レプリカが使われていません")
+            return False
+        if FileVersionService.get_file_versions(replica_db, filename):
+            print("   ✗ レプリカから未複製のファイルが見えています")
+            return False
+        print("   ✓ レプリカから読み取りました（未複製のファイルは見えない）")
+    finally:
+        replica_gen.close()
+
+    # 書き込み後のCookieでプライマリに固定される
+    print("3. 書き込み後のCookieでプライマリから読めることを確認...")
+    response = Response()
+    mark_primary_sticky(response)
+    cookie = response.headers["set-cookie"].split(";")[0]
+    sticky_gen = get_read_db(make_request({"Cookie": cookie}))
+    sticky_db = next(sticky_gen)
+    try:
+        if is_replica_session(sticky_db) or not FileVersionService.get_file_versions(sticky_db, filename):
+            print("   ✗ 書き込み直後のクライアントが自分の書き込みを読めません")
+            return False
+        print("   ✓ 書き込み直後のクライアントはプライマリから読み取りました")
+    finally:
+        sticky_gen.close()
+
+    # 期限切れのCookieはレプリカへ
+    print("4. 期限切れのCookieではレプリカへ戻ることを確認...")
+    expired_gen = get_read_db(make_request({"Cookie": f"{PRIMARY_STICKY_COOKIE}={time.time() - 1}"}))
+    expired_db = next(expired_gen)
+    try:
+        if not is_replica_session(expired_db):
+            print("   ✗ 期限切れのCookieでもプライマリが使われています")
+            return False
+        print("   ✓ レプリカへ戻りました")
+    finally:
+        expired_gen.close()
+
+    print("\n🎉 すべてのテストが成功しました！")
+    return True
+
+if __name__ == "__main__":
+    success = asyncio.run(test_read_replica())
+    sys.exit(0 if success else 1)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+再開可能なチャンクアップロード（/uploads）のテストスクリプト
+"""
+import sys
+import time
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from fastapi.testclient import TestClient
+from app.database import create_tables, SessionLocal
+from app.services import FileVersionService
+from app.uploads import UploadSessionService
+from app.main import app
+import asyncio
+
+async def _slow_chunks(data: bytes, pieces: int = 4):
+    """少しずつ届くリクエストボディを模擬する"""
+    size = len(data) // pieces + 1
+    for start in range(0, len(data), size):
+        await asyncio.sleep(0.01)
+        yield data[start:start + size]
+
+async def test_resumable_upload():
+    """再開可能なチャンクアップロードのテスト"""
+    print("チャンクアップロードのテストを開始します...")
+
+    # テーブルを作成
+    create_tables()
+
+    client = TestClient(app)
+    filename = f"resumable_test_{int(time.time())}.bin"
+    chunks = [b"a" * 1000, b"b" * 1000, b"c" * 500]
+    total_size = sum(len(chunk) for chunk in chunks)
+
+    try:
+        print("1. セッションを作成して最初のチャンクを送信...")
+        response = client.post("/uploads", data={"filename": filename, "total_size": str(total_size)})
+        upload_id = response.json()["upload_id"]
+        response = client.put(f"/uploads/{upload_id}/chunks/0?offset=0", content=chunks[0])
+        if response.status_code != 200 or response.json()["offset"] != 1000 or response.json()["next_chunk"] != 1:
+            print(f"   ✗ 応答が不正です: {response.status_code} {response.text}")
+            return False
+        print("   ✓ オフセット 1000 まで受信されました")
+
+        print("2. 受信済みチャンクの再送は無視されることを確認...")
+        response = client.put(f"/uploads/{upload_id}/chunks/0?offset=0", content=b"x" * 1000)
+        if response.status_code != 200 or response.json()["offset"] != 1000:
+            print(f"   ✗ 再送が受け付けられました: {response.text}")
+            return False
+        print("   ✓ 再送は無視されました")
+
+        print("3. オフセットが一致しないチャンクは409...")
+        response = client.put(f"/uploads/{upload_id}/chunks/1?offset=1500", content=chunks[1])
+        if response.status_code != 409 or response.json()["offset"] != 1000 or response.json()["next_chunk"] != 1:
+            print(f"   ✗ 応答が不正です: {response.status_code} {response.text}")
+            return False
+        print("   ✓ 現在のオフセット（1000）が返されました")
+
+        print("4. 同じチャンクの同時送信で一時ファイルが壊れないことを確認...")
+        sessions = [SessionLocal(), SessionLocal()]
+        try:
+            uploads = [UploadSessionService.get_session(db, upload_id) for db in sessions]
+            # 2つ目は内容の異なる再送（先に届いた方だけが書き込まれるべき）
+            await asyncio.gather(*(
+                UploadSessionService.append_chunk(db, upload, 1, 1000, _slow_chunks(data))
+                for db, upload, data in zip(sessions, uploads, (chunks[1], b"z" * 300))
+            ))
+        finally:
+            for db in sessions:
+                db.close()
+        staged = UploadSessionService.staging_path(upload_id).read_bytes()
+        if staged != chunks[0] + chunks[1] or client.get(f"/uploads/{upload_id}").json()["offset"] != 2000:
+            print(f"   ✗ 一時ファイルの内容が不正です: {len(staged)} バイト")
+            return False
+        print("   ✓ 2つ目のリクエストは再送として扱われ、内容は正しく保たれました")
+
+        print("5. 宣言サイズを超えるチャンクは413...")
+        response = client.put(f"/uploads/{upload_id}/chunks/2?offset=2000", content=b"c" * 600)
+        if response.status_code != 413 or client.get(f"/uploads/{upload_id}").json()["offset"] != 2000:
+            print(f"   ✗ 応答が不正です: {response.status_code} {response.text}")
+            return False
+        print("   ✓ 拒否され、オフセットは変わりませんでした")
+
+        print("6. 受信が終わる前の確定は400...")
+        response = client.post(f"/uploads/{upload_id}/complete")
+        if response.status_code != 400:
+            print(f"   ✗ 応答が不正です: {response.status_code} {response.text}")
+            return False
+        print("   ✓ 確定は拒否されました")
+
+        print("7. 最後のチャンクを送信して確定...")
+        response = client.put(f"/uploads/{upload_id}/chunks/2?offset=2000", content=chunks[2])
+        if response.status_code != 200 or response.json()["offset"] != total_size:
+            print(f"   ✗ 応答が不正です: {response.status_code} {response.text}")
+            return False
+        response = client.post(f"/uploads/{upload_id}/complete")
+        if response.status_code != 200 or response.json()["version"] != 1:
+            print(f"   ✗ 確定に失敗しました: {response.status_code} {response.text}")
+            return False
+        db = SessionLocal()
+        try:
+            version = FileVersionService.get_file_version(db, filename, 1)
+            if version.file_content != b"".join(chunks):
+                print("   ✗ 保存された内容が一致しません")
+                return False
+        finally:
+            db.close()
+        if client.get(f"/uploads/{upload_id}").status_code != 404 or UploadSessionService.staging_path(upload_id).exists():
+            print("   ✗ 確定後もセッションまたは一時ファイルが残っています")
+            return False
+        print("   ✓ バージョン1として保存され、セッションは削除されました")
+
+        print("\n🎉 すべてのテストが成功しました！")
+        return True
+
+    except Exception as e:
+        print(f"\n❌ テスト中にエラーが発生しました: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+if __name__ == "__main__":
+    success = asyncio.run(test_resumable_upload())
+    sys.exit(0 if success else 1)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+サーバー内での復元・コピー・移動・名前変更のテストスクリプト
+"""
+import sys
+import time
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from app.database import get_db, create_tables
+from app.services import FileVersionService, FolderService, FileConflictError
+import asyncio
+
+async def test_server_side_copy():
+    """サーバー内での復元・コピー・移動・名前変更のテスト"""
+    print("サーバー内での復元・コピー・移動・名前変更のテストを開始します...")
+
+    # テーブルを作成
+    create_tables()
+
+    # データベースセッションを取得
+    db = next(get_db())
+    filename = f"copy_test_{int(time.time())}.txt"
+
+    try:
+        source_folder = FolderService.create_folder(db, "コピー元フォルダ")
+        target_folder = FolderService.create_folder(db, "コピー先フォルダ")
+
+        for i in range(3):
+            await FileVersionService.save_file_version(
+                db=db,
+                filename=filename,
+                file_content=f"内容 {i}".encode('utf-8'),
+                memo=f"バージョン {i + 1}",
+                operation="create" if i == 0 else "update",
+                folder_id=source_folder.id,
+                mime_type="text/plain"
+            )
+
+        # 復元
+        print("1. バージョン1を最新版として復元...")
+        source = FileVersionService.get_version_metadata(db, filename, source_folder.id, 1)
+        _, new_version, operation, created = await FileVersionService.save_version_from(
+            db, source.id, filename, source_folder.id, "復元"
+        )
+        restored = FileVersionService.get_file_version(db, filename, new_version, source_folder.id)
+        if not created or new_version != 4 or restored.file_content != "内容 0".encode('utf-8'):
+            print(f"   ✗ 復元結果が不正です: version={new_version}, created={created}")
+            return False
+        if len(FileVersionService.get_file_versions(db, filename, source_folder.id)) != 3:
+            print("   ✗ 復元後の保持数が通常のアップロードと一致しません")
+            return False
+        print(f"   ✓ バージョン{new_version}として復元しました（保持数 3）")
+
+        # 同一内容のコピーはスキップ
+        print("2. 最新版と同一内容の復元はスキップされることを確認...")
+        head = FileVersionService.get_version_metadata(db, filename, source_folder.id)
+        _, _, operation, created = await FileVersionService.save_version_from(
+            db, head.id, filename, source_folder.id
+        )
+        if created or operation != "unchanged":
+            print("   ✗ 同一内容なのに新しいバージョンが作成されました")
+            return False
+        print("   ✓ 新しいバージョンは作成されませんでした")
+
+        # コピー
+        print("3. 別のフォルダへコピー...")
+        _, copied_version, operation, created = await FileVersionService.save_version_from(
+            db, head.id, filename, target_folder.id, "コピー"
+        )
+        if not created or copied_version != 1 or operation != "create":
+            print(f"   ✗ コピー結果が不正です: version={copied_version}, operation={operation}")
+            return False
+        print("   ✓ コピー先にバージョン1が作成されました")
+
+        # 移動先に同名ファイルがある場合は競合
+        print("4. 同名ファイルがあるフォルダへの移動は競合になることを確認...")
+        try:
+            FileVersionService.relocate_file(db, filename, source_folder.id, target_folder.id, filename)
+            print("   ✗ 競合が検出されませんでした")
+            return False
+        except FileConflictError:
+            print("   ✓ 競合が検出されました")
+
+        # 名前変更と移動
+        print("5. 名前を変更してから移動...")
+        renamed = f"renamed_{filename}"
+        moved = FileVersionService.relocate_file(db, filename, source_folder.id, source_folder.id, renamed)
+        moved_again = FileVersionService.relocate_file(db, renamed, source_folder.id, target_folder.id, renamed)
+        versions = FileVersionService.get_file_versions(db, renamed, target_folder.id)
+        if moved != 3 or moved_again != 3 or [v.version for v in versions] != [4, 3, 2]:
+            print(f"   ✗ 移動結果が不正です: {[v.version for v in versions]}")
+            return False
+        db.refresh(source_folder)
+        db.refresh(target_folder)
+        if source_folder.file_count != 0 or target_folder.file_count != 2:
+            print(f"   ✗ 集計値が不正です: {source_folder.file_count}, {target_folder.file_count}")
+            return False
+        print("   ✓ バージョン番号を保ったまま移動し、集計値も更新されました")
+
+        # コピー元が存在しない場合
+        print("6. 存在しないバージョンからのコピーはエラーになることを確認...")
+        try:
+            await FileVersionService.save_version_from(db, 10 ** 9, filename, target_folder.id)
+            print("   ✗ エラーになりませんでした")
+            return False
+        except ValueError:
+            db.rollback()
+            print("   ✓ ValueError が発生しました")
+
+        print("\n🎉 すべてのテストが成功しました！")
+        return True
+
+    except Exception as e:
+        print(f"\n❌ テスト中にエラーが発生しました: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    success = asyncio.run(test_server_side_copy())
+    sys.exit(0 if success else 1)
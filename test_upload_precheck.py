@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+アップロードの事前確認（/files/precheck）と同一内容のアップロード抑止のテストスクリプト
+"""
+import sys
+import time
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from app.database import get_db, create_tables, engine, FileVersion
+from app.services import FileVersionService
+from app.main import app
+import asyncio
+
+async def test_upload_precheck():
+    """事前確認と同一内容のアップロード抑止のテスト"""
+    print("アップロードの事前確認のテストを開始します...")
+
+    # テーブルを作成
+    create_tables()
+
+    # データベースセッションを取得
+    db = next(get_db())
+    client = TestClient(app)
+    filename = f"precheck_test_{int(time.time())}.txt"
+    content = "事前確認の内容".encode("utf-8")
+    sha256 = FileVersionService.compute_hash(content)
+
+    def versions():
+        db.expire_all()
+        return db.query(FileVersion).filter(FileVersion.filename == filename).count()
+
+    try:
+        print("1. 未登録のファイルは送信が必要...")
+        response = client.post("/files/precheck", data={"filename": filename, "size": str(len(content)), "sha256": sha256})
+        if response.json()["status"] != "upload_required":
+            print(f"   ✗ 応答が不正です: {response.text}")
+            return False
+        print("   ✓ upload_required が返されました")
+
+        print("2. アップロード後の同一内容は送信不要...")
+        client.post("/files/upload", files={"file": (filename, content, "text/plain")})
+        response = client.post("/files/precheck", data={"filename": filename, "size": str(len(content)), "sha256": sha256.upper()})
+        if response.json()["status"] != "unchanged" or response.json()["version"] != 1:
+            print(f"   ✗ 応答が不正です: {response.text}")
+            return False
+        response = client.post("/files/precheck", data={"filename": filename, "size": str(len(content) + 1), "sha256": sha256})
+        if response.json()["status"] != "upload_required":
+            print(f"   ✗ サイズが異なるのに送信不要と判定されました: {response.text}")
+            return False
+        print("   ✓ 同一内容のみ unchanged と判定されました")
+
+        print("3. 同一内容のアップロードでは新しいバージョンを作らない...")
+        response = client.post("/files/upload", files={"file": (filename, content, "text/plain")})
+        if not response.json().get("unchanged") or versions() != 1:
+            print(f"   ✗ 新しいバージョンが作成されました: {response.text}")
+            return False
+        response = client.post("/files/upload", files={"file": (filename, content, "text/plain")}, data={"force": "true"})
+        if response.json().get("version") != 2 or versions() != 2:
+            print(f"   ✗ force 指定でバージョンが作成されませんでした: {response.text}")
+            return False
+        print("   ✓ 通常は抑止され、force 指定時のみバージョン2が作成されました")
+
+        print("4. ハッシュ未計算のバージョンとも比較でき、判定では書き込まないことを確認...")
+        db.query(FileVersion).filter(FileVersion.filename == filename).update({"content_hash": None})
+        db.commit()
+        statements = []
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith(("UPDATE", "INSERT")):
+                statements.append(statement)
+        event.listen(engine, "before_cursor_execute", capture)
+        try:
+            response = client.post("/files/precheck", data={"filename": filename, "size": str(len(content)), "sha256": sha256})
+        finally:
+            event.remove(engine, "before_cursor_execute", capture)
+        if response.json()["status"] != "unchanged":
+            print(f"   ✗ 応答が不正です: {response.text}")
+            return False
+        if statements:
+            print(f"   ✗ 事前確認で書き込みが行われました: {statements}")
+            return False
+        db.expire_all()
+        head = FileVersionService.get_latest_version(db, filename)
+        if head.content_hash is not None:
+            print("   ✗ ハッシュが保存されています（バックフィルに任せるべき）")
+            return False
+        print("   ✓ その場で計算して比較し、保存は行いませんでした")
+
+        print("\n🎉 すべてのテストが成功しました！")
+        return True
+
+    except Exception as e:
+        print(f"\n❌ テスト中にエラーが発生しました: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    success = asyncio.run(test_upload_precheck())
+    sys.exit(0 if success else 1)
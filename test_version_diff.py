@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+バージョン間の差分（/files/{filename}/diff）のテストスクリプト
+"""
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from fastapi.testclient import TestClient
+from app.database import get_db, create_tables
+from app.services import FileVersionService
+from app import diffs
+from app.diffs import DiffService
+from app.main import app
+import asyncio
+
+async def _save(db, filename: str, content: bytes, mime_type: str):
+    return await FileVersionService.save_file_version(
+        db=db, filename=filename, file_content=content, memo=None,
+        operation=FileVersionService.detect_operation(db, filename, None), mime_type=mime_type, force=False
+    )
+
+async def test_version_diff():
+    """バージョン間の差分のテスト"""
+    print("差分のテストを開始します...")
+
+    # テーブルを作成
+    create_tables()
+
+    # データベースセッションを取得
+    db = next(get_db())
+    client = TestClient(app)
+    prefix = f"diff_test_{int(time.time())}"
+    text_name = f"{prefix}.txt"
+
+    # 差分を計算したスレッドと、そこでイベントループが動いていたかを記録する
+    threads = []
+    on_event_loop = []
+    original_compute_diff = diffs.compute_diff
+    def recording_compute_diff(*args, **kwargs):
+        threads.append(threading.current_thread())
+        try:
+            asyncio.get_running_loop()
+            on_event_loop.append(True)
+        except RuntimeError:
+            on_event_loop.append(False)
+        return original_compute_diff(*args, **kwargs)
+    diffs.compute_diff = recording_compute_diff
+
+    try:
+        print("1. テキストの差分（unified / lines）...")
+        await _save(db, text_name, "1行目\n2行目\n3行目\n".encode("utf-8"), "text/plain")
+        await _save(db, text_name, "1行目\n2行目を変更\n3行目\n4行目\n".encode("utf-8"), "text/plain")
+        response = client.get(f"/files/{text_name}/diff?from=1&to=2")
+        body = response.json()
+        if response.status_code != 200 or body["type"] != "text" or body["added"] != 2 or body["removed"] != 1:
+            print(f"   ✗ 応答が不正です: {response.status_code} {response.text}")
+            return False
+        if "+2行目を変更\n" not in body["diff"] or "-2行目\n" not in body["diff"]:
+            print(f"   ✗ unified 形式の差分が不正です: {body['diff']}")
+            return False
+        body = client.get(f"/files/{text_name}/diff?from=1&to=2&format=lines").json()
+        if [change["op"] for change in body["changes"]] != ["replace", "insert"]:
+            print(f"   ✗ lines 形式の差分が不正です: {body['changes']}")
+            return False
+        if client.get(f"/files/{text_name}/diff?from=1&to=2&format=html").status_code != 400:
+            print("   ✗ 不正な形式が拒否されていません")
+            return False
+        print("   ✓ 追加2行・削除1行の差分が返されました")
+
+        print("2. 小さな差分はイベントループ外のスレッドで計算されることを確認...")
+        if not threads or any(on_event_loop):
+            print(f"   ✗ イベントループのスレッドで計算されました: {threads}")
+            return False
+        print(f"   ✓ {threads[0].name} で計算されました")
+
+        print("3. 同じ組み合わせはキャッシュから返されることを確認...")
+        computed = len(threads)
+        response = client.get(f"/files/{text_name}/diff?from=1&to=2")
+        if response.status_code != 200 or len(threads) != computed:
+            print("   ✗ 再計算されました")
+            return False
+        client.get(f"/files/{text_name}/diff?from=1&to=2&context=0")
+        if len(threads) != computed + 1:
+            print("   ✗ 前後行数が異なるのにキャッシュが使われました")
+            return False
+        print("   ✓ 同じ条件はキャッシュから、条件が異なる場合は再計算されました")
+
+        print("4. バイナリやUTF-8でない内容は概要を返す...")
+        binary_name = f"{prefix}.bin"
+        await _save(db, binary_name, b"\x00\x01\x02", "application/octet-stream")
+        await _save(db, binary_name, b"\x00\x01\x02\x03", "application/octet-stream")
+        body = client.get(f"/files/{binary_name}/diff?from=1&to=2").json()
+        if body["type"] != "binary" or body["size_delta"] != 1 or body["identical"]:
+            print(f"   ✗ バイナリの概要が不正です: {body}")
+            return False
+        latin_name = f"{prefix}_latin1.txt"
+        await _save(db, latin_name, "café\n".encode("latin-1"), "text/plain")
+        await _save(db, latin_name, "cafe\n".encode("latin-1"), "text/plain")
+        body = client.get(f"/files/{latin_name}/diff?from=1&to=2").json()
+        if body["type"] != "binary":
+            print(f"   ✗ UTF-8でないテキストが行差分として扱われました: {body}")
+            return False
+        print("   ✓ サイズとハッシュの概要が返されました")
+
+        print("5. 大きな差分はワーカープールで計算されることを確認...")
+        # 記録用の関数はプロセスへ渡せないため、プールはスレッドで代用し、取得されたことを確認する
+        pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="diff-test-pool")
+        pool_requests = []
+        original_get_process_pool = diffs.get_process_pool
+        def spy_get_process_pool():
+            pool_requests.append(True)
+            return pool
+        saved_threshold = diffs.DIFF_POOL_THRESHOLD
+        diffs.DIFF_POOL_THRESHOLD = 16
+        diffs.get_process_pool = spy_get_process_pool
+        DiffService._cache.clear()
+        try:
+            threads.clear()
+            response = client.get(f"/files/{text_name}/diff?from=1&to=2")
+        finally:
+            diffs.DIFF_POOL_THRESHOLD = saved_threshold
+            diffs.get_process_pool = original_get_process_pool
+            pool.shutdown()
+        if response.status_code != 200 or not pool_requests or not threads or not threads[0].name.startswith("diff-test-pool"):
+            print(f"   ✗ ワーカープールで計算されていません: {threads}")
+            return False
+        print("   ✓ ワーカープールで計算されました")
+
+        print("\n🎉 すべてのテストが成功しました！")
+        return True
+
+    except Exception as e:
+        print(f"\n❌ テスト中にエラーが発生しました: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+    finally:
+        diffs.compute_diff = original_compute_diff
+        db.close()
+
+if __name__ == "__main__":
+    success = asyncio.run(test_version_diff())
+    sys.exit(0 if success else 1)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+複数ファイルのバージョン履歴の一括取得のテストスクリプト
+"""
+import sys
+import time
+from pathlib import Path
+
+# プロジェクトルートをPythonパスに追加
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from app.database import get_db, create_tables, engine
+from app.services import FileVersionService, FolderService
+from app.main import app
+import asyncio
+
+async def test_versions_batch():
+    """複数ファイルのバージョン履歴の一括取得のテスト"""
+    print("バージョン履歴の一括取得のテストを開始します...")
+
+    # テーブルを作成
+    create_tables()
+
+    # データベースセッションを取得
+    db = next(get_db())
+    client = TestClient(app)
+    prefix = f"batch_test_{int(time.time())}"
+
+    try:
+        folder = FolderService.create_folder(db, f"一括取得_{prefix}")
+        names = [f"{prefix}_{i}.txt" for i in range(20)]
+        for name in names:
+            for version in range(2):
+                await FileVersionService.save_file_version(
+                    db=db,
+                    filename=name,
+                    file_content=f"{name} {version}".encode('utf-8'),
+                    memo=f"バージョン {version + 1}",
+                    operation="create" if version == 0 else "update",
+                    folder_id=folder.id,
+                    mime_type="text/plain"
+                )
+        # 同じ名前のファイルをルートにも置く（フォルダの区別を確認）
+        await FileVersionService.save_file_version(
+            db=db, filename=names[0], file_content=b"root", memo=None, operation="create"
+        )
+
+        print("1. 指定したファイルの履歴を1回のクエリで取得...")
+        requested = [{"filename": name, "folder_id": folder.id} for name in names] + [
+            {"filename": names[0]},
+            {"filename": f"{prefix}_missing.txt", "folder_id": folder.id}
+        ]
+        statements = []
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            if "file_versions" in statement:
+                statements.append(statement)
+        event.listen(engine, "before_cursor_execute", count_statement)
+        try:
+            response = client.post("/files/versions/batch", json={"files": requested})
+        finally:
+            event.remove(engine, "before_cursor_execute", count_statement)
+
+        files = response.json()["files"]
+        if response.status_code != 200 or len(files) != len(requested):
+            print(f"   ✗ 応答が不正です: {response.status_code}")
+            return False
+        if [f["filename"] for f in files] != [r["filename"] for r in requested]:
+            print("   ✗ 指定した順に返されていません")
+            return False
+        first = files[0]["versions"]
+        if [v["version"] for v in first] != [2, 1] or first[0]["memo"] != "バージョン 2" or "file_content" in first[0]:
+            print(f"   ✗ 履歴の内容が不正です: {first}")
+            return False
+        if len(files[-2]["versions"]) != 1 or files[-2]["folder_id"] is not None or files[-1]["versions"]:
+            print("   ✗ ルートのファイル・存在しないファイルの扱いが不正です")
+            return False
+        if len(statements) != 1 or "file_content" in statements[0]:
+            print(f"   ✗ 履歴の取得が1クエリではないか、コンテンツを読み込んでいます: {len(statements)}")
+            return False
+        print(f"   ✓ {len(requested)} ファイルの履歴を1クエリで取得しました")
+
+        print("2. フォルダ内の全ファイルの履歴を取得...")
+        response = client.post("/files/versions/batch", json={"folder_id": folder.id})
+        files = response.json()["files"]
+        if response.status_code != 200 or sorted(f["filename"] for f in files) != sorted(names):
+            print(f"   ✗ フォルダ内のファイルが一致しません: {response.status_code}")
+            return False
+        if any(len(f["versions"]) != 2 for f in files):
+            print("   ✗ 各ファイルの履歴が不足しています")
+            return False
+        print(f"   ✓ フォルダ内の {len(files)} ファイルの履歴を取得しました")
+
+        print("3. 指定した組に含まれない行は取得しないことを確認...")
+        other = FolderService.create_folder(db, f"一括取得_別_{prefix}")
+        await FileVersionService.save_file_version(
+            db=db, filename=names[1], file_content=b"other", memo=None, operation="create", folder_id=other.id
+        )
+        captured = []
+        def capture_statement(conn, cursor, statement, parameters, context, executemany):
+            if "FROM file_versions" in statement:
+                captured.append((statement, parameters))
+        event.listen(engine, "before_cursor_execute", capture_statement)
+        try:
+            histories = FileVersionService.get_versions_batch(db, [(folder.id, names[0]), (other.id, names[1])])
+        finally:
+            event.remove(engine, "before_cursor_execute", capture_statement)
+        # フォルダとファイル名を別々に絞り込むと (folder, names[1]) と (other, names[0]) の行も取得される
+        with engine.connect() as connection:
+            fetched = connection.exec_driver_sql(*captured[-1]).fetchall()
+        if len(fetched) != 3 or sorted(histories) != sorted([(folder.id, names[0]), (other.id, names[1])]):
+            print(f"   ✗ 指定していない組の行も取得されました: {len(fetched)} 行")
+            return False
+        print(f"   ✓ 指定した組の {len(fetched)} 行だけを取得しました")
+
+        print("4. 存在しないフォルダは404...")
+        response = client.post("/files/versions/batch", json={"folder_id": 10 ** 9})
+        if response.status_code != 404:
+            print(f"   ✗ ステータスが不正です: {response.status_code}")
+            return False
+        print("   ✓ 404が返されました")
+
+        print("\n🎉 すべてのテストが成功しました！")
+        return True
+
+    except Exception as e:
+        print(f"\n❌ テスト中にエラーが発生しました: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    success = asyncio.run(test_versions_batch())
+    sys.exit(0 if success else 1)